@@ -14,12 +14,83 @@ emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵
 # %%
 import pandas as pd
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import as_completed
 from tqdm import tqdm
 
+from utils.parallelutils import get_worker_pool
+from utils.timeutils import trading_day_numbers
+from utils.rollutils import (segmented_rolling_sum, segmented_rolling_mean, segmented_rolling_mean_multi,
+                             segmented_ewma_multi, segmented_rolling_min, segmented_rolling_max)
+
+
+# %% 分段
+class SegmentIndex:
+    """
+    时间索引的分段结果，供各日内算子共用：同一面板的分段只计算一次，
+    之后每个算子、每组参数都直接使用各段的起止行号，不再逐行生成date对象并groupby
+    
+    Parameters:
+    -----------
+    index : pd.DatetimeIndex
+        升序的时间索引
+    by_day : bool
+        是否在交易日变化处开始新的一段：夜盘（不早于 utils.timeutils.NIGHT_SESSION_START）计入下一交易日，
+        与合并面板的交易日划分（trading_day_row_offsets）一致；只有日盘时与按 index.date 分组一致
+    reset_times : list or None
+        重置时刻，如 ['10:01', '13:01']，处于该时刻的行开始新的一段
+    freq : str or None
+        相邻时间戳间隔超过freq时开始新的一段，同 _detect_breaks
+    """
+    
+    def __init__(self, index, by_day=True, reset_times=None, freq=None):
+        index = pd.DatetimeIndex(index)
+        stamps = np.asarray(index, dtype='datetime64[ns]').view(np.int64)
+        n_rows = len(stamps)
+        
+        breaks = np.zeros(n_rows, dtype=bool)
+        breaks[:1] = True
+        if by_day:
+            days = trading_day_numbers(stamps.view('datetime64[ns]'))
+            breaks[1:] |= days[1:] != days[:-1]
+        if reset_times is not None:
+            # 重置时刻为当日时钟时刻，相对自然日零点计算
+            midnights = np.asarray(index.normalize(), dtype='datetime64[ns]').view(np.int64)
+            reset_offsets = [(t - t.normalize()).value for t in pd.to_datetime(reset_times)]
+            breaks |= np.isin(stamps - midnights, reset_offsets)
+        if freq is not None:
+            breaks |= _detect_breaks(index, freq)
+        
+        self.n_rows = n_rows
+        self.starts = np.flatnonzero(breaks).astype(np.int64)
+        self.ends = np.append(self.starts[1:], n_rows).astype(np.int64)
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    @property
+    def segment_ids(self):
+        """
+        每行所属分段的编号
+        """
+        return np.repeat(np.arange(len(self.starts)), self.ends - self.starts)
+    
+    def check(self, index):
+        if len(index) != self.n_rows:
+            raise ValueError(f'分段的行数 {self.n_rows} 与数据的行数 {len(index)} 不一致')
+
+
+def _resolve_segments(index, segments=None, **kwargs):
+    """
+    使用调用方传入的共用分段，未传入时按算子默认的方式为该索引计算分段
+    """
+    if segments is None:
+        return SegmentIndex(index, **kwargs)
+    segments.check(index)
+    return segments
+
 
 # %%
-def OAD(df, reference_time='0930', columns=None):
+def OAD(df, reference_time='0930', columns=None, segments=None):
     """
     Calculate differences between each time point and a reference time for specified columns.
     
@@ -31,6 +102,9 @@ def OAD(df, reference_time='0930', columns=None):
         Reference time in format 'HH:MM:SS' to compare against
     columns : list or None, default None
         List of columns to calculate differences for. If None, uses all columns in df.
+    segments : SegmentIndex or None, default None
+        Shared segmentation of df.index; reference values are carried forward within each segment.
+        If None, segments by trading day (night session rows belong to the next trading day).
     
     Returns:
     --------
@@ -38,8 +112,8 @@ def OAD(df, reference_time='0930', columns=None):
         DataFrame containing only the difference columns
     """
     
-    # Make a copy to avoid modifying the original
-    df = df.copy()
+    # Shallow copy: new columns and index are added to the copy only, the data is not duplicated
+    df = df.copy(deep=False)
     
     # Ensure index is datetime format
     if not isinstance(df.index, pd.DatetimeIndex):
@@ -58,11 +132,9 @@ def OAD(df, reference_time='0930', columns=None):
         ref_col_name = f"{col}_{reference_time.replace(':', '')}"
         df[ref_col_name] = np.where(df.index.time == ref_time, df[col], np.nan)
     
-    # Group by date and forward fill the reference values
-    df = df.groupby(df.index.date).apply(lambda x: x.fillna(method='ffill'))
-    
-    # Reset index (remove multi-level index)
-    df = df.reset_index(level=0, drop=True)
+    # Forward fill the reference values within each segment (by trading day unless given)
+    segments = _resolve_segments(df.index, segments)
+    df = df.groupby(segments.segment_ids).ffill()
     
     # Calculate differences
     diff_columns = []
@@ -82,16 +154,17 @@ def OAD(df, reference_time='0930', columns=None):
 
 
 # %% ma
-def intraSma(data, window: int):
+def intraSma(data, window: int, segments=None):
     """
     计算日内简单滑动窗口均值，确保每天的计算仅使用当天的数据。
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
         window (int): 滑动窗口的大小。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
         
     Returns:
-        与输入相同类型的日内滑动均值结果，结构与输入一致。
+        与输入相同类型的日内滑动均值结果（float64），结构与输入一致。
     """
     # 判断输入是DataFrame还是Series
     is_series = isinstance(data, pd.Series)
@@ -100,21 +173,14 @@ def intraSma(data, window: int):
     if is_series:
         df = data.to_frame()
     else:
-        df = data.copy()
-    
-    # 创建一个与输入相同结构的结果DataFrame
-    result = pd.DataFrame(index=df.index, columns=df.columns)
+        df = data.copy(deep=False)
     
-    # 根据日期对数据进行分组
-    grouped = df.groupby(df.index.date)
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df.index, segments)
     
-    # 对每一天的数据单独计算滑动平均
-    for date, group in grouped:
-        # 对当天的数据计算滑动平均
-        day_result = group.rolling(window=window, min_periods=1).mean()
-        
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+    # 在整个二维数组上一次完成各段的滑动平均，每段从段首重新开始
+    values = segmented_rolling_mean(df.to_numpy(dtype=np.float64), segments.starts, segments.ends, window)
+    result = pd.DataFrame(values, index=df.index, columns=df.columns)
     
     # 如果输入是Series，则返回Series，否则返回DataFrame
     if is_series:
@@ -122,71 +188,101 @@ def intraSma(data, window: int):
     else:
         return result
 
-def intraEwma(data, span: int):
+def intraSma_multi(data, windows, segments=None, exact=False):
     """
-    计算日内指数加权移动平均(EWMA)，确保每天的计算仅使用当天的数据。
+    一次计算多个窗口的日内简单滑动均值：分段只计算一次，每段做一次带补偿的前缀和，
+    每个窗口由前缀相减得到，增加窗口几乎不增加计算；与intraSma的差异约为 2 × 2.2e-16 × |窗口和|。
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
-        span (int): 指数加权的周期数，类似于半衰期。
+        windows (list): 滑动窗口大小的列表，如 [5, 10, 15, 30, 60]。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
+        exact (bool): 为True时每个窗口的结果与逐个调用intraSma逐位一致，计算量随窗口数线性增加。
         
     Returns:
-        与输入相同类型的日内指数加权移动平均结果，结构与输入一致。
+        dict: 窗口大小 -> 与输入相同类型的日内滑动均值结果（float64）。
     """
-    # 判断输入是DataFrame还是Series
     is_series = isinstance(data, pd.Series)
+    df = data.to_frame() if is_series else data.copy(deep=False)
     
-    # 如果是Series，转换为DataFrame处理，方便统一逻辑
-    if is_series:
-        df = data.to_frame()
-    else:
-        df = data.copy()
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df.index, segments)
     
-    # 创建一个与输入相同结构的结果DataFrame
-    result = pd.DataFrame(index=df.index, columns=df.columns)
+    # 形状为 (窗口数 × 行 × 列)
+    values = segmented_rolling_mean_multi(df.to_numpy(dtype=np.float64), segments.starts, segments.ends, windows,
+                                          exact=exact)
     
-    # 根据日期对数据进行分组
-    grouped = df.groupby(df.index.date)
+    results = {}
+    for window, window_values in zip(windows, values):
+        result = pd.DataFrame(window_values, index=df.index, columns=df.columns, copy=False)
+        results[window] = result.iloc[:, 0] if is_series else result
+    return results
+
+
+def _segmented_ewma_frames(df, spans, segments, is_series):
+    """
+    在整个二维数组上一次完成各段、各span的EWMA，每段从段首重新开始，返回 span -> 结果
+    """
+    values = segmented_ewma_multi(df.to_numpy(dtype=np.float64), segments.starts, segments.ends, spans)
+    results = {}
+    for span, span_values in zip(spans, values):
+        result = pd.DataFrame(span_values, index=df.index, columns=df.columns, copy=False)
+        results[span] = result.iloc[:, 0] if is_series else result
+    return results
+
+
+def intraEwma(data, span: int, segments=None):
+    """
+    计算日内指数加权移动平均(EWMA)，确保每天的计算仅使用当天的数据。
     
-    # 对每一天的数据单独计算EWMA
-    for date, group in grouped:
-        # 对当天的数据计算EWMA，adjust=True确保更准确的指数权重
-        day_result = group.ewm(span=span, min_periods=1, adjust=True).mean()
+    Args:
+        data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
+        span (int): 指数加权的周期数，类似于半衰期。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
         
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+    Returns:
+        与输入相同类型的日内指数加权移动平均结果（float64），结构与输入一致。
+    """
+    return intraEwma_multi(data, [span], segments)[span]
+
+
+def intraEwma_multi(data, spans, segments=None):
+    """
+    一次计算多个span的日内EWMA：逐列单次遍历，各span在同一次遍历中递推，结果与逐个调用intraEwma相同。
     
-    # 如果输入是Series，则返回Series，否则返回DataFrame
-    if is_series:
-        return result.iloc[:, 0]
-    else:
-        return result
+    Args:
+        data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
+        spans (list): span的列表，如 [10, 20, 30, 60, 120]。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
+        
+    Returns:
+        dict: span -> 与输入相同类型的日内EWMA结果（float64）。
+    """
+    is_series = isinstance(data, pd.Series)
+    df = data.to_frame() if is_series else data.copy(deep=False)
     
+    # 使用共用的分段（默认按交易日分段），adjust=True、min_periods=1，与逐段ewm().mean()一致
+    segments = _resolve_segments(df.index, segments)
+    return _segmented_ewma_frames(df, list(spans), segments, is_series)
     
-def intraResetSma(data, window: int | str, reset_times=None):
+    
+def intraResetSma(data, window: int | str, reset_times=None, segments=None):
     """
     终极优化版本：使用pandas的rolling和groupby的高级特性。
+    segments (SegmentIndex): 可选，共用的分段，默认按日期和reset_times分段，传入时忽略reset_times。
     """
     # 默认重置节点
     if reset_times is None:
         reset_times = ['10:01', '10:31', '11:01', '13:01', '13:31', '14:01', '14:31']
     
     is_series = isinstance(data, pd.Series)
-    df = data.to_frame() if is_series else data.copy()
-    
-    # 向量化创建segment标识
-    reset_times_set = set(pd.to_datetime(reset_times).time)
-    
-    # 创建MultiIndex用于分组
-    dates = df.index.date
-    times = df.index.time
+    df = data.to_frame() if is_series else data.copy(deep=False)
     
-    # 向量化标记重置点和日期变化
-    is_reset = pd.Series(times).isin(reset_times_set)
-    is_new_day = pd.Series(dates) != pd.Series(dates).shift(1)
+    # 在日期变化和重置节点处分段
+    segments = _resolve_segments(df.index, segments, reset_times=reset_times)
     
     # 创建segment分组
-    segment_breaks = pd.Series((is_reset | is_new_day).cumsum().values, index=df.index)
+    segment_breaks = pd.Series(segments.segment_ids, index=df.index)
     
     # 使用groupby + rolling的组合进行超高速计算
     def fast_segment_rolling(group):
@@ -254,7 +350,7 @@ def _create_groups_by_freq(index, freq):
     return group_ids
 
 
-def intraTEwma(data, span: int, freq: str = '1min'):
+def intraTEwma(data, span: int, freq: str = '1min', segments=None):
     """
     计算指数加权移动平均(EWMA)，按指定频率间隔刷新计算。
     当前后两个时间戳相隔超过给定freq时，EWMA会重新开始计算。
@@ -264,46 +360,40 @@ def intraTEwma(data, span: int, freq: str = '1min'):
         span (int): 指数加权的周期数，类似于半衰期。
         freq (str): 刷新频率，默认'1D'（按日刷新）。
                    可以是 '1min', '30min', '1H', '2H' 等任意pandas频率字符串。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index, by_day=False, freq=freq)），
+                   传入时忽略freq。
         
     Returns:
-        与输入相同类型的指数加权移动平均结果，结构与输入一致。
+        与输入相同类型的指数加权移动平均结果（float64），结构与输入一致。
     """
-    # 判断输入是DataFrame还是Series
-    is_series = isinstance(data, pd.Series)
+    return intraTEwma_multi(data, [span], freq, segments)[span]
+
+
+def intraTEwma_multi(data, spans, freq: str = '1min', segments=None):
+    """
+    一次计算多个span的intraTEwma：按freq的间隔分段后逐列单次遍历，各span在同一次遍历中递推，
+    结果与逐个调用intraTEwma相同。
     
-    # 如果是Series，转换为DataFrame处理，方便统一逻辑
-    if is_series:
-        df = data.to_frame()
-    else:
-        df = data.copy()
+    Args:
+        data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
+        spans (list): span的列表，如 [10, 20, 30, 60, 120]。
+        freq (str): 刷新频率，前后两个时间戳相隔超过freq时重新开始计算。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index, by_day=False, freq=freq)），
+                   传入时忽略freq。
+        
+    Returns:
+        dict: span -> 与输入相同类型的指数加权移动平均结果（float64）。
+    """
+    is_series = isinstance(data, pd.Series)
+    df = data.to_frame() if is_series else data.copy(deep=False)
     
     # 确保索引是datetime类型
     if not isinstance(df.index, pd.DatetimeIndex):
         df.index = pd.to_datetime(df.index)
     
-    # 创建一个与输入相同结构的结果DataFrame
-    result = pd.DataFrame(index=df.index, columns=df.columns)
-    
-    # 根据频率创建分组标识
-    group_ids = _create_groups_by_freq(df.index, freq)
-    
-    # 为每个组单独计算EWMA
-    for group_id in np.unique(group_ids):
-        # 获取当前组的索引位置
-        group_mask = group_ids == group_id
-        group_data = df[group_mask]
-        
-        # 对当前组的数据计算EWMA，adjust=True确保更准确的指数权重
-        group_result = group_data.ewm(span=span, min_periods=1, adjust=True).mean()
-        
-        # 将当前组的结果填入总结果中
-        result.loc[group_data.index] = group_result
-    
-    # 如果输入是Series，则返回Series，否则返回DataFrame
-    if is_series:
-        return result.iloc[:, 0]
-    else:
-        return result
+    # 根据频率分段（间隔超过freq处开始新的一段）
+    segments = _resolve_segments(df.index, segments, by_day=False, freq=freq)
+    return _segmented_ewma_frames(df, list(spans), segments, is_series)
 
 
 # 示例用法：
@@ -321,16 +411,17 @@ def intraTEwma(data, span: int, freq: str = '1min'):
 
     
 # %%
-def intraSum(data, window: int):
+def intraSum(data, window: int, segments=None):
     """
     计算日内滑动窗口累计求和，确保每天的计算仅使用当天的数据。
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
         window (int): 滑动窗口的大小。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
         
     Returns:
-        与输入相同类型的日内滑动求和结果，结构与输入一致。
+        与输入相同类型的日内滑动求和结果（float64），结构与输入一致。
     """
     # 判断输入是DataFrame还是Series
     is_series = isinstance(data, pd.Series)
@@ -339,21 +430,14 @@ def intraSum(data, window: int):
     if is_series:
         df = data.to_frame()
     else:
-        df = data.copy()
+        df = data.copy(deep=False)
     
-    # 创建一个与输入相同结构的结果DataFrame
-    result = pd.DataFrame(index=df.index, columns=df.columns)
-    
-    # 根据日期对数据进行分组
-    grouped = df.groupby(df.index.date)
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df.index, segments)
     
-    # 对每一天的数据单独计算滑动求和
-    for date, group in grouped:
-        # 对当天的数据计算滑动求和
-        day_result = group.rolling(window=window, min_periods=1).sum()
-        
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+    # 在整个二维数组上一次完成各段的滑动求和，每段从段首重新开始
+    values = segmented_rolling_sum(df.to_numpy(dtype=np.float64), segments.starts, segments.ends, window)
+    result = pd.DataFrame(values, index=df.index, columns=df.columns)
     
     # 如果输入是Series，则返回Series，否则返回DataFrame
     if is_series:
@@ -363,35 +447,38 @@ def intraSum(data, window: int):
     
     
 # %%
-def process_intraCumSum_block(df_block, block_idx):
+def process_intraCumSum_block(df_block, block_idx, segments=None):
     """
     处理 intraCumSum 的单个数据块
     """
     # 创建一个与输入相同结构的结果DataFrame
     result = pd.DataFrame(index=df_block.index, columns=df_block.columns)
     
-    # 根据日期对数据进行分组
-    grouped = df_block.groupby(df_block.index.date)
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df_block.index, segments)
     
-    # 对每一天的数据单独计算累计求和
-    for date, group in grouped:
+    # 对每一段（默认每一天）的数据单独计算累计求和
+    for start, end in zip(segments.starts, segments.ends):
+        group = df_block.iloc[start:end]
         # 对当天的数据计算累计求和
         day_result = group.cumsum()
         
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+        # 将当段的结果填入总结果中
+        result.iloc[start:end] = day_result.to_numpy()
     
     return block_idx, result
 
 
-def intraCumSum_parallel(data, n_jobs: int = 150, block_size: int = 5):
+def intraCumSum_parallel(data, n_jobs: int = None, block_size: int = 5, segments=None):
     """
     intraCumSum 的并行加速版本
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
-        n_jobs (int): 并行进程数，默认值为 150。
+        n_jobs (int): 最大并行进程数，默认为CPU核心数；实际进程数不超过数据块数，
+            使用 utils.parallelutils 的常驻执行器，与其他阶段复用已启动的worker。
         block_size (int): 每个数据块的列数，默认值为 5。
+        segments (SegmentIndex): 可选，共用的分段，默认按交易日分段；只计算一次，随任务发给各数据块。
         
     Returns:
         与输入相同类型的日内累计求和结果，结构与输入一致。
@@ -403,29 +490,32 @@ def intraCumSum_parallel(data, n_jobs: int = 150, block_size: int = 5):
     if is_series:
         df = data.to_frame()
     else:
-        df = data.copy()
+        df = data.copy(deep=False)
+    
+    # 分段只计算一次，各数据块共用
+    segments = _resolve_segments(df.index, segments)
     
     # 将数据按列分块
     col_blocks = [df.columns[i:i+block_size] for i in range(0, len(df.columns), block_size)]
     result = pd.DataFrame(index=df.index, columns=df.columns)
     total_blocks = len(col_blocks)
 
-    print(f"[intraCumSum_parallel] Launching {total_blocks} blocks with {n_jobs} processes...")
+    executor = get_worker_pool(n_tasks=total_blocks, max_workers=n_jobs)
+    print(f"[intraCumSum_parallel] Launching {total_blocks} blocks on shared worker pool...")
 
-    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
-        future_to_idx = {}
-        for block_idx, cols in enumerate(col_blocks):
-            df_block = df[cols]
-            future = executor.submit(process_intraCumSum_block, df_block, block_idx)
-            future_to_idx[future] = (block_idx, cols)
+    future_to_idx = {}
+    for block_idx, cols in enumerate(col_blocks):
+        df_block = df[cols]
+        future = executor.submit(process_intraCumSum_block, df_block, block_idx, segments)
+        future_to_idx[future] = (block_idx, cols)
 
-        with tqdm(total=total_blocks, desc="intraCumSum Progress") as pbar:
-            for future in as_completed(future_to_idx):
-                block_idx, cols = future_to_idx[future]
-                _, block_result = future.result()
-                for col in cols:
-                    result[col] = block_result[col]
-                pbar.update(1)
+    with tqdm(total=total_blocks, desc="intraCumSum Progress") as pbar:
+        for future in as_completed(future_to_idx):
+            block_idx, cols = future_to_idx[future]
+            _, block_result = future.result()
+            for col in cols:
+                result[col] = block_result[col]
+            pbar.update(1)
 
     print("[intraCumSum_parallel] All blocks completed.")
     
@@ -436,12 +526,13 @@ def intraCumSum_parallel(data, n_jobs: int = 150, block_size: int = 5):
         return result
 
 
-def intraCumSum(data):
+def intraCumSum(data, segments=None):
     """
     计算日内累计求和，确保每天的计算仅使用当天的数据，每天重新开始累积。
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
         
     Returns:
         与输入相同类型的日内累计求和结果，结构与输入一致。
@@ -453,21 +544,22 @@ def intraCumSum(data):
     if is_series:
         df = data.to_frame()
     else:
-        df = data.copy()
+        df = data.copy(deep=False)
     
     # 创建一个与输入相同结构的结果DataFrame
     result = pd.DataFrame(index=df.index, columns=df.columns)
     
-    # 根据日期对数据进行分组
-    grouped = df.groupby(df.index.date)
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df.index, segments)
     
-    # 对每一天的数据单独计算累计求和
-    for date, group in grouped:
+    # 对每一段（默认每一天）的数据单独计算累计求和
+    for start, end in zip(segments.starts, segments.ends):
+        group = df.iloc[start:end]
         # 对当天的数据计算累计求和
         day_result = group.cumsum()
         
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+        # 将当段的结果填入总结果中
+        result.iloc[start:end] = day_result.to_numpy()
     
     # 如果输入是Series，则返回Series，否则返回DataFrame
     if is_series:
@@ -477,16 +569,17 @@ def intraCumSum(data):
     
     
 # %%
-def intraRmin(data, window: int):
+def intraRmin(data, window: int, segments=None):
     """
     计算日内滚动最小值，确保每天的计算仅使用当天的数据。
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
         window (int): 滚动窗口的大小。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
         
     Returns:
-        与输入相同类型的日内滚动最小值结果，结构与输入一致。
+        与输入相同类型的日内滚动最小值结果（float64），结构与输入一致。
     """
     # 判断输入是DataFrame还是Series
     is_series = isinstance(data, pd.Series)
@@ -495,21 +588,14 @@ def intraRmin(data, window: int):
     if is_series:
         df = data.to_frame()
     else:
-        df = data.copy()
-    
-    # 创建一个与输入相同结构的结果DataFrame
-    result = pd.DataFrame(index=df.index, columns=df.columns)
+        df = data.copy(deep=False)
     
-    # 根据日期对数据进行分组
-    grouped = df.groupby(df.index.date)
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df.index, segments)
     
-    # 对每一天的数据单独计算滚动最小值
-    for date, group in grouped:
-        # 对当天的数据计算滚动最小值，min_periods=1确保从第一个值开始计算
-        day_result = group.rolling(window=window, min_periods=1).min()
-        
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+    # 在整个二维数组上一次完成各段的滚动最小值，每段从段首重新开始，NaN不参与比较
+    values = segmented_rolling_min(df.to_numpy(dtype=np.float64), segments.starts, segments.ends, window)
+    result = pd.DataFrame(values, index=df.index, columns=df.columns)
     
     # 如果输入是Series，则返回Series，否则返回DataFrame
     if is_series:
@@ -518,16 +604,17 @@ def intraRmin(data, window: int):
         return result
 
 
-def intraRmax(data, window: int):
+def intraRmax(data, window: int, segments=None):
     """
     计算日内滚动最大值，确保每天的计算仅使用当天的数据。
     
     Args:
         data: 时间序列数据，可以是DataFrame或Series，index为时间戳。
         window (int): 滚动窗口的大小。
+        segments (SegmentIndex): 可选，共用的分段（如 SegmentIndex(data.index)），默认按交易日分段。
         
     Returns:
-        与输入相同类型的日内滚动最大值结果，结构与输入一致。
+        与输入相同类型的日内滚动最大值结果（float64），结构与输入一致。
     """
     # 判断输入是DataFrame还是Series
     is_series = isinstance(data, pd.Series)
@@ -536,21 +623,14 @@ def intraRmax(data, window: int):
     if is_series:
         df = data.to_frame()
     else:
-        df = data.copy()
-    
-    # 创建一个与输入相同结构的结果DataFrame
-    result = pd.DataFrame(index=df.index, columns=df.columns)
+        df = data.copy(deep=False)
     
-    # 根据日期对数据进行分组
-    grouped = df.groupby(df.index.date)
+    # 使用共用的分段（默认按交易日分段）
+    segments = _resolve_segments(df.index, segments)
     
-    # 对每一天的数据单独计算滚动最大值
-    for date, group in grouped:
-        # 对当天的数据计算滚动最大值，min_periods=1确保从第一个值开始计算
-        day_result = group.rolling(window=window, min_periods=1).max()
-        
-        # 将当天的结果填入总结果中
-        result.loc[group.index] = day_result
+    # 在整个二维数组上一次完成各段的滚动最大值，每段从段首重新开始，NaN不参与比较
+    values = segmented_rolling_max(df.to_numpy(dtype=np.float64), segments.starts, segments.ends, window)
+    result = pd.DataFrame(values, index=df.index, columns=df.columns)
     
     # 如果输入是Series，则返回Series，否则返回DataFrame
     if is_series:
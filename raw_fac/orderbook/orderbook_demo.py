@@ -14,7 +14,6 @@ emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵
 # %% imports
 import sys
 from pathlib import Path
-import pandas as pd
 from datetime import datetime
 
 
@@ -27,12 +26,13 @@ sys.path.append(str(project_dir))
 
 # %%
 from utils.timeutils import parse_time_string, get_a_share_intraday_time_series
+from utils.tickstore import TickStore, ORDERBOOK_COLUMNS, tick_datetime
 
 
 # %%
-path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup/20231213/mdl_21_1_0.csv'
-data_all = pd.read_csv(path)
-data = data_all[data_all['InstruID']=='IC2401']
+data_base_path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup'
+tick_cache_dir = Path('/mnt/Data/xintang/future_data/tick_cache')
+tick_store = TickStore(data_base_path, cache_dir=tick_cache_dir)
 
 interval = '1min'
 keep_periods = {
@@ -40,6 +40,7 @@ keep_periods = {
     'afternoon': ('13:01:00', '15:00:00')
 }
 date = '20231213'
+data = tick_store.load_ticks(date, instru_id='IC2401', columns=ORDERBOOK_COLUMNS)
 date_in_dt = datetime.strptime(date, '%Y%m%d')
 
 
@@ -63,7 +64,7 @@ data['ask_amount'] = (
 )
 
 # 按分钟聚合
-data['DateTime'] = pd.to_datetime(data['TradDay'].astype(str) + ' ' + data['UpdateTime'].astype(str))
+data['DateTime'] = tick_datetime(data)
 data.set_index('DateTime', inplace=True)
 minute_data = data.resample('1min', closed='right', label='right').agg({
     'bid_amount': 'sum',
@@ -4,14 +4,16 @@ Created on Wed Jul 02 2025
 @author: Assistant
 
 期货主买主卖量数据合并模块
-将逐期货逐日的数据整理成按feature分组的parquet文件
+将逐期货逐日的数据整理成按feature分组的面板，每次只读取新的或有更新的逐日文件（见 utils.panelstore）
 行index: 所有天所有时间戳按顺序
 列: 不同的期货品种
 """
 
 import os
 import sys
+import json
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from tqdm import tqdm
@@ -22,142 +24,278 @@ file_path = Path(__file__).resolve()
 project_dir = file_path.parents[1]
 sys.path.append(str(project_dir))
 
-from utils.timeutils import parse_time_string, get_a_share_intraday_time_series
+from utils.timeutils import parse_time_string, grid_for_dates, trading_day_row_offsets
+from utils.products import product_keep_periods, available_products
+from utils.tickfeatures import trade_flow_result_cache, DEFAULT_TRADE_FLOW_FEATURES
+from utils.panelstore import (read_merge_state, write_merge_state, clear_panels, append_panel, replace_panel_days,
+                              PANEL_LAYOUT, write_memmap_panel)
+from utils.parallelutils import get_worker_pool
 
 
-def collect_all_timestamps(zhuli_dir, fut_list, params):
+def collect_all_timestamps(zhuli_dir, fut_list, params, after_date=None, until_date=None):
     """
     收集所有可能的时间戳，用于创建完整的时间索引
+    未指定keep_periods时按各品种的交易时段生成，结果为所有品种时间网格的并集
+    after_date/until_date (str): 可选，只保留 (after_date, until_date] 内的日期，YYYYMMDD
     """
     interval = params.get('interval', '1min')
-    keep_periods = params.get('keep_periods', {
-        'morning': ('09:31:00', '11:30:00'),
-        'afternoon': ('13:01:00', '15:00:00')
-    })
-    
-    all_timestamps = set()
+    keep_periods = params.get('keep_periods')
     
-    # 收集所有日期
-    all_dates = set()
+    # 收集所有日期（交易时段相同的品种合并处理）
+    dates_by_periods = {}
     for fut in fut_list:
         zhuli_path = zhuli_dir / f'{fut}.parquet'
         if zhuli_path.exists():
             zhuli_data = pd.read_parquet(zhuli_path)
             dates = zhuli_data['date'].astype(str).unique()
-            all_dates.update(dates)
+            if after_date is not None:
+                dates = [date for date in dates if date > after_date]
+            if until_date is not None:
+                dates = [date for date in dates if date <= until_date]
+            periods = keep_periods or product_keep_periods(fut, interval)
+            key = tuple(periods.items())
+            dates_by_periods.setdefault(key, set()).update(dates)
     
-    # 为每个日期生成时间戳
+    # 每组日期的时间戳一次性生成，合并得到排序的DatetimeIndex
     interval_timedelta = {'seconds': parse_time_string(interval)}
-    
-    for date in sorted(all_dates):
-        date_in_dt = datetime.strptime(date, '%Y%m%d')
-        day_timestamps = get_a_share_intraday_time_series(
-            date_in_dt, 
-            interval_timedelta, 
-            trading_periods=keep_periods
-        )
-        all_timestamps.update(day_timestamps)
-    
-    # 转换为排序的DatetimeIndex
-    full_index = pd.DatetimeIndex(sorted(all_timestamps))
+    full_index = pd.DatetimeIndex([])
+    for key, all_dates in dates_by_periods.items():
+        if all_dates:
+            full_index = full_index.union(grid_for_dates(all_dates, interval_timedelta, trading_periods=dict(key)))
     
     return full_index
 
 
-def merge_feature_data(feature_name, raw_data_dir, fut_list, full_index, output_path):
+def list_daily_files(raw_data_dir, fut_list):
     """
-    合并单个feature的数据
+    列出每个品种已有的逐日结果文件，每个品种只列一次目录
+
+    返回:
+    dict: 品种 -> {日期: 文件修改时间(秒)}
     """
-    # 初始化结果DataFrame
-    result_df = pd.DataFrame(index=full_index, columns=fut_list, dtype=float)
-    result_df = result_df.fillna(0.0)
-    
-    # 逐个期货品种处理
-    for fut in tqdm(fut_list, desc=f"处理 {feature_name}"):
+    daily_files = {}
+    for fut in fut_list:
         fut_dir = raw_data_dir / fut
-        
+        daily_files[fut] = {}
         if not fut_dir.exists():
             continue
-        
-        # 收集该期货的所有数据文件
-        parquet_files = list(fut_dir.glob('*.parquet'))
-        
-        if not parquet_files:
-            continue
-        
-        # 读取并合并该期货的所有日期数据
-        fut_data_list = []
-        
-        for file_path in parquet_files:
+        with os.scandir(fut_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.parquet') and not entry.name.startswith('.'):
+                    daily_files[fut][entry.name[:-len('.parquet')]] = entry.stat().st_mtime
+    return daily_files
+
+
+def assemble_panels(raw_data_dir, new_dates, fut_list, features, full_index, n_jobs=None):
+    """
+    预分配一个 (feature × 时间戳 × 品种) 的float64数组，由交易日行偏移定位每个逐日文件在数组中的位置，
+    直接写入对应切片，不做concat、排序和reindex；各feature的面板是数组切片上的视图
+    
+    同一品种同一交易日被多个文件写入时视为重复，保留后读取的文件并提示；
+    逐日文件中的NaN保留，没有文件的日期和文件中没有的feature为0
+    
+    参数:
+    raw_data_dir (Path): 逐日结果目录
+    new_dates (dict): 品种 -> 需要读取的日期列表
+    fut_list (list): 品种列表，即面板的列
+    features (list): 特征名
+    full_index (pd.DatetimeIndex): 升序的时间索引，即面板的行
+    n_jobs (int): 读取文件的最大并行线程数，None表示CPU核心数
+    
+    返回:
+    dict: feature -> pd.DataFrame
+    """
+    grid = np.asarray(full_index, dtype='datetime64[ns]').view(np.int64)
+    day_offsets = trading_day_row_offsets(full_index)
+    day_starts = np.array(sorted(start for start, _ in day_offsets.values()), dtype=np.int64)
+    values = np.zeros((len(features), len(grid), len(fut_list)), dtype=np.float64)
+    filled = np.zeros((len(day_starts), len(fut_list)), dtype=bool)
+    duplicates = []
+    
+    def fill_product(j, fut):
+        for date in new_dates.get(fut, []):
             try:
-                daily_data = pd.read_parquet(file_path)
-                
-                # 确保包含目标feature
-                if feature_name not in daily_data.columns:
-                    continue
-                
-                # 提取目标feature的数据
-                feature_series = daily_data[feature_name].copy()
-                fut_data_list.append(feature_series)
-                
-            except Exception as e:
+                daily_data = pd.read_parquet(raw_data_dir / fut / f'{date}.parquet')
+            except Exception:
+                continue
+            present = [k for k, feature in enumerate(features) if feature in daily_data.columns]
+            if not present:
                 continue
-        
-        if fut_data_list:
-            # 合并该期货的所有数据
-            fut_combined = pd.concat(fut_data_list, axis=0)
-            fut_combined = fut_combined.sort_index()
+            data = daily_data[[features[k] for k in present]].to_numpy(dtype=np.float64).T
+            stamps = np.asarray(daily_data.index, dtype='datetime64[ns]').view(np.int64)
             
-            # 去重（保留最后一个值，以防有重复时间戳）
-            fut_combined = fut_combined[~fut_combined.index.duplicated(keep='last')]
+            # 时间戳与该交易日的网格完全一致时整段写入，否则按时间戳定位，网格外的时间戳丢弃
+            start, stop = day_offsets.get(date, (0, 0))
+            if stop - start == len(stamps) and np.array_equal(grid[start:stop], stamps):
+                rows = slice(start, stop)
+                day_ids = np.searchsorted(day_starts, [start], side='right') - 1
+            else:
+                pos = np.minimum(np.searchsorted(grid, stamps), max(len(grid) - 1, 0))
+                valid = grid[pos] == stamps if len(grid) else np.zeros(len(stamps), dtype=bool)
+                rows, data = pos[valid], data[:, valid]
+                day_ids = np.unique(np.searchsorted(day_starts, rows, side='right') - 1)
             
-            # 将数据对齐到完整索引
-            result_df[fut] = fut_combined.reindex(full_index, fill_value=0.0)
+            if filled[day_ids, j].any():
+                duplicates.append(f'{fut}/{date}')
+            filled[day_ids, j] = True
+            for i, k in enumerate(present):
+                values[k, rows, j] = data[i]
+    
+    # 各品种写入数组的不同列，用线程并行读取
+    executor = get_worker_pool(n_tasks=len(fut_list), max_workers=n_jobs, executor_type='thread')
+    futures = [executor.submit(fill_product, j, fut) for j, fut in enumerate(fut_list)]
+    for future in tqdm(futures, desc='读取逐日结果'):
+        future.result()
+    
+    if duplicates:
+        print(f'⚠️  {len(duplicates)} 个文件与同一品种已读取的交易日重复，保留后读取的值（如 {duplicates[0]}）')
     
-    # 保存结果
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    result_df.to_parquet(output_path)
+    return {feature: pd.DataFrame(values[k], index=full_index, columns=fut_list, copy=False)
+            for k, feature in enumerate(features)}
 
 
-def merge_all_trade_flow_data(raw_data_dir, zhuli_dir, merged_save_dir, fut_list, params):
+def _json_canonical(value):
+    """
+    转换为写入merge_state后读回的形式（如tuple变为list），使参数与已记录的状态可以直接比较
+    """
+    return json.loads(json.dumps(value))
+
+
+def _merge_compatible(state, raw_data_dir, fut_list, features, params):
+    """
+    已有的合并结果是否可以增量追加：存储格式、原始数据目录、品种、feature和时间网格参数均未变化，
+    且记录了每个品种已合并的日期
+    """
+    return (state is not None
+            and state.get('layout') == PANEL_LAYOUT
+            and 'merged_dates' in state
+            and state.get('raw_data_dir') == str(raw_data_dir)
+            and state.get('products') == _json_canonical(list(fut_list))
+            and state.get('features') == _json_canonical(list(features))
+            and state.get('interval') == _json_canonical(params.get('interval', '1min'))
+            and state.get('keep_periods') == _json_canonical(params.get('keep_periods')))
+
+
+def _split_by_month(dates_by_fut):
+    """
+    品种 -> 日期列表 按交易日所在月份拆分为 月份 -> {品种: 日期列表}
+    """
+    by_month = {}
+    for fut, dates in dates_by_fut.items():
+        for date in dates:
+            by_month.setdefault(date[:6], {}).setdefault(fut, []).append(date)
+    return by_month
+
+
+def merge_all_trade_flow_data(raw_data_dir, zhuli_dir, merged_save_dir, fut_list, params, n_jobs=None,
+                              full_rebuild=False, memmap=False):
     """
     合并所有期货主买主卖量数据
+    增量模式：merge_state记录每个品种已合并的日期，只读取未合并过或上次合并后有更新的逐日文件
+    （每个文件读一次，所有feature共用）。已合并的最新日期之后的日期追加到所在的月份分区；
+    之前的日期（某品种的文件晚于其他品种到达，或文件被重算）只改写所在月份分区中该品种该交易日的行，
+    耗时与需要读取的文件数成正比；存储格式、原始数据目录、品种、feature或网格参数变化时自动全量重建
+    
+    参数:
+    raw_data_dir (Path): trade_flow_mp.py按参数哈希分目录的结果目录
+    zhuli_dir (Path): 主力合约目录
+    merged_save_dir (Path): 合并数据目录，格式见 utils.panelstore
+    fut_list (list): 品种列表
+    params (dict): 与trade_flow_mp.py一致的参数，features未指定时合并主买主卖金额
+    n_jobs (int): 读取结果文件的最大并行线程数，None表示CPU核心数
+    full_rebuild (bool): 是否忽略已有结果全量重建
+    memmap (bool): 是否同时输出内存映射格式的面板（按月份分文件，只重写本次改动的月份），见 utils.panelstore.MemmapPanel
     """
-    # 收集完整的时间索引
-    full_index = collect_all_timestamps(zhuli_dir, fut_list, params)
+    features = list(params.get('features') or DEFAULT_TRADE_FLOW_FEATURES)
+    fut_list = list(fut_list)
+    merge_start = datetime.now()
+    
+    state = read_merge_state(merged_save_dir)
+    if full_rebuild or not _merge_compatible(state, raw_data_dir, fut_list, features, params):
+        if state is not None:
+            print('⚠️  合并参数变化或指定全量重建，重新合并全部日期')
+        clear_panels(merged_save_dir, features)
+        state = None
+    last_date = state['last_date'] if state else None
+    merged_dates = {fut: set(dates) for fut, dates in state['merged_dates'].items()} if state else {}
+    merged_at = datetime.fromisoformat(state['merged_at']).timestamp() if state else None
+    
+    # 需要读取的逐日文件：未合并过的日期，以及上次合并开始后有更新的文件
+    daily_files = list_daily_files(raw_data_dir, fut_list)
+    pending = {fut: sorted(date for date, mtime in files.items()
+                           if date not in merged_dates.get(fut, ()) or mtime > merged_at)
+               for fut, files in daily_files.items()}
+    new_dates = {fut: [date for date in dates if last_date is None or date > last_date]
+                 for fut, dates in pending.items()}
+    late_dates = {fut: [date for date in dates if last_date is not None and date <= last_date]
+                  for fut, dates in pending.items()}
+    all_new_dates = sorted({date for dates in new_dates.values() for date in dates})
+    n_late = sum(len(dates) for dates in late_dates.values())
+    if not all_new_dates and not n_late:
+        print(f'✅ 合并数据已是最新（截至 {last_date}）')
+        if memmap:
+            for feature in features:
+                write_memmap_panel(merged_save_dir, feature)
+        return
     
-    # 定义要合并的features
-    features = ['act_buy_amount', 'act_sell_amount']
+    # 已合并日期范围内晚到或有更新的文件：按月份重新读取，只替换对应品种、交易日的行
+    if n_late:
+        late_by_month = _split_by_month(late_dates)
+        print(f'🔁 {n_late} 个已合并范围内的逐日文件晚到或有更新，改写 {len(late_by_month)} 个月份分区')
+        for month, month_dates in sorted(late_by_month.items()):
+            month_index = collect_all_timestamps(zhuli_dir, fut_list, params,
+                                                 after_date=f'{month}00', until_date=f'{month}99')
+            panels = assemble_panels(raw_data_dir, month_dates, fut_list, features, month_index, n_jobs=n_jobs)
+            for feature, panel in panels.items():
+                replace_panel_days(merged_save_dir, feature, month, panel, month_dates)
     
-    # 逐个feature进行合并
-    for feature_name in features:
-        output_path = merged_save_dir / f'{feature_name}.parquet'
-        
-        merge_feature_data(
-            feature_name=feature_name,
-            raw_data_dir=raw_data_dir,
-            fut_list=fut_list,
-            full_index=full_index,
-            output_path=output_path
-        )
+    # 已合并的最新日期之后的新日期：逐日文件直接写入预分配的面板数组，追加到所在的月份分区
+    until_date = last_date
+    if all_new_dates:
+        first_date, until_date = all_new_dates[0], all_new_dates[-1]
+        full_index = collect_all_timestamps(zhuli_dir, fut_list, params, after_date=last_date,
+                                            until_date=until_date)
+        panels = assemble_panels(raw_data_dir, new_dates, fut_list, features, full_index, n_jobs=n_jobs)
+        for feature, panel in panels.items():
+            append_panel(merged_save_dir, feature, panel)
+    
+    for fut, dates in pending.items():
+        merged_dates.setdefault(fut, set()).update(dates)
+    write_merge_state(merged_save_dir, {
+        'layout': PANEL_LAYOUT,
+        'raw_data_dir': str(raw_data_dir),
+        'products': fut_list,
+        'features': features,
+        'interval': params.get('interval', '1min'),
+        'keep_periods': params.get('keep_periods'),
+        'last_date': until_date,
+        'merged_dates': {fut: sorted(dates) for fut, dates in merged_dates.items()},
+        'merged_at': merge_start.isoformat(),
+    })
+    if all_new_dates:
+        print(f'✅ 合并 {first_date} 至 {until_date} 共 {len(all_new_dates)} 个日期，{len(features)} 个feature')
+    
+    if memmap:
+        for feature in features:
+            write_memmap_panel(merged_save_dir, feature)
 
 
 # %% 主函数
 if __name__ == '__main__':
     # 配置参数
-    fut_list = ['IC', 'IF', 'IH', 'IM']
     zhuli_dir = Path('/mnt/nfs/30.132_xt_data1/future_zhuli')
-    raw_data_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_raw')  # trade_flow_mp.py的save_dir
+    fut_list = available_products(zhuli_dir)  # 主力合约目录中所有已登记元数据的品种
+    raw_root_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_raw')  # trade_flow_mp.py的save_dir
     merged_save_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_merged')  # 新的保存目录
     
     params = {
-        'interval': '1min',
-        'keep_periods': {
-            'morning': ('09:31:00', '11:30:00'),
-            'afternoon': ('13:01:00', '15:00:00')
-        }
+        'interval': '1min',  # 与trade_flow_mp.py的params一致，不指定keep_periods时按各品种的交易时段
     }
     
+    # trade_flow_mp.py按参数哈希分目录保存，这里取相同参数对应的目录
+    raw_data_dir = trade_flow_result_cache(raw_root_dir, params['interval'],
+                                           params.get('keep_periods'), params.get('features')).result_dir
+    
     # 执行数据合并
     merge_all_trade_flow_data(
         raw_data_dir=raw_data_dir,
@@ -32,6 +32,7 @@ sys.path.append(str(project_dir))
 
 # %%
 from utils.timeutils import parse_time_string, get_a_share_intraday_time_series
+from utils.tickstore import TickStore, TRADE_FLOW_COLUMNS, tick_datetime
 
 
 # %% 计算单个期货单日主买主卖量的函数
@@ -41,7 +42,7 @@ def calc_order_flow_per_fut_per_day(date, data_all, instru_id, interval='1min',
     
     参数:
     date (str): 日期，格式为'YYYYMMDD'
-    data_all (pd.DataFrame): 包含所有期货数据的DataFrame
+    data_all (pd.DataFrame): 包含所有期货数据的DataFrame（TickStore缓存格式）
     instru_id (str): 目标合约的InstruID，如'IC2401'
     interval (str): 聚合间隔，如'1min'
     keep_periods (dict): 保留的交易时段，如{'morning': ('09:31:00', '11:30:00'), 'afternoon': ('13:01:00', '15:00:00')}
@@ -102,7 +103,7 @@ def calc_order_flow_per_fut_per_day(date, data_all, instru_id, interval='1min',
         data.loc[data['trade_direction'] == -1, 'act_sell_amount'] = data.loc[data['trade_direction'] == -1, 'Turnover']
         
         # 创建时间索引
-        data['DateTime'] = pd.to_datetime(data['TradDay'].astype(str) + ' ' + data['UpdateTime'].astype(str))
+        data['DateTime'] = tick_datetime(data)
         data.set_index('DateTime', inplace=True)
         
         # 按指定间隔聚合
@@ -128,7 +129,8 @@ def calc_order_flow_per_fut_per_day(date, data_all, instru_id, interval='1min',
 
 
 # %% 计算所有期货品种的主买主卖量
-def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, params, use_cache=True):
+def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, params, use_cache=True,
+                            tick_cache_dir=None):
     """
     计算所有期货品种的主买主卖量
     
@@ -139,6 +141,7 @@ def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, param
     save_dir (Path): 保存目录
     params (dict): 参数字典，包含interval和keep_periods
     use_cache (bool): 是否使用缓存
+    tick_cache_dir (Path): tick数据本地列式缓存目录，None表示每次直接解析原始csv
     
     返回:
     None
@@ -152,6 +155,8 @@ def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, param
     # 确保保存目录存在
     save_dir.mkdir(parents=True, exist_ok=True)
     
+    tick_store = TickStore(data_base_path, cache_dir=tick_cache_dir)
+    
     for fut in fut_list:
         print(f'Processing {fut}...')
         
@@ -178,14 +183,11 @@ def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, param
                 continue
             
             try:
-                # 构建数据文件路径
-                data_path = f'{data_base_path}/{date}/mdl_21_1_0.csv'
-                
                 # 读取当日数据
                 try:
-                    data_all = pd.read_csv(data_path)
+                    data_all = tick_store.load_ticks(date, instru_id=instru_id, columns=TRADE_FLOW_COLUMNS)
                 except Exception as e:
-                    print(f'无法读取数据文件 {data_path}: {str(e)}')
+                    print(f'无法读取数据文件 {tick_store.raw_path(date)}: {str(e)}')
                     continue
                 
                 # 计算当日主买主卖量
@@ -214,6 +216,7 @@ if __name__ == '__main__':
     zhuli_dir = Path('/mnt/nfs/30.132_xt_data1/future_zhuli')
     data_base_path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup'
     save_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_raw')
+    tick_cache_dir = Path('/mnt/Data/xintang/future_data/tick_cache')
     
     params = {
         'interval': '1min',
@@ -230,7 +233,8 @@ if __name__ == '__main__':
         data_base_path=data_base_path,
         save_dir=save_dir,
         params=params,
-        use_cache=True
+        use_cache=True,
+        tick_cache_dir=tick_cache_dir
     )
     
     print('所有期货品种的主买主卖量计算完成！')
@@ -14,7 +14,6 @@ emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵
 # %% imports
 import sys
 from pathlib import Path
-import pandas as pd
 from datetime import datetime
 
 
@@ -27,26 +26,28 @@ sys.path.append(str(project_dir))
 
 # %%
 from utils.timeutils import parse_time_string, get_a_share_intraday_time_series
+from utils.tickstore import TickStore, TRADE_FLOW_COLUMNS, tick_datetime
+from utils.products import product_of, get_product, product_keep_periods
 
 
 # %%
-path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup/20231213/mdl_21_1_0.csv'
-data_all = pd.read_csv(path)
-data = data_all[data_all['InstruID']=='IC2401']
+data_base_path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup'
+tick_cache_dir = Path('/mnt/Data/xintang/future_data/tick_cache')
+tick_store = TickStore(data_base_path, cache_dir=tick_cache_dir)
 
 interval = '1min'
-keep_periods = {
-    'morning': ('09:31:00', '11:30:00'),
-    'afternoon': ('13:01:00', '15:00:00')
-}
+instru_id = 'IC2401'
+keep_periods = product_keep_periods(product_of(instru_id), interval)
+multiplier = get_product(product_of(instru_id))['multiplier']
 date = '20231213'
+data = tick_store.load_ticks(date, instru_id=instru_id, columns=TRADE_FLOW_COLUMNS)
 date_in_dt = datetime.strptime(date, '%Y%m%d')
 
 
 # %%
 data['turnover'] = data['Turnover'].diff()
 data['volume'] = data['Volume'].diff()
-data['vwap'] = data['turnover'] / data['volume'] / 200
+data['vwap'] = data['turnover'] / data['volume'] / multiplier
 data['midprice'] = (data['BidPrice1'] + data['AskPrice1']) / 2
 data['midprice_diff'] = data['midprice'].diff()
 data['vwap_lastmpc_diff'] = (data['vwap'] - data['midprice']).shift(1)
@@ -80,7 +81,7 @@ data.loc[data['trade_direction'] == 1, 'act_buy_amount'] = data.loc[data['trade_
 data.loc[data['trade_direction'] == -1, 'act_sell_amount'] = data.loc[data['trade_direction'] == -1, 'turnover']
 
 # 按分钟聚合
-data['DateTime'] = pd.to_datetime(data['TradDay'].astype(str) + ' ' + data['UpdateTime'].astype(str))
+data['DateTime'] = tick_datetime(data)
 data.set_index('DateTime', inplace=True)
 minute_data = data.resample('1min', closed='right', label='right').agg({
     'act_buy_amount': 'sum',
@@ -18,15 +18,19 @@ emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💡 🎵 🎶
 import os
 import sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from functools import partial
+from contextlib import contextmanager, closing
 from tqdm import tqdm
 import traceback
 import pickle
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import multiprocessing as mp
-from itertools import product
+import threading
+import tempfile
+import shutil
+from collections import Counter
 import time
 
 # %% add sys path
@@ -37,93 +41,75 @@ sys.path.append(str(project_dir))
 
 # %%
 from utils.timeutils import parse_time_string, get_a_share_intraday_time_series
+from utils.tickstore import TickStore, TickPrefetcher, TRADE_FLOW_COLUMNS
+from utils.tickfeatures import (DEFAULT_TRADE_FLOW_FEATURES, build_tick_context, evaluate_tick_features,
+                                 empty_bar_features, reduce_features_to_grid, trade_flow_result_cache)
+from utils.cacheutils import atomic_to_parquet
+from utils.products import product_of, get_product, product_keep_periods, available_products
+from utils.parallelutils import run_bounded, print_worker_peak_rss, print_core_utilization, get_worker_pool
 
 
 # %% 计算单个期货单日主买主卖量的函数
-def calc_order_flow_per_fut_per_day(date, data_all, instru_id, interval='1min', keep_periods=None):
+def calc_order_flow_per_fut_per_day(date, data_all, instru_id, interval='1min', keep_periods=None,
+                                    features=None):
     """
     计算单个期货品种单日的主买主卖金额
     
     参数:
     date (str): 日期，格式为'YYYYMMDD'
-    data_all (pd.DataFrame): 包含所有期货数据的DataFrame
+    data_all (pd.DataFrame): 包含所有期货数据的DataFrame（TickStore缓存格式）
     instru_id (str): 目标合约的InstruID，如'IC2401'
-    interval (str): 聚合间隔，如'1min'
-    keep_periods (dict): 保留的交易时段，如{'morning': ('09:31:00', '11:30:00'), 'afternoon': ('13:01:00', '15:00:00')}
+    interval (str or list): 聚合间隔，如'1min'；传入列表如['30s', '1min', '5min']时，
+                            只判断一次交易方向，再分别聚合到每个间隔的时间网格
+    keep_periods (dict): 保留的交易时段，如{'morning': ('09:31:00', '11:30:00'), 'afternoon': ('13:01:00', '15:00:00')}，
+                         None表示按品种元数据的交易时段（含夜盘），见 utils.products.product_keep_periods
+    features (list): 输出的特征名，需已在utils.tickfeatures中注册，如['act_buy_amount', 'act_sell_amount',
+                     'act_buy_volume', 'trade_count', 'vwap']，None表示只输出主买主卖金额；
+                     所有特征共用一次方向判断，在同一次聚合中计算
     
     返回:
-    pd.DataFrame: 包含主买主卖金额的DataFrame
+    pd.DataFrame: 每个特征一列的DataFrame；interval为列表时返回 {interval: pd.DataFrame}
     """
-    if keep_periods is None:
-        keep_periods = {
-            'morning': ('09:31:00', '11:30:00'),
-            'afternoon': ('13:01:00', '15:00:00')
-        }
+    # 合约乘数、最小变动价位和交易时段取自品种元数据
+    product = product_of(instru_id)
+    product_info = get_product(product)
     
+    intervals = [interval] if isinstance(interval, str) else list(interval)
+    features = list(features or DEFAULT_TRADE_FLOW_FEATURES)
     date_in_dt = datetime.strptime(date, '%Y%m%d')
-    interval_timedelta = {'seconds': parse_time_string(interval)}
-    keep_ts = get_a_share_intraday_time_series(date_in_dt, interval_timedelta, 
-                                               trading_periods=keep_periods)
     
-    # 初始化结果DataFrame
-    res = pd.DataFrame(index=keep_ts, columns=['act_buy_amount', 'act_sell_amount'])
-    res['act_buy_amount'] = 0.0
-    res['act_sell_amount'] = 0.0
+    # 初始化每个间隔的结果DataFrame
+    res_by_interval = {}
+    for curr_interval in intervals:
+        interval_timedelta = {'seconds': parse_time_string(curr_interval)}
+        keep_ts = get_a_share_intraday_time_series(
+            date_in_dt, interval_timedelta,
+            trading_periods=keep_periods or product_keep_periods(product, curr_interval)
+        )
+        res = pd.DataFrame(empty_bar_features(features, len(keep_ts)), index=keep_ts)
+        res_by_interval[curr_interval] = res
     
     try:
         # 筛选指定合约的数据
-        data = data_all[data_all['InstruID'] == instru_id].copy()
+        data = data_all[data_all['InstruID'] == instru_id]
         
         if data.empty:
             print(f'No data found for {instru_id} on {date}')
-            return res
-        
-        # 计算VWAP和中间价
-        data['turnover'] = data['Turnover'].diff()
-        data['volume'] = data['Volume'].diff()
-        data['vwap'] = data['turnover'] / data['volume'] / 200
-        data['midprice'] = (data['BidPrice1'] + data['AskPrice1']) / 2
-        data['midprice_diff'] = data['midprice'].diff()
-        data['vwap_lastmpc_diff'] = (data['vwap'] - data['midprice']).shift(1)
-        
-        # 计算交易方向
-        data['trade_direction'] = 0
-        
-        # 第一优先级：midprice变化方向
-        data.loc[data['midprice_diff'] > 0, 'trade_direction'] = 1   # midprice上升，主买
-        data.loc[data['midprice_diff'] < 0, 'trade_direction'] = -1  # midprice下降，主卖
-        
-        # 第二优先级：midprice不变时，比较vwap和midprice
-        midprice_unchanged = (data['midprice_diff'] == 0) | data['midprice_diff'].isna()
-        data.loc[midprice_unchanged & (data['vwap'] > data['midprice']), 'trade_direction'] = 1   # vwap > midprice，主买
-        data.loc[midprice_unchanged & (data['vwap'] < data['midprice']), 'trade_direction'] = -1  # vwap < midprice，主卖
-        
-        # 第三优先级：vwap == midprice时，延续上一tick方向
-        vwap_eq_midprice = midprice_unchanged & (data['vwap'] == data['midprice'])
-        data.loc[vwap_eq_midprice, 'trade_direction'] = data['trade_direction'].shift(1).fillna(0)
-        
-        # 计算每个tick的主买和主卖金额
-        data['act_buy_amount'] = 0.0
-        data['act_sell_amount'] = 0.0
-        data.loc[data['trade_direction'] == 1, 'act_buy_amount'] = data.loc[data['trade_direction'] == 1, 'turnover']
-        data.loc[data['trade_direction'] == -1, 'act_sell_amount'] = data.loc[data['trade_direction'] == -1, 'turnover']
-        
-        # 创建时间索引
-        data['DateTime'] = pd.to_datetime(data['TradDay'].astype(str) + ' ' + data['UpdateTime'].astype(str))
-        data.set_index('DateTime', inplace=True)
-        
-        # 按指定间隔聚合
-        minute_data = data.resample(interval, closed='right', label='right').agg({
-            'act_buy_amount': 'sum',
-            'act_sell_amount': 'sum'
-        })
-        
-        # 重新索引到目标时间序列
-        output = minute_data.reindex(index=keep_ts)
-        output = output.fillna(0.0)  # 将NaN填充为0
-        
-        res.loc[:, 'act_buy_amount'] = output['act_buy_amount']
-        res.loc[:, 'act_sell_amount'] = output['act_sell_amount']
+        else:
+            # 单次遍历判断交易方向，计算每个tick的主买和主卖金额
+            # midprice变化方向 > vwap与midprice比较 > 延续上一tick方向
+            ticks = build_tick_context(data, multiplier=product_info['multiplier'],
+                                       tick_size=product_info['tick_size'])
+            tick_values = evaluate_tick_features(ticks, features)
+            day_ns = data['TradDay'].to_numpy()
+            time_ns = data['UpdateTime'].to_numpy()
+            
+            # 同一组逐tick特征按每个间隔直接聚合到目标时间序列（右闭右标签）
+            for curr_interval, res in res_by_interval.items():
+                output = reduce_features_to_grid(tick_values, features, day_ns, time_ns, res.index,
+                                                 parse_time_string(curr_interval), ticks['multiplier'])
+                for name in features:
+                    res[name] = output[name]
         
     except Exception as e:
         traceback.print_exc()
@@ -131,70 +117,61 @@ def calc_order_flow_per_fut_per_day(date, data_all, instru_id, interval='1min',
         if date > '20250101':
             raise Exception(f'Processing error: {date}, {instru_id}')
     
-    return res
+    if isinstance(interval, str):
+        return res_by_interval[interval]
+    return res_by_interval
 
 
 # %% 处理单个任务的函数
 def process_single_task(task_params):
     """
-    处理单个任务的函数，用于并行计算
+    处理单个任务的函数，用于并行计算（缓存是否有效已由主进程判断，这里只负责计算）
     
     参数:
     task_params (tuple): 包含任务参数的元组
     
     返回:
-    dict: 任务结果
+    dict: 任务结果，成功时包含instru_id、输入文件指纹和耗时，供主进程写入manifest
     """
-    fut, date, curr_trade, data_base_path, save_dir, interval, keep_periods, use_cache = task_params
+    fut, date, curr_trade, tick_store, result_dirs, intervals, keep_periods, features = task_params
     
     instru_id = f'{fut}{curr_trade}'
-    fut_save_dir = save_dir / fut
-    cache_path = fut_save_dir / f'{date}.parquet'
-    
-    # 检查是否已有缓存文件
-    if use_cache and cache_path.exists():
-        return {
-            'fut': fut,
-            'date': date,
-            'status': 'cached',
-            'message': f'Cache exists for {instru_id} on {date}'
-        }
+    start_time = time.perf_counter()
     
     try:
-        # 构建数据文件路径
-        data_path = f'{data_base_path}/{date}/mdl_21_1_0.csv'
-        
         # 读取当日数据
         try:
-            data_all = pd.read_csv(data_path)
+            data_all = tick_store.load_ticks(date, instru_id=instru_id, columns=TRADE_FLOW_COLUMNS)
         except Exception as e:
             return {
                 'fut': fut,
                 'date': date,
                 'status': 'error',
-                'message': f'无法读取数据文件 {data_path}: {str(e)}'
+                'message': f'无法读取数据文件 {tick_store.raw_path(date)}: {str(e)}'
             }
         
-        # 计算当日主买主卖量
-        result = calc_order_flow_per_fut_per_day(
+        # 计算当日主买主卖量（一次方向判断，输出所有间隔）
+        result_by_interval = calc_order_flow_per_fut_per_day(
             date=date,
             data_all=data_all,
             instru_id=instru_id,
-            interval=interval,
-            keep_periods=keep_periods
+            interval=intervals,
+            keep_periods=keep_periods,
+            features=features
         )
         
-        # 确保保存目录存在
-        fut_save_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 保存结果
-        result.to_parquet(cache_path)
+        # 每个间隔保存到各自的结果目录（先写临时文件再重命名）
+        for curr_interval, result in result_by_interval.items():
+            atomic_to_parquet(result, result_dirs[curr_interval] / fut / f'{date}.parquet')
         
         return {
             'fut': fut,
             'date': date,
             'status': 'success',
-            'message': f'Successfully processed {instru_id} on {date}'
+            'message': f'Successfully processed {instru_id} on {date}',
+            'instru_id': instru_id,
+            'fingerprint': tick_store.fingerprint(date),
+            'seconds': time.perf_counter() - start_time
         }
         
     except Exception as e:
@@ -214,40 +191,250 @@ def process_single_task(task_params):
         }
 
 
+# %% 处理单日所有品种的函数（按日期读取一次数据）
+def process_single_date(task_params):
+    """
+    处理单个日期的任务：当日数据文件只读取一次，按InstruID拆分后计算所有品种
+    
+    参数:
+    task_params (tuple): 包含任务参数的元组，其中fut_trades为[(fut, curr_trade), ...]
+    
+    返回:
+    list: 每个品种一个任务结果dict，耗时为该品种的计算时间加上均摊的读取时间
+    """
+    date, fut_trades, tick_store, result_dirs, intervals, keep_periods, features = task_params
+    
+    start_time = time.perf_counter()
+    results = []
+    todo = [(fut, f'{fut}{curr_trade}') for fut, curr_trade in fut_trades]
+    
+    # 读取当日数据（所有品种共用一次读取，只读需要的合约和列）
+    instru_ids = [instru_id for _, instru_id in todo]
+    try:
+        data_all = tick_store.load_ticks(date, instru_id=instru_ids, columns=TRADE_FLOW_COLUMNS)
+    except Exception as e:
+        for fut, instru_id in todo:
+            results.append({
+                'fut': fut,
+                'date': date,
+                'status': 'error',
+                'message': f'无法读取数据文件 {tick_store.raw_path(date)}: {str(e)}'
+            })
+        return results
+    
+    fingerprint = tick_store.fingerprint(date)
+    
+    # 一次groupby按合约拆分
+    data_by_instru = dict(tuple(data_all.groupby('InstruID', sort=False, observed=True)))
+    empty_data = data_all.iloc[:0]
+    shared_seconds = (time.perf_counter() - start_time) / len(todo)
+    
+    for fut, instru_id in todo:
+        fut_start_time = time.perf_counter()
+        try:
+            # 计算当日主买主卖量（一次方向判断，输出所有间隔）
+            result_by_interval = calc_order_flow_per_fut_per_day(
+                date=date,
+                data_all=data_by_instru.get(instru_id, empty_data),
+                instru_id=instru_id,
+                interval=intervals,
+                keep_periods=keep_periods,
+                features=features
+            )
+            
+            # 每个间隔保存到各自的结果目录（先写临时文件再重命名）
+            for curr_interval, result in result_by_interval.items():
+                atomic_to_parquet(result, result_dirs[curr_interval] / fut / f'{date}.parquet')
+            
+            results.append({
+                'fut': fut,
+                'date': date,
+                'status': 'success',
+                'message': f'Successfully processed {instru_id} on {date}',
+                'instru_id': instru_id,
+                'fingerprint': fingerprint,
+                'seconds': shared_seconds + time.perf_counter() - fut_start_time
+            })
+            
+        except Exception as e:
+            error_msg = f'处理 {fut} {date} 时出错: {str(e)}'
+            results.append({
+                'fut': fut,
+                'date': date,
+                'status': 'critical_error' if date > '20250101' else 'error',
+                'message': error_msg
+            })
+    
+    return results
+
+
+# %% manifest落盘
+@contextmanager
+def _saving_manifest(result_caches):
+    """
+    计算结束（包括异常中断）时保存manifest，已完成的结果下次不再重算
+    """
+    try:
+        yield
+    finally:
+        for result_cache in result_caches:
+            result_cache.save_manifest()
+
+
+@contextmanager
+def _closing_prefetcher(prefetcher, staging_dir):
+    """
+    计算结束（包括异常中断）时停止预下载并删除暂存目录
+    """
+    try:
+        yield
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+# %% 等待预下载完成后再交给计算进程
+def _iter_prefetched(tasks, prefetcher, task_date):
+    for task in tasks:
+        prefetcher.wait(task_date(task))
+        yield task
+
+
+# %% 按估计耗时排序任务
+def _order_tasks(all_tasks, task_mode, result_cache, tick_store):
+    """
+    估计每个任务的耗时，按耗时从大到小排序（最长任务优先），减少最后少数大任务拖尾、其余核心空闲的时间
+    
+    耗时估计: 优先使用manifest中记录的历史耗时；没有历史时按输入文件大小（当日各品种均摊）
+    换算，换算系数取有历史耗时的品种-日期的中位数；两者都没有时取历史耗时均值或1
+    fut模式下同一日期的任务排在一起（日期按总耗时排序），共用的输入文件读取时保持在页缓存中；
+    date模式下一个日期本身就是一个任务，当日文件只读取一次
+    
+    返回:
+    tuple: (排序后的任务列表, 对应的估计耗时列表)
+    """
+    if task_mode == 'date':
+        items = [(date, fut) for date, fut_trades, *_ in all_tasks for fut, _ in fut_trades]
+    else:
+        items = [(date, fut) for fut, date, *_ in all_tasks]
+    
+    n_by_date = Counter(date for date, _ in items)
+    sizes = tick_store.input_sizes(list(n_by_date))
+    history = {}
+    for date, fut in items:
+        entry = result_cache.entries.get(result_cache.entry_key(fut, date), {})
+        if entry.get('seconds') is not None:
+            history[(date, fut)] = entry['seconds']
+    
+    def size_share(date):
+        return sizes[date] / n_by_date[date] if sizes.get(date) else None
+    
+    ratios = [seconds / size_share(date) for (date, fut), seconds in history.items()
+              if size_share(date) and seconds > 0]
+    seconds_per_byte = float(np.median(ratios)) if ratios else None
+    default_cost = float(np.mean(list(history.values()))) if history else 1.0
+    
+    def item_cost(date, fut):
+        if (date, fut) in history:
+            return history[(date, fut)]
+        share = size_share(date)
+        if share is None:
+            return default_cost
+        if seconds_per_byte is not None:
+            return share * seconds_per_byte
+        return share if not history else default_cost
+    
+    if task_mode == 'date':
+        costs = [sum(item_cost(task[0], fut) for fut, _ in task[1]) for task in all_tasks]
+        order = sorted(range(len(all_tasks)), key=lambda i: -costs[i])
+    else:
+        costs = [item_cost(task[1], task[0]) for task in all_tasks]
+        date_costs = Counter()
+        for task, cost in zip(all_tasks, costs):
+            date_costs[task[1]] += cost
+        order = sorted(range(len(all_tasks)),
+                       key=lambda i: (-date_costs[all_tasks[i][1]], all_tasks[i][1], -costs[i]))
+    
+    return [all_tasks[i] for i in order], [costs[i] for i in order]
+
+
 # %% 并行计算所有期货品种的主买主卖量
 def calc_order_flow_for_all_parallel(fut_list, zhuli_dir, data_base_path, save_dir, params, 
-                                    use_cache=True, max_workers=None, executor_type='process'):
+                                    use_cache=True, max_workers=None, executor_type='process',
+                                    task_mode='date', tick_cache_dir=None,
+                                    max_in_flight=None, rss_budget_mb=None,
+                                    prefetch_workers=0, prefetch_bytes=4 * 1024 ** 3,
+                                    largest_first=True, check_tick_source=False):
     """
     并行计算所有期货品种的主买主卖量
     
     参数:
-    fut_list (list): 期货品种列表，如['IC', 'IF', 'IH', 'IM']
+    fut_list (list): 期货品种列表，如['IC', 'IF', 'cu', 'SR']，None表示主力合约目录中所有已登记元数据的品种
     zhuli_dir (Path): 主力合约数据目录
     data_base_path (str): 数据基础路径，如'http://172.16.30.3/future-data/tonglian-data/msg_backup'
-    save_dir (Path): 保存目录
-    params (dict): 参数字典，包含interval和keep_periods
-    use_cache (bool): 是否使用缓存
-    max_workers (int): 最大并行工作进程数，None表示使用CPU核心数
+    save_dir (Path): 保存根目录，结果保存在 save_dir/{参数哈希}/{fut}/{date}.parquet，不同参数的结果并存
+    params (dict): 参数字典，包含interval和可选的keep_periods、features（输出的特征名列表）；
+                   不指定keep_periods时每个品种按元数据中的交易时段（含夜盘）生成时间网格；
+                   interval可以是列表，如['30s', '1min', '5min']，此时每个品种-日期只读取和判断方向一次，
+                   各间隔分别写入自己的结果目录，任一间隔的缓存失效时重算该品种-日期的所有间隔
+    use_cache (bool): 是否使用缓存，缓存按manifest中记录的合约及输入文件指纹判断是否失效
+    max_workers (int): 最大并行工作进程数，None表示使用CPU核心数；复用worker更多的常驻执行器时，
+                       同时运行的任务数仍不超过max_workers
     executor_type (str): 执行器类型，'process' 或 'thread'
+    task_mode (str): 任务划分方式，'date' 为每个日期一个任务（当日数据只读一次，计算所有品种），
+                     'fut' 为每个(品种, 日期)一个任务
+    tick_cache_dir (Path): tick数据本地列式缓存目录，None表示每次直接解析原始csv
+    max_in_flight (int): 最大在途任务数，None表示2倍工作进程数，限制同时驻留内存的全日数据量
+    rss_budget_mb (float): 可选，主进程及所有worker常驻内存之和的预算(MB)，超出时暂停提交新任务
+    prefetch_workers (int): 原始数据为http地址时，预下载后续日期原始csv的线程数，0表示不预下载
+    prefetch_bytes (int): 预下载暂存文件的字节预算
+    largest_first (bool): 是否按估计耗时从大到小提交任务（历史耗时记录在manifest中，没有时按输入文件大小），
+                          False表示按日期顺序提交
+    check_tick_source (bool): 是否检查原始数据是否变化，为True时tick缓存在原始文件变化后重新转换，相应结果重算
     
     返回:
-    None
+    Path: 本参数对应的结果目录；interval为列表时返回 {interval: 结果目录}
     """
     interval = params.get('interval', '1min')
-    keep_periods = params.get('keep_periods', {
-        'morning': ('09:31:00', '11:30:00'),
-        'afternoon': ('13:01:00', '15:00:00')
-    })
+    intervals = [interval] if isinstance(interval, str) else list(interval)
+    keep_periods = params.get('keep_periods')
+    features = params.get('features')
+    
+    # 结果缓存按 (参数, 代码版本, 品种元数据版本) 分目录，每个间隔一个目录，与单独按该间隔运行的目录相同
+    result_caches = {
+        curr_interval: trade_flow_result_cache(save_dir, curr_interval, keep_periods, features)
+        for curr_interval in intervals
+    }
+    result_dirs = {curr_interval: result_cache.result_dir
+                   for curr_interval, result_cache in result_caches.items()}
+    for curr_interval, result_dir in result_dirs.items():
+        result_dir.mkdir(parents=True, exist_ok=True)
+        print(f'结果目录 ({curr_interval}): {result_dir}')
     
-    # 确保保存目录存在
-    save_dir.mkdir(parents=True, exist_ok=True)
+    # 未指定品种时取主力合约目录中所有已登记元数据的品种
+    if fut_list is None:
+        fut_list = available_products(zhuli_dir)
+    print(f'品种数: {len(fut_list)}')
     
-    # 收集所有任务
+    # 所有任务通过TickStore读取tick数据
+    tick_store = TickStore(data_base_path, cache_dir=tick_cache_dir, check_source=check_tick_source)
+    
+    # 收集所有任务（已有缓存的品种-日期在主进程中直接跳过，不再派发给worker）
     all_tasks = []
+    date_to_trades = {}
+    n_cached = 0
     
     for fut in fut_list:
         print(f'准备 {fut} 的任务...')
         
+        try:
+            get_product(fut)
+        except KeyError as e:
+            print(f'⚠ {e.args[0]}，跳过')
+            continue
+        
         # 读取主力合约数据
         zhuli_path = zhuli_dir / f'{fut}.parquet'
         if not zhuli_path.exists():
@@ -255,57 +442,137 @@ def calc_order_flow_for_all_parallel(fut_list, zhuli_dir, data_base_path, save_d
             continue
             
         zhuli_data = pd.read_parquet(zhuli_path)
+        zhuli_dates = zhuli_data['date'].astype(str)
+        
+        # 每个品种只列一次目录，结合manifest中的合约和输入指纹判断缓存是否有效
+        if use_cache:
+            existing_dates = {curr_interval: result_cache.existing_dates(fut)
+                              for curr_interval, result_cache in result_caches.items()}
+            fingerprints = tick_store.fingerprints(zhuli_dates.unique())
         
-        for idx in zhuli_data.index:
-            date = str(zhuli_data.loc[idx, 'date'])
-            curr_trade = zhuli_data.loc[idx, 'curr_trade']
+        for date, curr_trade in zip(zhuli_dates, zhuli_data['curr_trade']):
+            if use_cache and all(
+                    result_cache.is_valid(fut, date, f'{fut}{curr_trade}', fingerprints[date],
+                                          existing_dates=existing_dates[curr_interval])
+                    for curr_interval, result_cache in result_caches.items()):
+                n_cached += 1
+                continue
+            
+            if task_mode == 'date':
+                date_to_trades.setdefault(date, []).append((fut, curr_trade))
+                continue
             
             task_params = (
-                fut, date, curr_trade, data_base_path, save_dir,
-                interval, keep_periods, use_cache
+                fut, date, curr_trade, tick_store, result_dirs,
+                intervals, keep_periods, features
+            )
+            all_tasks.append(task_params)
+    
+    # 按日期模式：每个日期一个任务，包含当日所有品种
+    if task_mode == 'date':
+        for date in sorted(date_to_trades):
+            task_params = (
+                date, date_to_trades[date], tick_store, result_dirs,
+                intervals, keep_periods, features
             )
             all_tasks.append(task_params)
+        task_func = process_single_date
+        n_items = sum(len(trades) for trades in date_to_trades.values())
+    else:
+        task_func = process_single_task
+        n_items = len(all_tasks)
+    
+    print(f'总共准备了 {len(all_tasks)} 个任务（{n_items} 个品种-日期），已有缓存 {n_cached} 个品种-日期')
+    
+    # 最长任务优先，fut模式下同一日期的任务相邻
+    if largest_first and all_tasks:
+        all_tasks, task_costs = _order_tasks(all_tasks, task_mode, result_caches[intervals[0]], tick_store)
+        print(f'按估计耗时从大到小提交任务，最大/中位估计耗时比: '
+              f'{task_costs[0] / max(np.median(task_costs), 1e-12):.1f}')
     
-    print(f'总共准备了 {len(all_tasks)} 个任务')
+    output_dirs = result_dirs[interval] if isinstance(interval, str) else result_dirs
+    if not all_tasks:
+        print('所有品种-日期均已有缓存，无需计算')
+        return output_dirs
     
     # 设置最大工作进程数
     if max_workers is None:
         max_workers = min(mp.cpu_count(), len(all_tasks))
     
-    print(f'使用 {executor_type} 执行器，最大工作进程数: {max_workers}')
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
     
-    # 选择执行器类型
-    ExecutorClass = ProcessPoolExecutor if executor_type == 'process' else ThreadPoolExecutor
+    print(f'使用 {executor_type} 执行器，最大工作进程数: {max_workers}，最大在途任务数: {max_in_flight}')
+    
+    # 常驻执行器：同一进程中的后续调用（及merge、trans阶段）复用已启动并预热的worker
+    executor = get_worker_pool(n_tasks=len(all_tasks), max_workers=max_workers, executor_type=executor_type)
     
     # 统计结果
     results = {
         'success': 0,
-        'cached': 0,
+        'cached': n_cached,
         'error': 0,
         'critical_error': 0
     }
     
     start_time = time.time()
+    worker_peak_rss = {}
+    task_spans = []
     
-    # 执行并行计算
-    with ExecutorClass(max_workers=max_workers) as executor:
-        # 提交所有任务
-        future_to_task = {executor.submit(process_single_task, task): task for task in all_tasks}
+    # 预下载：按任务顺序提前下载原始csv，某日的所有任务结束后删除暂存文件释放预算
+    task_iter, on_task_done, prefetcher, staging_dir = all_tasks, None, None, None
+    if prefetch_workers and tick_store.is_remote():
+        # 任务参数在提交时才序列化，计算进程会看到这里设置的暂存目录并优先读取暂存文件
+        staging_dir = Path(tempfile.mkdtemp(prefix='tick_prefetch_'))
+        tick_store.staging_dir = staging_dir
+        task_date = (lambda task: task[0]) if task_mode == 'date' else (lambda task: task[1])
+        date_refs = Counter(task_date(task) for task in all_tasks)
+        refs_lock = threading.Lock()
+        prefetcher = TickPrefetcher(tick_store, max_workers=prefetch_workers, byte_budget=prefetch_bytes)
+        
+        def release_finished_date(task):
+            date = task_date(task)
+            with refs_lock:
+                date_refs[date] -= 1
+                finished = date_refs[date] == 0
+            if finished:
+                prefetcher.release(date)
         
+        on_task_done = release_finished_date
+        print(f'预下载线程数: {prefetch_workers}，暂存预算: {prefetch_bytes / 1024 ** 2:.0f} MB')
+        prefetcher.start(task_date(task) for task in all_tasks)
+        task_iter = _iter_prefetched(all_tasks, prefetcher, task_date)
+    
+    # 执行并行计算，manifest由主进程统一写入
+    # 有界提交：完成一个任务再补充一个，避免所有全日数据同时驻留内存；
+    # 中断时先等待在途任务结束，再清理预下载暂存目录
+    with _closing_prefetcher(prefetcher, staging_dir), _saving_manifest(result_caches.values()), \
+            closing(run_bounded(executor, task_func, task_iter, max_in_flight,
+                                rss_budget_mb=rss_budget_mb, worker_peak_rss=worker_peak_rss,
+                                on_task_done=on_task_done, task_spans=task_spans)) as completed:
         # 使用tqdm显示进度
         with tqdm(total=len(all_tasks), desc='处理任务') as pbar:
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                
+            for task, task_results, task_error in completed:
                 try:
-                    result = future.result()
-                    status = result['status']
-                    results[status] += 1
+                    if task_error is not None:
+                        raise task_error
+                    if isinstance(task_results, dict):
+                        task_results = [task_results]
+                    
+                    for result in task_results:
+                        status = result['status']
+                        results[status] += 1
+                        if status == 'success':
+                            for result_cache in result_caches.values():
+                                result_cache.record(result['fut'], result['date'],
+                                                    result['instru_id'], result['fingerprint'],
+                                                    seconds=round(result['seconds'], 4))
                     
                     # 如果是严重错误，抛出异常
-                    if status == 'critical_error':
-                        print(f"严重错误: {result['message']}")
-                        raise Exception(result['message'])
+                    for result in task_results:
+                        if result['status'] == 'critical_error':
+                            print(f"严重错误: {result['message']}")
+                            raise Exception(result['message'])
                     
                     # 更新进度条描述
                     pbar.set_postfix({
@@ -315,8 +582,11 @@ def calc_order_flow_for_all_parallel(fut_list, zhuli_dir, data_base_path, save_d
                     })
                     
                 except Exception as e:
-                    fut, date = task[0], task[1]
-                    print(f'任务执行异常 {fut} {date}: {str(e)}')
+                    if task_mode == 'date':
+                        print(f'任务执行异常 {task[0]}: {str(e)}')
+                    else:
+                        fut, date = task[0], task[1]
+                        print(f'任务执行异常 {fut} {date}: {str(e)}')
                     results['error'] += 1
                 
                 pbar.update(1)
@@ -330,15 +600,21 @@ def calc_order_flow_for_all_parallel(fut_list, zhuli_dir, data_base_path, save_d
     print(f'使用缓存: {results["cached"]} 个任务')
     print(f'处理错误: {results["error"]} 个任务')
     print(f'严重错误: {results["critical_error"]} 个任务')
-    print(f'总任务数: {len(all_tasks)} 个')
+    print(f'总任务数: {len(all_tasks)} 个（{n_items} 个品种-日期）')
+    print_core_utilization(task_spans, executor._max_workers, start_time, end_time)
+    if executor_type == 'process':
+        print_worker_peak_rss(worker_peak_rss)
+    
+    return output_dirs
 
 
 # %% 兼容性函数：保持原有接口
-def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, params, use_cache=True):
+def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, params, use_cache=True,
+                            tick_cache_dir=None):
     """
     计算所有期货品种的主买主卖量（兼容性函数，调用并行版本）
     """
-    calc_order_flow_for_all_parallel(
+    return calc_order_flow_for_all_parallel(
         fut_list=fut_list,
         zhuli_dir=zhuli_dir,
         data_base_path=data_base_path,
@@ -346,24 +622,27 @@ def calc_order_flow_for_all(fut_list, zhuli_dir, data_base_path, save_dir, param
         params=params,
         use_cache=use_cache,
         max_workers=None,
-        executor_type='process'
+        executor_type='process',
+        tick_cache_dir=tick_cache_dir
     )
 
 
 # %% 主函数
 if __name__ == '__main__':
     # 配置参数
-    fut_list = ['IC', 'IF', 'IH', 'IM']
+    fut_list = None  # None表示主力合约目录中所有已登记元数据的品种（utils.products），也可指定如['IC', 'IF']
     zhuli_dir = Path('/mnt/nfs/30.132_xt_data1/future_zhuli')
     data_base_path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup'
     save_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_raw')
+    tick_cache_dir = Path('/mnt/Data/xintang/future_data/tick_cache')
     
     params = {
-        'interval': '1min',
-        'keep_periods': {
-            'morning': ('09:31:00', '11:30:00'),
-            'afternoon': ('13:01:00', '15:00:00')
-        }
+        'interval': '1min',  # 也可以传入列表如['30s', '1min', '5min']，一次读取同时输出多个间隔
+        # 不指定keep_periods时每个品种按元数据中的交易时段（含夜盘）生成时间网格，
+        # 也可为所有品种统一指定，如 {'morning': ('09:31:00', '11:30:00'), 'afternoon': ('13:01:00', '15:00:00')}
+        # 可选：输出更多已注册的特征，如 ['act_buy_amount', 'act_sell_amount', 'act_buy_volume',
+        # 'act_sell_volume', 'trade_count', 'vwap']，不指定时只输出主买主卖金额
+        # 'features': [...],
     }
     
     # 执行并行计算
@@ -375,7 +654,12 @@ if __name__ == '__main__':
         params=params,
         use_cache=True,
         max_workers=None,  # 自动使用CPU核心数
-        executor_type='process'  # 使用进程池，也可以选择'thread'
+        executor_type='process',  # 使用进程池，也可以选择'thread'
+        task_mode='date',  # 按日期读取一次数据，计算当日所有品种
+        tick_cache_dir=tick_cache_dir,  # tick数据本地列式缓存
+        max_in_flight=None,  # 默认2倍工作进程数
+        rss_budget_mb=None,  # 可设置内存预算(MB)，超出时暂停提交新任务
+        prefetch_workers=4  # 预下载线程数，网络读取与计算重叠
     )
     
     print('所有期货品种的主买主卖量并行计算完成！')
\ No newline at end of file
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+测试共用设置：把项目根目录加入sys.path，与各模块的 add sys path 一致
+"""
+import sys
+from pathlib import Path
+
+project_dir = Path(__file__).resolve().parents[1]
+sys.path.append(str(project_dir))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+结果缓存：参数哈希分目录，manifest记录的输入指纹变化或取不到时缓存失效
+"""
+import pandas as pd
+
+from utils.cacheutils import ResultCache, atomic_to_parquet, params_hash
+
+
+PARAMS = {'interval': '1min', 'keep_periods': None}
+FINGERPRINT = {'size': 1024, 'mtime_ns': 1700000000000000000}
+
+
+def _write_result(cache, fut, date, instru_id, fingerprint=FINGERPRINT):
+    atomic_to_parquet(pd.DataFrame({'act_buy_amount': [1.0, 2.0]}), cache.path(fut, date))
+    cache.record(fut, date, instru_id, fingerprint)
+
+
+def test_params_hash_separates_params_and_code_version():
+    assert params_hash(PARAMS, '4') == params_hash(dict(reversed(list(PARAMS.items()))), '4')
+    assert params_hash(PARAMS, '4') != params_hash({**PARAMS, 'interval': '5min'}, '4')
+    assert params_hash(PARAMS, '4') != params_hash(PARAMS, '5')
+
+
+def test_manifest_round_trip(tmp_path):
+    cache = ResultCache(tmp_path, PARAMS, '4')
+    _write_result(cache, 'IC', '20240130', 'IC2402')
+    _write_result(cache, 'IC', '20240131', 'IC2402')
+    assert list(tmp_path.iterdir()) == [cache.result_dir]
+    cache.save_manifest()
+
+    reloaded = ResultCache(tmp_path, PARAMS, '4')
+    existing = reloaded.existing_dates('IC')
+    assert existing == {'20240130', '20240131'}
+    assert reloaded.is_valid('IC', '20240130', 'IC2402', FINGERPRINT)
+    assert reloaded.is_valid('IC', '20240131', 'IC2402', FINGERPRINT, existing_dates=existing)
+
+    # 主力合约切换、输入文件变化或结果文件缺失时失效
+    assert not reloaded.is_valid('IC', '20240130', 'IC2403', FINGERPRINT)
+    assert not reloaded.is_valid('IC', '20240130', 'IC2402', {**FINGERPRINT, 'size': 2048})
+    assert not reloaded.is_valid('IC', '20240201', 'IC2402', FINGERPRINT)
+    reloaded.path('IC', '20240131').unlink()
+    assert not reloaded.is_valid('IC', '20240131', 'IC2402', FINGERPRINT)
+    assert reloaded.existing_dates('IF') == set()
+
+
+def test_other_params_use_separate_directory(tmp_path):
+    cache = ResultCache(tmp_path, PARAMS, '4')
+    _write_result(cache, 'IC', '20240130', 'IC2402')
+    cache.save_manifest()
+
+    for other in (ResultCache(tmp_path, {**PARAMS, 'interval': '5min'}, '4'), ResultCache(tmp_path, PARAMS, '5')):
+        assert other.result_dir != cache.result_dir
+        assert other.entries == {}
+        assert not other.is_valid('IC', '20240130', 'IC2402', FINGERPRINT)
+    assert ResultCache(tmp_path, PARAMS, '4').is_valid('IC', '20240130', 'IC2402', FINGERPRINT)
+
+
+def test_missing_fingerprint_always_recomputes(tmp_path):
+    # HTTP原始文件取不到指纹时，即使manifest中记录的也是None，仍然重算
+    cache = ResultCache(tmp_path, PARAMS, '4')
+    _write_result(cache, 'IC', '20240130', 'IC2402', fingerprint=None)
+    assert not cache.is_valid('IC', '20240130', 'IC2402', None)
+    assert not cache.is_valid('IC', '20240130', 'IC2402', None, existing_dates={'20240130'})
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+增量合并与全量重建的一致性：新日期追加、某品种晚到的逐日文件、合并后被重算的逐日文件
+"""
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from raw_fac.trade_flow.merge_trade_flow import merge_all_trade_flow_data
+from utils.panelstore import read_panel, read_merge_state, load_panel, MemmapPanel
+from utils.products import product_keep_periods
+from utils.timeutils import get_a_share_intraday_time_series
+
+
+FUT_LIST = ['IC', 'IF', 'au']
+DATES = ['20240129', '20240130', '20240131', '20240201', '20240202']
+FEATURES = ['act_buy_amount', 'act_sell_amount']
+PARAMS = {'interval': '1min'}
+
+
+def _write_daily(raw_dir, fut, date, seed):
+    rng = np.random.default_rng(seed)
+    index = get_a_share_intraday_time_series(datetime.strptime(date, '%Y%m%d'), {'seconds': 60},
+                                             trading_periods=product_keep_periods(fut, '1min'))
+    data = pd.DataFrame(rng.gamma(1.0, 1e6, size=(len(index), len(FEATURES))), index=pd.DatetimeIndex(index),
+                        columns=FEATURES)
+    data.iloc[3, 0] = np.nan
+    path = raw_dir / fut / f'{date}.parquet'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data.to_parquet(path)
+    return path
+
+
+@pytest.fixture
+def fixture_dirs(tmp_path):
+    zhuli_dir = tmp_path / 'zhuli'
+    zhuli_dir.mkdir()
+    for fut in FUT_LIST:
+        pd.DataFrame({'date': [int(date) for date in DATES], 'curr_trade': ['2403'] * len(DATES)}).to_parquet(
+            zhuli_dir / f'{fut}.parquet')
+    return zhuli_dir, tmp_path / 'raw', tmp_path
+
+
+def _merge(zhuli_dir, raw_dir, merged_dir, **kwargs):
+    merge_all_trade_flow_data(raw_dir, zhuli_dir, merged_dir, FUT_LIST, PARAMS, n_jobs=2, **kwargs)
+
+
+def _assert_same_as_rebuild(zhuli_dir, raw_dir, merged_dir, rebuild_dir):
+    _merge(zhuli_dir, raw_dir, rebuild_dir, full_rebuild=True)
+    for feature in FEATURES:
+        pd.testing.assert_frame_equal(read_panel(merged_dir, feature), read_panel(rebuild_dir, feature))
+
+
+def _seed(fut, date, version=0):
+    return FUT_LIST.index(fut) * 100000 + int(date[-4:]) * 10 + version
+
+
+def test_incremental_append_matches_full_rebuild(fixture_dirs):
+    zhuli_dir, raw_dir, tmp_path = fixture_dirs
+    merged_dir = tmp_path / 'merged'
+    for date in DATES[:2]:
+        for fut in FUT_LIST:
+            _write_daily(raw_dir, fut, date, _seed(fut, date))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+
+    for date in DATES[2:]:
+        for fut in FUT_LIST:
+            _write_daily(raw_dir, fut, date, _seed(fut, date))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+
+    assert read_merge_state(merged_dir)['last_date'] == DATES[-1]
+    _assert_same_as_rebuild(zhuli_dir, raw_dir, merged_dir, tmp_path / 'rebuild')
+
+
+def test_late_product_file_is_merged(fixture_dirs):
+    zhuli_dir, raw_dir, tmp_path = fixture_dirs
+    merged_dir = tmp_path / 'merged'
+    for date in DATES:
+        for fut in FUT_LIST:
+            if (fut, date) not in (('IF', '20240131'), ('au', '20240201')):
+                _write_daily(raw_dir, fut, date, _seed(fut, date))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+    assert read_panel(merged_dir, 'act_buy_amount').loc['2024-01-31 10:00', 'IF'] == 0.0
+
+    # 两个品种的文件在各自日期已合并之后才到达，其中au的夜盘属于2月的分区
+    _write_daily(raw_dir, 'IF', '20240131', _seed('IF', '20240131'))
+    _write_daily(raw_dir, 'au', '20240201', _seed('au', '20240201'))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+
+    assert read_panel(merged_dir, 'act_buy_amount').loc['2024-01-31 10:00', 'IF'] > 0.0
+    _assert_same_as_rebuild(zhuli_dir, raw_dir, merged_dir, tmp_path / 'rebuild')
+
+
+def test_rewritten_daily_file_is_reread(fixture_dirs):
+    zhuli_dir, raw_dir, tmp_path = fixture_dirs
+    merged_dir = tmp_path / 'merged'
+    for date in DATES:
+        for fut in FUT_LIST:
+            _write_daily(raw_dir, fut, date, _seed(fut, date))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+
+    path = _write_daily(raw_dir, 'IC', '20240130', _seed('IC', '20240130', version=1))
+    future = time.time() + 60
+    os.utime(path, (future, future))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+
+    _assert_same_as_rebuild(zhuli_dir, raw_dir, merged_dir, tmp_path / 'rebuild')
+
+
+def test_up_to_date_merge_reads_nothing(fixture_dirs, capsys):
+    zhuli_dir, raw_dir, tmp_path = fixture_dirs
+    merged_dir = tmp_path / 'merged'
+    for fut in FUT_LIST:
+        _write_daily(raw_dir, fut, DATES[0], _seed(fut, DATES[0]))
+    _merge(zhuli_dir, raw_dir, merged_dir)
+    capsys.readouterr()
+
+    _merge(zhuli_dir, raw_dir, merged_dir)
+    assert '已是最新' in capsys.readouterr().out
+
+
+def test_memmap_panel_follows_incremental_merge(fixture_dirs):
+    zhuli_dir, raw_dir, tmp_path = fixture_dirs
+    merged_dir = tmp_path / 'merged'
+    for date in DATES[:3]:
+        for fut in FUT_LIST:
+            _write_daily(raw_dir, fut, date, _seed(fut, date))
+    _merge(zhuli_dir, raw_dir, merged_dir, memmap=True)
+    january = merged_dir / 'memmap' / 'act_buy_amount' / '202401.npy'
+    january_mtime = january.stat().st_mtime_ns
+
+    # 新日期只在2月：1月的内存映射文件不重写
+    for date in DATES[3:]:
+        for fut in FUT_LIST:
+            _write_daily(raw_dir, fut, date, _seed(fut, date))
+    _merge(zhuli_dir, raw_dir, merged_dir, memmap=True)
+    assert january.stat().st_mtime_ns == january_mtime
+
+    for feature in FEATURES:
+        pd.testing.assert_frame_equal(MemmapPanel(merged_dir, feature).load(), read_panel(merged_dir, feature))
+        for start, end, products in (('20240130', '20240131', None), ('20240131', '20240201', ['au', 'IC']),
+                                     ('20240202', None, ['IF'])):
+            panel = MemmapPanel(merged_dir, feature, start, end, products)
+            expected = load_panel(merged_dir, feature, start, end, products)
+            # 索引、品种和形状不读取值
+            pd.testing.assert_index_equal(panel.index, expected.index)
+            assert list(panel.columns) == list(expected.columns) and panel.shape == expected.shape
+            pd.testing.assert_frame_equal(panel.load(), expected)
+
+    # 跨月份的范围映射一个连续文件，不在内存中拼接
+    panel = MemmapPanel(merged_dir, 'act_buy_amount', '20240130', '20240201')
+    range_path = panel.prepare()
+    assert range_path is not None and range_path.exists()
+    assert MemmapPanel(merged_dir, 'act_buy_amount', '20240131', '20240131').prepare() is None
+    loaded = panel.load()
+    assert not loaded.to_numpy().flags.writeable
+    pd.testing.assert_frame_equal(loaded, load_panel(merged_dir, 'act_buy_amount', '20240130', '20240201'))
+
+    # 晚到的1月文件只重写1月
+    _write_daily(raw_dir, 'IC', '20240130', _seed('IC', '20240130', version=1))
+    future = time.time() + 60
+    os.utime(raw_dir / 'IC' / '20240130.parquet', (future, future))
+    february_mtime = (merged_dir / 'memmap' / 'act_buy_amount' / '202402.npy').stat().st_mtime_ns
+    _merge(zhuli_dir, raw_dir, merged_dir, memmap=True)
+    assert (merged_dir / 'memmap' / 'act_buy_amount' / '202402.npy').stat().st_mtime_ns == february_mtime
+    assert not range_path.exists()
+    pd.testing.assert_frame_equal(MemmapPanel(merged_dir, 'act_buy_amount').load(),
+                                  read_panel(merged_dir, 'act_buy_amount'))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+常驻执行器复用时的并发上限，以及有界提交的在途任务数
+"""
+import threading
+import time
+
+from utils.parallelutils import get_worker_pool, run_bounded, shutdown_worker_pools
+
+
+class _Tracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, task):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        return task * 2
+
+
+def test_reused_larger_pool_respects_max_workers():
+    shutdown_worker_pools()
+    try:
+        large = get_worker_pool(max_workers=6, executor_type='thread')
+        small = get_worker_pool(n_tasks=20, max_workers=2, executor_type='thread')
+        assert large._max_workers == 6
+        assert small._max_workers == 2
+
+        tracker = _Tracker()
+        results = sorted(result for _, result, error in run_bounded(small, tracker, range(20), max_in_flight=4)
+                         if error is None)
+        assert results == [task * 2 for task in range(20)]
+        assert tracker.peak <= 2
+    finally:
+        shutdown_worker_pools()
+
+
+def test_run_bounded_limits_in_flight():
+    shutdown_worker_pools()
+    try:
+        executor = get_worker_pool(max_workers=8, executor_type='thread')
+        tracker = _Tracker()
+        done = list(run_bounded(executor, tracker, range(16), max_in_flight=3))
+        assert len(done) == 16
+        assert tracker.peak <= 3
+    finally:
+        shutdown_worker_pools()
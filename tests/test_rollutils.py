@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+分段滚动内核与原先按日分组的pandas实现比较：编译版本逐位一致，numpy版本在文档给出的误差范围内
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.rollutils as rollutils
+from operators.ts_intraday import (intraSma, intraSma_multi, intraSum, intraEwma, intraEwma_multi, intraTEwma,
+                                  intraRmin, intraRmax, SegmentIndex)
+from utils.products import product_keep_periods
+from utils.timeutils import grid_for_dates, trading_day_numbers
+
+
+DATES = ['20240102', '20240103', '20240104', '20240105']
+
+
+def _panel(product, seed=0, n_cols=3):
+    index = grid_for_dates(DATES, {'seconds': 60}, trading_periods=product_keep_periods(product, '1min'))
+    rng = np.random.default_rng(seed)
+    values = rng.gamma(0.5, 1e6, size=(len(index), n_cols))
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[rng.random(values.shape) < 0.1] = 0.0
+    values[40:60, 0] = 7.25
+    values[100, 1] = 1e13
+    values[:, 2] -= 5e5
+    return pd.DataFrame(values, index=index, columns=['a', 'b', 'c'][:n_cols])
+
+
+def _per_day(df, func):
+    """
+    原先的实现：按交易日分组，每组分别做pandas计算后写回
+    """
+    result = pd.DataFrame(index=df.index, columns=df.columns, dtype=np.float64)
+    for _, group in df.groupby(trading_day_numbers(df.index)):
+        result.loc[group.index] = func(group)
+    return result
+
+
+def _tolerance(df, window):
+    """
+    numpy分块版本、前缀和版本与pandas之差的上界：窗口内逐项求和的舍入误差，加上pandas整段滚动加减的舍入误差
+    """
+    eps = np.finfo(np.float64).eps
+    abs_df = df.abs()
+    window_abs = _per_day(abs_df, lambda g: g.rolling(window, min_periods=1).sum())
+    segment_abs = _per_day(abs_df, lambda g: pd.DataFrame(np.broadcast_to(g.sum().to_numpy(), g.shape),
+                                                          index=g.index, columns=g.columns))
+    return (window + 4) * eps * window_abs + 4 * eps * segment_abs
+
+
+def _assert_within(actual, expected, tolerance):
+    pd.testing.assert_index_equal(actual.index, expected.index)
+    actual, expected = actual.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64)
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    valid = ~np.isnan(expected)
+    assert (np.abs(actual - expected)[valid] <= np.asarray(tolerance, dtype=np.float64)[valid]).all()
+
+
+@pytest.fixture(params=['compiled', 'fallback'])
+def rolling_kernel(request, monkeypatch):
+    if request.param == 'fallback':
+        monkeypatch.setattr(rollutils, '_segmented_rolling_kernel', rollutils._segmented_window_sums_numpy)
+        monkeypatch.setattr(rollutils, '_segmented_window_sums_kernel', rollutils._segmented_window_sums_numpy)
+    elif rollutils.njit is None:
+        pytest.skip('没有安装numba')
+    return request.param
+
+
+@pytest.mark.parametrize('product', ['IC', 'au'])
+@pytest.mark.parametrize('window', [1, 5, 30, 1000])
+def test_intra_sma_sum_match_per_day_pandas(rolling_kernel, product, window):
+    df = _panel(product)
+    expected_mean = _per_day(df, lambda g: g.rolling(window, min_periods=1).mean())
+    expected_sum = _per_day(df, lambda g: g.rolling(window, min_periods=1).sum())
+    if rolling_kernel == 'compiled':
+        pd.testing.assert_frame_equal(intraSma(df, window), expected_mean, check_exact=True, check_freq=False)
+        pd.testing.assert_frame_equal(intraSum(df, window), expected_sum, check_exact=True, check_freq=False)
+    else:
+        # 没有numba时为分块求和，与pandas之差在文档给出的误差范围内
+        tolerance = _tolerance(df, window)
+        _assert_within(intraSma(df, window), expected_mean, tolerance)
+        _assert_within(intraSum(df, window), expected_sum, tolerance)
+
+
+def test_intra_sma_series_and_shared_segments(rolling_kernel):
+    df = _panel('IC')
+    segments = SegmentIndex(df.index)
+    expected = df['a'].groupby(df.index.date).transform(lambda g: g.rolling(10, min_periods=1).mean())
+    result = intraSma(df['a'], 10, segments=segments)
+    if rolling_kernel == 'compiled':
+        pd.testing.assert_series_equal(result, expected, check_exact=True, check_freq=False)
+    else:
+        _assert_within(result, expected, _tolerance(df[['a']], 10)['a'])
+
+
+@pytest.mark.parametrize('product', ['IC', 'au'])
+def test_intra_sma_multi_exact_matches_intra_sma(rolling_kernel, product):
+    df = _panel(product, seed=1)
+    windows = [5, 10, 15, 30, 60]
+    results = intraSma_multi(df, windows, exact=True)
+    for window in windows:
+        pd.testing.assert_frame_equal(results[window], intraSma(df, window), check_exact=True)
+
+
+@pytest.mark.parametrize('product', ['IC', 'au'])
+def test_intra_sma_multi_prefix_within_bound(rolling_kernel, product):
+    df = _panel(product, seed=1)
+    windows = [1, 5, 10, 15, 30, 60, 1000]
+    results = intraSma_multi(df, windows)
+    for window in windows:
+        _assert_within(results[window], intraSma(df, window), _tolerance(df, window))
+
+
+def test_prefix_sums_exact_zero_after_large_values(rolling_kernel):
+    # 段内先出现大值后全为0的窗口，前缀相减的结果仍为0，非负输入不出现负数
+    values = np.zeros((240, 2))
+    values[:5, 0] = [1e13, 0.1, 3.3e7, 1e-3, 7.0]
+    values[:5, 1] = [-2.5e12, -0.3, -1e5, -7.0, -1e-4]
+    starts, ends = np.array([0, 120]), np.array([120, 240])
+    sums = rollutils.segmented_rolling_sum_multi(values, starts, ends, [3, 5, 30])
+    means = rollutils.segmented_rolling_mean_multi(values, starts, ends, [3, 5, 30])
+    for window, window_sums, window_means in zip([3, 5, 30], sums, means):
+        assert (window_sums[window + 4:] == 0).all() and (window_means[window + 4:] == 0).all()
+        assert (window_sums[:, 0] >= 0).all() and (window_sums[:, 1] <= 0).all()
+    np.testing.assert_allclose(sums[1][4], values[:5].sum(axis=0), rtol=1e-15)
+
+
+def test_segmented_rolling_sum_multi_matches_single(rolling_kernel):
+    df = _panel('au', seed=2)
+    segments = SegmentIndex(df.index)
+    values = df.to_numpy()
+    multi = rollutils.segmented_rolling_sum_multi(values, segments.starts, segments.ends, [3, 7, 240], exact=True)
+    for k, window in enumerate([3, 7, 240]):
+        np.testing.assert_array_equal(multi[k], rollutils.segmented_rolling_sum(values, segments.starts,
+                                                                                segments.ends, window))
+
+
+# %% 指数加权均值
+@pytest.fixture(params=['compiled', 'numpy'])
+def ewma_kernel(request, monkeypatch):
+    if request.param == 'numpy':
+        monkeypatch.setattr(rollutils, '_segmented_ewma_kernel', rollutils._segmented_ewma_numpy)
+    elif rollutils.njit is None:
+        pytest.skip('没有安装numba')
+    return request.param
+
+
+@pytest.mark.parametrize('product', ['IC', 'au'])
+@pytest.mark.parametrize('span', [2, 10, 120])
+def test_intra_ewma_matches_per_day_pandas(ewma_kernel, product, span):
+    df = _panel(product, seed=3)
+    expected = _per_day(df, lambda g: g.ewm(span=span, min_periods=1, adjust=True).mean())
+    pd.testing.assert_frame_equal(intraEwma(df, span), expected, check_exact=True, check_freq=False)
+
+
+def test_intra_ewma_multi_matches_intra_ewma(ewma_kernel):
+    df = _panel('au', seed=4)
+    spans = [10, 20, 30, 60, 120]
+    results = intraEwma_multi(df, spans)
+    for span in spans:
+        pd.testing.assert_frame_equal(results[span], intraEwma(df, span), check_exact=True)
+
+
+def test_intra_t_ewma_restarts_after_gaps(ewma_kernel):
+    # 原实现：相邻时间戳间隔超过freq处开始新的一组
+    df = _panel('au', seed=5)
+    groups = np.cumsum(np.concatenate([[True], (df.index[1:] - df.index[:-1]) > pd.Timedelta('1min')]))
+    expected = pd.DataFrame(index=df.index, columns=df.columns, dtype=np.float64)
+    for _, group in df.groupby(groups):
+        expected.loc[group.index] = group.ewm(span=20, min_periods=1, adjust=True).mean()
+    pd.testing.assert_frame_equal(intraTEwma(df, 20, freq='1min'), expected, check_exact=True, check_freq=False)
+
+
+# %% 滚动最小、最大值
+@pytest.fixture(params=['compiled', 'numpy'])
+def extrema_kernel(request, monkeypatch):
+    if request.param == 'numpy':
+        monkeypatch.setattr(rollutils, '_segmented_rolling_extrema_kernel',
+                            rollutils._segmented_rolling_extrema_numpy)
+    elif rollutils.njit is None:
+        pytest.skip('没有安装numba')
+    return request.param
+
+
+@pytest.mark.parametrize('product', ['IC', 'au'])
+@pytest.mark.parametrize('window', [1, 7, 30, 1000])
+def test_intra_rmin_rmax_match_per_day_pandas(extrema_kernel, product, window):
+    df = _panel(product, seed=6)
+    df.iloc[200:260, 1] = np.nan
+    expected_min = _per_day(df, lambda g: g.rolling(window, min_periods=1).min())
+    expected_max = _per_day(df, lambda g: g.rolling(window, min_periods=1).max())
+    pd.testing.assert_frame_equal(intraRmin(df, window), expected_min, check_exact=True, check_freq=False)
+    pd.testing.assert_frame_equal(intraRmax(df, window), expected_max, check_exact=True, check_freq=False)
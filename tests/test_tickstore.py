@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+tick缓存的合约行范围索引与直接过滤原始csv的一致性；
+输入指纹：HTTP原始文件由HEAD得到，原始文件变化后缓存重新转换；
+预下载的字节预算：下载开始前按估计大小预留，下载中的文件同样占用预算
+"""
+import os
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from utils.tickstore import TICK_FILE_NAME, TRADE_FLOW_COLUMNS, TickStore, TickPrefetcher
+
+
+INSTRUMENTS = ['au2402', 'IF2401', 'IC2401', 'IC2402', 'rb2405']
+
+
+def _write_raw_csv(base_dir, date, n=600, seed=0):
+    """
+    按时间顺序写出多个合约交错的原始行情
+    """
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(9 * 3600, 15 * 3600, size=n))
+    bid = 5000 + rng.integers(-20, 20, size=n)
+    data = pd.DataFrame({
+        'InstruID': rng.choice(INSTRUMENTS, size=n, p=[0.4, 0.3, 0.2, 0.07, 0.03]),
+        'TradDay': date,
+        'UpdateTime': [f'{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}.{ms:03d}'
+                       for s, ms in zip(seconds, rng.integers(0, 1000, size=n))],
+        'LastPrice': bid + 0.5,
+        'Volume': np.arange(n) * 2,
+        'Turnover': np.arange(n) * 2.0e6,
+        'BidPrice1': bid.astype(float),
+        'AskPrice1': bid + 1.0,
+    })
+    (base_dir / date).mkdir(parents=True, exist_ok=True)
+    data.to_csv(base_dir / date / TICK_FILE_NAME, index=False)
+
+
+def _plain(data):
+    data = data.reset_index(drop=True)
+    if 'InstruID' in data.columns:
+        data['InstruID'] = data['InstruID'].astype(str)
+    return data
+
+
+@pytest.fixture
+def raw_base(tmp_path):
+    base_dir = tmp_path / 'raw'
+    _write_raw_csv(base_dir, '20240130')
+    return base_dir
+
+
+def test_instrument_index_covers_sorted_rows(raw_base, tmp_path):
+    tick_store = TickStore(str(raw_base), cache_dir=tmp_path / 'cache', row_group_size=64)
+    full = tick_store.load_ticks('20240130')
+    instru_index = tick_store.instrument_index('20240130')
+
+    assert sorted(instru_index) == sorted(INSTRUMENTS)
+    ranges = sorted(instru_index.values())
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(full)
+    assert all(prev[1] == curr[0] for prev, curr in zip(ranges, ranges[1:]))
+    for instru, (start, end) in instru_index.items():
+        assert (full['InstruID'].iloc[start:end].astype(str) == instru).all()
+
+
+@pytest.mark.parametrize('instru_id', ['IC2401', 'rb2405', ['IF2401', 'IC2402'], 'ag2406'])
+def test_load_ticks_by_index_matches_raw_filter(raw_base, tmp_path, instru_id):
+    columns = [col for col in TRADE_FLOW_COLUMNS if col != 'InstruID']
+    raw_store = TickStore(str(raw_base))
+    expected = raw_store.load_ticks('20240130', instru_id=instru_id, columns=['InstruID'] + columns)
+
+    # 合约内部保持原始行情顺序
+    tick_store = TickStore(str(raw_base), cache_dir=tmp_path / 'cache', row_group_size=64)
+    pd.testing.assert_frame_equal(_plain(tick_store.load_ticks('20240130', instru_id=instru_id,
+                                                               columns=['InstruID'] + columns)),
+                                  _plain(expected))
+    pd.testing.assert_frame_equal(_plain(tick_store.load_ticks('20240130', instru_id=instru_id, columns=columns)),
+                                  _plain(expected[columns]))
+
+    # 没有索引的旧版本缓存文件回退到按InstruID过滤
+    path = tick_store.tick_path('20240130')
+    table = pq.read_table(path)
+    pq.write_table(table.replace_schema_metadata({}), path, row_group_size=64)
+    assert tick_store.instrument_index('20240130') is None
+    pd.testing.assert_frame_equal(_plain(tick_store.load_ticks('20240130', instru_id=instru_id, columns=columns)),
+                                  _plain(expected[columns]))
+
+
+def test_cache_refreshes_when_source_changes(raw_base, tmp_path):
+    tick_store = TickStore(str(raw_base), cache_dir=tmp_path / 'cache', check_source=True)
+    first = tick_store.load_ticks('20240130')
+    fingerprint = tick_store.fingerprint('20240130')
+    assert fingerprint is not None and not tick_store.is_stale('20240130')
+
+    # 原始文件变化后，新的实例判定缓存落后，结果指纹为None，读取时重新转换
+    raw_path = raw_base / '20240130' / TICK_FILE_NAME
+    _write_raw_csv(raw_base, '20240130', n=700, seed=1)
+    os.utime(raw_path, ns=(raw_path.stat().st_atime_ns, raw_path.stat().st_mtime_ns + 10 ** 9))
+    tick_store = TickStore(str(raw_base), cache_dir=tmp_path / 'cache', check_source=True)
+    assert tick_store.fingerprints(['20240130']) == {'20240130': None}
+    assert tick_store.fingerprint('20240130') is None
+    assert len(tick_store.load_ticks('20240130')) == 700 != len(first)
+    assert tick_store.fingerprint('20240130') not in (None, fingerprint)
+
+    # 不检查原始文件时沿用已有缓存
+    _write_raw_csv(raw_base, '20240130', n=800, seed=2)
+    assert len(TickStore(str(raw_base), cache_dir=tmp_path / 'cache').load_ticks('20240130')) == 700
+
+
+# %% 预下载
+DATES = ['20240129', '20240130', '20240131', '20240201']
+FILE_SIZE = 1000
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_base(tmp_path):
+    root = tmp_path / 'remote'
+    for date in DATES:
+        (root / date).mkdir(parents=True)
+        (root / date / TICK_FILE_NAME).write_bytes(b'x' * FILE_SIZE)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_prefetch_reserves_budget_before_download(http_base, tmp_path):
+    tick_store = TickStore(http_base, staging_dir=tmp_path / 'staging')
+    prefetcher = TickPrefetcher(tick_store, max_workers=4, byte_budget=int(FILE_SIZE * 2.5))
+    prefetcher.start(DATES)
+    try:
+        prefetcher.wait(DATES[0])
+        prefetcher.wait(DATES[1])
+        time.sleep(0.2)
+        # 第三个文件的预留会超出预算，即使还有空闲的下载线程也不开始
+        assert prefetcher.used_bytes == 2 * FILE_SIZE
+        assert sorted(p.name for p in tick_store.staging_dir.glob(f'*_{TICK_FILE_NAME}')) == [
+            f'{date}_{TICK_FILE_NAME}' for date in DATES[:2]]
+
+        prefetcher.release(DATES[0])
+        prefetcher.wait(DATES[2])
+        assert tick_store.staged_path(DATES[2]).stat().st_size == FILE_SIZE
+        assert prefetcher.used_bytes == 2 * FILE_SIZE
+        assert not tick_store.staged_path(DATES[3]).exists()
+    finally:
+        prefetcher.close()
+    assert prefetcher.used_bytes == 0
+
+
+def test_remote_fingerprint_without_cache(http_base, tmp_path):
+    # 没有本地缓存时由HEAD的Content-Length和Last-Modified得到指纹，文件不存在时为None
+    fingerprint = TickStore(http_base).fingerprint(DATES[0])
+    assert fingerprint is not None and fingerprint.startswith(f'{FILE_SIZE}-')
+    assert TickStore(http_base).fingerprints(DATES[:2]) == {date: fingerprint for date in DATES[:2]}
+    assert TickStore(http_base).fingerprint('20240301') is None
+
+    raw_path = tmp_path / 'remote' / DATES[0] / TICK_FILE_NAME
+    raw_path.write_bytes(b'x' * (FILE_SIZE + 1))
+    assert TickStore(http_base).fingerprint(DATES[0]) != fingerprint
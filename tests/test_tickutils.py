@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+tick级别计算内核与原pandas实现的一致性：主买主卖方向判断，按时间网格聚合
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import tickutils
+from utils.tickutils import classify_trade_direction, grid_bar_ids, reduce_bars
+from utils.tickstore import tick_datetime
+from utils.timeutils import get_a_share_intraday_time_series
+
+
+MULTIPLIER = 200.0
+
+
+def _ticks(n, seed, chained_carry):
+    """
+    构造带大量midprice不变、vwap == midprice和零成交tick的序列；
+    chained_carry为False时，vwap == midprice的tick不会连续出现
+    """
+    rng = np.random.default_rng(seed)
+    bid = 5000 + np.cumsum(rng.choice([-1, 0, 0, 0, 1], size=n)).astype(float)
+    ask = bid + rng.choice([1, 2], size=n)
+    volume = rng.choice([0, 1, 2, 5], size=n).astype(float)
+    midprice = (bid + ask) / 2
+    turnover = (midprice + rng.choice([-0.5, 0.5], size=n)) * volume * MULTIPLIER
+
+    # 只有标记的tick满足 vwap == midprice 且 midprice不变（整数与半整数的乘除均为精确浮点运算）
+    carry = rng.random(n) < 0.3
+    carry[0] = False
+    if not chained_carry:
+        carry[1:] &= ~carry[:-1]
+    volume[carry] = np.maximum(volume[carry], 1)
+    for i in np.flatnonzero(carry):
+        bid[i], ask[i] = bid[i - 1], ask[i - 1]
+    midprice = (bid + ask) / 2
+    turnover[carry] = midprice[carry] * volume[carry] * MULTIPLIER
+    return np.cumsum(turnover), np.cumsum(volume), bid, ask
+
+
+def _baseline_direction(cum_turnover, cum_volume, bid1, ask1, multiplier):
+    """
+    原 calc_order_flow_per_fut_per_day 中按优先级逐层赋值的pandas实现
+    """
+    data = pd.DataFrame({'Turnover': cum_turnover, 'Volume': cum_volume, 'BidPrice1': bid1, 'AskPrice1': ask1})
+    data['turnover'] = data['Turnover'].diff()
+    data['volume'] = data['Volume'].diff()
+    data['vwap'] = data['turnover'] / data['volume'] / multiplier
+    data['midprice'] = (data['BidPrice1'] + data['AskPrice1']) / 2
+    data['midprice_diff'] = data['midprice'].diff()
+
+    data['trade_direction'] = 0
+    data.loc[data['midprice_diff'] > 0, 'trade_direction'] = 1
+    data.loc[data['midprice_diff'] < 0, 'trade_direction'] = -1
+    midprice_unchanged = (data['midprice_diff'] == 0) | data['midprice_diff'].isna()
+    data.loc[midprice_unchanged & (data['vwap'] > data['midprice']), 'trade_direction'] = 1
+    data.loc[midprice_unchanged & (data['vwap'] < data['midprice']), 'trade_direction'] = -1
+    vwap_eq_midprice = midprice_unchanged & (data['vwap'] == data['midprice'])
+    data.loc[vwap_eq_midprice, 'trade_direction'] = data['trade_direction'].shift(1).fillna(0)
+
+    data['act_buy_amount'] = 0.0
+    data['act_sell_amount'] = 0.0
+    data.loc[data['trade_direction'] == 1, 'act_buy_amount'] = data.loc[data['trade_direction'] == 1, 'turnover']
+    data.loc[data['trade_direction'] == -1, 'act_sell_amount'] = data.loc[data['trade_direction'] == -1, 'turnover']
+    return (data['trade_direction'].to_numpy(), data['act_buy_amount'].to_numpy(),
+            data['act_sell_amount'].to_numpy())
+
+
+@pytest.fixture(params=['compiled', 'numpy'])
+def classify_kernel(request, monkeypatch):
+    if request.param == 'numpy':
+        monkeypatch.setattr(tickutils, '_classify_trade_direction_kernel',
+                            tickutils._classify_trade_direction_numpy)
+    return request.param
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_classifier_matches_pandas_baseline(classify_kernel, seed):
+    arrays = _ticks(2000, seed, chained_carry=False)
+    direction, buy, sell = classify_trade_direction(*arrays, MULTIPLIER)
+    expected_direction, expected_buy, expected_sell = _baseline_direction(*arrays, MULTIPLIER)
+
+    assert direction.dtype == np.int8
+    np.testing.assert_array_equal(direction, expected_direction)
+    np.testing.assert_array_equal(buy, expected_buy)
+    np.testing.assert_array_equal(sell, expected_sell)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_classifier_kernels_agree_on_chained_carry(seed):
+    arrays = [np.ascontiguousarray(arr) for arr in _ticks(2000, seed, chained_carry=True)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        loop = tickutils._classify_trade_direction_loop(*arrays, MULTIPLIER)
+    vectorized = tickutils._classify_trade_direction_numpy(*arrays, MULTIPLIER)
+    compiled = classify_trade_direction(*arrays, MULTIPLIER)
+    for expected, numpy_result, compiled_result in zip(loop, vectorized, compiled):
+        np.testing.assert_array_equal(numpy_result, expected)
+        np.testing.assert_array_equal(compiled_result, expected)
+
+
+def test_classifier_carries_direction_over_runs():
+    # tick 1 midprice上升为主买，tick 2~4 midprice不变且vwap == midprice，连续延续主买
+    bid = np.array([100.0, 101.0, 101.0, 101.0, 101.0])
+    ask = bid + 1
+    volume = np.array([0.0, 1.0, 2.0, 1.0, 3.0])
+    turnover = np.array([0.0, 101.0, 101.5, 101.5, 101.5]) * volume * MULTIPLIER
+    direction, buy, sell = classify_trade_direction(np.cumsum(turnover), np.cumsum(volume), bid, ask, MULTIPLIER)
+
+    np.testing.assert_array_equal(direction, [0, 1, 1, 1, 1])
+    np.testing.assert_array_equal(buy, turnover * [0, 1, 1, 1, 1])
+    np.testing.assert_array_equal(sell, np.zeros(5))
+
+
+# %% 按时间网格聚合
+DAY_PERIODS = {'morning': ('09:31:00', '11:30:00'), 'afternoon': ('13:01:00', '15:00:00')}
+NIGHT_PERIODS = {'night': ('21:01:00', '23:00:00'), **DAY_PERIODS}
+
+
+def _tick_times(n, seed, with_night):
+    """
+    当日零点起的纳秒偏移，覆盖开盘前、午休、收盘后和整分钟边界上的tick
+    """
+    rng = np.random.default_rng(seed)
+    minute_ns = 60 * 1_000_000_000
+    starts = [8 * 60 + 55, 11 * 60 + 25, 14 * 60 + 55] + ([20 * 60 + 55] if with_night else [])
+    ends = [11 * 60 + 35, 13 * 60 + 5, 15 * 60 + 5] + ([23 * 60 + 5] if with_night else [])
+    blocks = []
+    for start, end in zip(starts, ends):
+        blocks.append(rng.integers(start * minute_ns, end * minute_ns, size=n))
+        blocks.append(rng.integers(start, end, size=n // 10) * minute_ns)
+    time_ns = np.concatenate(blocks)
+    # 夜盘在前，与交易日内的行情顺序一致
+    return time_ns[np.argsort(np.where(time_ns >= 18 * 60 * minute_ns, time_ns - 24 * 60 * minute_ns, time_ns),
+                              kind='stable')]
+
+
+@pytest.mark.parametrize('interval, periods', [
+    ('1min', DAY_PERIODS),
+    ('5min', {'morning': ('09:35:00', '11:30:00'), 'afternoon': ('13:05:00', '15:00:00')}),
+    ('1min', NIGHT_PERIODS),
+])
+def test_grid_bar_sum_matches_resample(interval, periods):
+    rng = np.random.default_rng(7)
+    time_ns = _tick_times(3000, 7, with_night='night' in periods)
+    day_ns = np.full(len(time_ns), np.datetime64('2024-01-30', 'ns').view('i8'))
+    values = rng.normal(size=(len(time_ns), 2))
+    values[rng.random(len(time_ns)) < 0.05, 0] = np.nan
+
+    interval_seconds = pd.Timedelta(interval).seconds
+    grid = get_a_share_intraday_time_series(datetime(2024, 1, 30), {'seconds': interval_seconds},
+                                            trading_periods=periods)
+    bar_ids, in_grid = grid_bar_ids(day_ns, time_ns, grid, interval_seconds)
+    output = np.column_stack([reduce_bars(bar_ids, values[in_grid, i], len(grid), how='sum') for i in range(2)])
+
+    # 原实现：按时间戳 resample 右闭右标签求和，再 reindex 到网格
+    ticks = pd.DataFrame(values, index=tick_datetime(pd.DataFrame({'TradDay': day_ns, 'UpdateTime': time_ns})))
+    expected = (ticks.resample(interval, closed='right', label='right').sum()
+                .reindex(index=pd.DatetimeIndex(grid)).fillna(0.0))
+
+    assert output.shape == (len(grid), 2)
+    np.testing.assert_allclose(output, expected.to_numpy(), rtol=1e-12, atol=1e-12)
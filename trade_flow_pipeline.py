@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jul 21 2025
+
+@author: Xintang Zheng
+
+期货主买主卖量日常流程入口
+在同一个进程中依次执行 raw_fac 计算 → 合并 → trans 因子计算，
+各阶段复用同一个常驻执行器，worker只启动、预加载模块和预热内核一次（见 utils.parallelutils.get_worker_pool）
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import sys
+import time
+from pathlib import Path
+
+# %% add sys path
+file_path = Path(__file__).resolve()
+project_dir = file_path.parents[0]
+sys.path.append(str(project_dir))
+
+# %%
+from raw_fac.trade_flow.trade_flow_mp import calc_order_flow_for_all_parallel
+from raw_fac.trade_flow.merge_trade_flow import merge_all_trade_flow_data
+from trans_fac.trans_trade_flow import main as calc_trade_flow_factors
+from utils.products import available_products
+
+
+# %%
+def run_trade_flow_pipeline(zhuli_dir, data_base_path, raw_root_dir, merged_save_dir, factor_save_dir,
+                            params, trans_config, fut_list=None, tick_cache_dir=None, max_workers=None,
+                            prefetch_workers=0, memmap=False):
+    """
+    依次执行主买主卖量计算、合并和因子计算
+
+    参数:
+    zhuli_dir (Path): 主力合约数据目录
+    data_base_path (str): 原始tick数据基础路径
+    raw_root_dir (Path): 逐品种逐日结果的根目录，即trade_flow_mp.py的save_dir
+    merged_save_dir (Path): 合并数据目录
+    factor_save_dir (Path): 因子保存目录
+    params (dict): trade_flow_mp.py的参数，interval为单个间隔
+    trans_config (dict): trans_trade_flow.main的配置
+    fut_list (list): 品种列表，None表示主力合约目录中所有已登记元数据的品种
+    tick_cache_dir (Path): tick数据本地列式缓存目录
+    max_workers (int): 最大并行工作进程数，None表示CPU核心数，各阶段共用
+    prefetch_workers (int): 预下载原始csv的线程数，0表示不预下载
+    memmap (bool): 合并时是否输出内存映射面板，trans阶段随之使用内存映射格式
+    """
+    if fut_list is None:
+        fut_list = available_products(zhuli_dir)
+
+    stage_start = time.time()
+    print('🚀 [1/3] 计算主买主卖量')
+    raw_data_dir = calc_order_flow_for_all_parallel(
+        fut_list=fut_list,
+        zhuli_dir=zhuli_dir,
+        data_base_path=data_base_path,
+        save_dir=raw_root_dir,
+        params=params,
+        max_workers=max_workers,
+        tick_cache_dir=tick_cache_dir,
+        prefetch_workers=prefetch_workers
+    )
+    print(f'⏰ 阶段耗时 {time.time() - stage_start:.1f} 秒')
+
+    stage_start = time.time()
+    print('🚀 [2/3] 合并主买主卖量')
+    merge_all_trade_flow_data(
+        raw_data_dir=raw_data_dir,
+        zhuli_dir=zhuli_dir,
+        merged_save_dir=merged_save_dir,
+        fut_list=fut_list,
+        params=params,
+        n_jobs=max_workers,
+        memmap=memmap
+    )
+    print(f'⏰ 阶段耗时 {time.time() - stage_start:.1f} 秒')
+
+    stage_start = time.time()
+    print('🚀 [3/3] 计算主买主卖因子')
+    calc_trade_flow_factors(merged_save_dir, factor_save_dir, {**trans_config, 'memmap': memmap})
+    print(f'⏰ 阶段耗时 {time.time() - stage_start:.1f} 秒')
+
+
+# %% 主函数
+if __name__ == '__main__':
+    # 路径配置，与各阶段脚本的主函数一致
+    zhuli_dir = Path('/mnt/nfs/30.132_xt_data1/future_zhuli')
+    data_base_path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup'
+    tick_cache_dir = Path('/mnt/Data/xintang/future_data/tick_cache')
+    raw_root_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_raw')
+    merged_save_dir = Path('/mnt/Data/xintang/future_factors/trade_flow_merged')
+    factor_save_dir = Path('/mnt/Data/xintang/index_factors/trade_flow/v0')
+
+    params = {
+        'interval': '1min',  # 不指定keep_periods时每个品种按元数据中的交易时段（含夜盘）生成时间网格
+    }
+
+    trans_config = {
+        'smooth_params': {
+            'intraSma': [5, 10, 15, 30, 60],
+            'intraTEwma': [{'span': span, 'freq': '1min'} for span in (10, 20, 30, 60, 120)],
+        },
+        'imb_methods': ['imb01'],
+        'start': None,
+        'end': None,
+        'products': None,
+    }
+
+    run_trade_flow_pipeline(
+        zhuli_dir=zhuli_dir,
+        data_base_path=data_base_path,
+        raw_root_dir=raw_root_dir,
+        merged_save_dir=merged_save_dir,
+        factor_save_dir=factor_save_dir,
+        params=params,
+        trans_config=trans_config,
+        tick_cache_dir=tick_cache_dir,
+        max_workers=None,  # 自动使用CPU核心数
+        prefetch_workers=4
+    )
+
+    print('期货主买主卖量日常流程完成！')
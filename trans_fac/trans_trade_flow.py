@@ -10,9 +10,9 @@ Created on Wed Jul 02 2025
 import os
 import sys
 from pathlib import Path
-import pandas as pd
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import Future
 import traceback
 
 # 添加项目路径
@@ -20,81 +20,132 @@ file_path = Path(__file__).resolve()
 project_dir = file_path.parents[1]
 sys.path.append(str(project_dir))
 
-from operators.ts_intraday import intraSma, intraTEwma
+from operators.ts_intraday import intraSma_multi, intraTEwma_multi, SegmentIndex
 from operators.fundamental import imb01, imb02, imb03, imb04, imb05, imb06, imb07, imb08, imb09, imb10, imb01_rob
+from utils.parallelutils import get_worker_pool
+from utils.panelstore import load_panel, MemmapPanel
 
 
-def load_trade_flow_data(merged_data_dir):
+def load_trade_flow_data(merged_data_dir, start=None, end=None, products=None, memmap=False):
     """
-    加载合并好的trade flow数据
+    加载合并好的trade flow数据，只读取指定交易日范围和品种的部分
     
     Parameters:
     -----------
     merged_data_dir : Path
         合并数据的目录路径
+    start, end : str
+        起止交易日（包含），如 '20240101'，None表示不限
+    products : list
+        品种列表，None表示全部
+    memmap : bool
+        是否使用内存映射格式（合并时需指定memmap=True），返回MemmapPanel引用，
+        各平滑进程映射同一文件，不反序列化也不复制
         
     Returns:
     --------
-    tuple: (act_buy_amount, act_sell_amount) DataFrame对象
+    tuple: (act_buy_amount, act_sell_amount) DataFrame对象，memmap=True时为MemmapPanel
     """
     print("📊 加载trade flow数据...")
     
-    # 加载主买量和主卖量数据
-    buy_path = merged_data_dir / 'act_buy_amount.parquet'
-    sell_path = merged_data_dir / 'act_sell_amount.parquet'
-    
-    if not buy_path.exists():
-        raise FileNotFoundError(f"未找到主买量数据文件: {buy_path}")
-    
-    if not sell_path.exists():
-        raise FileNotFoundError(f"未找到主卖量数据文件: {sell_path}")
-    
-    act_buy_amount = pd.read_parquet(buy_path)
-    act_sell_amount = pd.read_parquet(sell_path)
+    if memmap:
+        # 打印的形状和时间范围只读取索引文件，不读取值
+        act_buy_amount = buy_view = MemmapPanel(merged_data_dir, 'act_buy_amount', start, end, products)
+        act_sell_amount = sell_view = MemmapPanel(merged_data_dir, 'act_sell_amount', start, end, products)
+    else:
+        # 加载主买量和主卖量数据（只读取相关的月份分区、交易日和品种列）
+        act_buy_amount = buy_view = load_panel(merged_data_dir, 'act_buy_amount', start, end, products)
+        act_sell_amount = sell_view = load_panel(merged_data_dir, 'act_sell_amount', start, end, products)
     
     print(f"✅ 数据加载完成")
-    print(f"   📈 主买量数据形状: {act_buy_amount.shape}")
-    print(f"   📉 主卖量数据形状: {act_sell_amount.shape}")
-    print(f"   📅 时间范围: {act_buy_amount.index[0]} 至 {act_buy_amount.index[-1]}")
-    print(f"   🏷️  期货品种: {list(act_buy_amount.columns)}")
+    print(f"   📈 主买量数据形状: {buy_view.shape}")
+    print(f"   📉 主卖量数据形状: {sell_view.shape}")
+    print(f"   📅 时间范围: {buy_view.index[0]} 至 {buy_view.index[-1]}")
+    print(f"   🏷️  期货品种: {list(buy_view.columns)}")
     
     return act_buy_amount, act_sell_amount
 
 
-def apply_smoothing(data, smooth_params):
+def _smooth_panel(func, panel, kwargs):
+    """
+    在worker中映射内存映射面板后执行平滑，只有路径随任务传递
+    """
+    return func(panel.load(), **kwargs)
+
+
+def _completed(func, data, kwargs):
+    """
+    在本进程中直接计算，返回已完成的future，与提交到执行器的结果统一处理
+    """
+    future = Future()
+    future.set_result(func(data, **kwargs))
+    return future
+
+
+def apply_smoothing(data, smooth_params, n_jobs=None):
     """
-    对数据应用平滑处理
+    对数据应用平滑处理，各平滑配置并行计算，
+    时间索引的分段只计算一次（按日期、按各freq的间隔），所有配置共用
     
     Parameters:
     -----------
-    data : pd.DataFrame
-        输入数据
+    data : pd.DataFrame or MemmapPanel
+        输入数据，MemmapPanel时在常驻进程执行器中计算，各worker自行映射同一文件；
+        DataFrame时在本进程中用线程计算，不向其他进程复制面板
     smooth_params : dict
         平滑参数配置
+    n_jobs : int
+        最大并行进程（线程）数，None表示CPU核心数，实际数量不超过平滑配置数，1表示在本进程中逐个计算
         
     Returns:
     --------
     dict: 平滑后的数据字典，键为平滑方法名
     """
-    smoothed_data = {}
-    
     print(f"🔄 开始数据平滑处理...")
     
-    # intraSma 平滑
-    if 'intraSma' in smooth_params:
-        print(f"   📊 应用 intraSma...")
-        for window in tqdm(smooth_params['intraSma'], desc="intraSma"):
-            key = f"intraSma_{window}"
-            smoothed_data[key] = intraSma(data, window=window)
+    # 收集所有平滑任务
+    jobs = {}
+    # 内存映射面板只读取时间索引；跨月份时在本进程中写出一次连续文件，各worker直接映射
+    index = data.index
+    if isinstance(data, MemmapPanel):
+        data.prepare()
+    
+    # intraSma 平滑：所有窗口由同一个前缀和相减得到，与逐个调用intraSma只差舍入误差
+    day_segments = SegmentIndex(index)
+    windows = list(smooth_params.get('intraSma', []))
+    if windows:
+        jobs['intraSma'] = (intraSma_multi, {'windows': windows, 'segments': day_segments})
+    
+    # intraTEwma 平滑：同一freq的所有span在一个任务中一次遍历得到
+    spans_by_freq = {}
+    for config in smooth_params.get('intraTEwma', []):
+        spans_by_freq.setdefault(config['freq'], []).append(config['span'])
+    for freq, spans in spans_by_freq.items():
+        segments = SegmentIndex(index, by_day=False, freq=freq)
+        jobs[('intraTEwma', freq)] = (intraTEwma_multi, {'spans': spans, 'freq': freq, 'segments': segments})
     
-    # intraTEwma 平滑
-    if 'intraTEwma' in smooth_params:
-        print(f"   📈 应用 intraTEwma...")
-        for config in tqdm(smooth_params['intraTEwma'], desc="intraTEwma"):
-            span = config['span']
-            freq = config['freq']
-            key = f"intraTEwma_span{span}_freq{freq}"
-            smoothed_data[key] = intraTEwma(data, span=span, freq=freq)
+    if not jobs:
+        return {}
+    
+    # 内存映射面板：提交到常驻进程执行器，只传递路径，各worker映射同一文件；
+    # DataFrame：在本进程中计算，不复制面板，多个配置时用线程并行（numba内核计算时释放GIL）
+    if isinstance(data, MemmapPanel):
+        executor = get_worker_pool(n_tasks=len(jobs), max_workers=n_jobs)
+        futures = {key: executor.submit(_smooth_panel, func, data, kwargs) for key, (func, kwargs) in jobs.items()}
+    elif len(jobs) > 1 and n_jobs != 1:
+        executor = get_worker_pool(n_tasks=len(jobs), max_workers=n_jobs, executor_type='thread')
+        futures = {key: executor.submit(func, data, **kwargs) for key, (func, kwargs) in jobs.items()}
+    else:
+        futures = {key: _completed(func, data, kwargs) for key, (func, kwargs) in jobs.items()}
+    
+    smoothed_data = {}
+    for key, future in tqdm(futures.items(), desc="平滑处理"):
+        if key == 'intraSma':
+            smoothed_data.update({f"intraSma_{window}": frame for window, frame in future.result().items()})
+        else:
+            _, freq = key
+            smoothed_data.update({f"intraTEwma_span{span}_freq{freq}": frame
+                                  for span, frame in future.result().items()})
     
     return smoothed_data
 
@@ -209,11 +260,15 @@ def main(merged_data_dir, save_dir, config):
     save_dir : Path
         因子保存目录
     config : dict
-        配置参数
+        配置参数，可选start/end/products限定读取的交易日范围和品种，
+        memmap=True时使用内存映射格式
     """
     # try:
     # 1. 加载数据
-    act_buy_amount, act_sell_amount = load_trade_flow_data(merged_data_dir)
+    act_buy_amount, act_sell_amount = load_trade_flow_data(
+        merged_data_dir, config.get('start'), config.get('end'), config.get('products'),
+        memmap=config.get('memmap', False)
+    )
     
     # 2. 数据平滑
     print("\n🔄 处理主买量数据...")
@@ -260,7 +315,13 @@ if __name__ == '__main__':
         },
         
         # imbalance计算方法
-        'imb_methods': ['imb01']
+        'imb_methods': ['imb01'],
+        
+        # 读取范围（None表示全部）
+        'start': None,
+        'end': None,
+        'products': None,
+        'memmap': False,  # 合并时指定memmap=True后可用
     }
     
     # 路径配置
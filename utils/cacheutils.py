@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul 15 2025
+
+@author: Xintang Zheng
+
+结果缓存模块
+缓存目录按 (参数, 代码版本) 的哈希区分，不同参数的结果可以并存；
+每个目录下的manifest记录每个结果文件对应的输入指纹，输入变化或参数、代码版本变化时只重算失效的部分
+
+目录结构:
+    root_dir/{cache_key}/manifest.json
+    root_dir/{cache_key}/{fut}/{date}.parquet
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import os
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime
+
+
+# %% 原子写入
+def _tmp_path(path):
+    path = Path(path)
+    return path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+
+def atomic_to_parquet(df, path):
+    """
+    先写临时文件再重命名，避免中断或并发时留下写了一半的文件
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(path)
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(obj, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# %% 参数哈希
+def params_hash(params, code_version, length=12):
+    """
+    计算 (参数, 代码版本) 的哈希，参数需可JSON序列化
+    """
+    payload = json.dumps({'params': params, 'code_version': code_version}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:length]
+
+
+# %% 结果缓存
+class ResultCache:
+    """
+    按参数哈希分目录、由manifest记录输入指纹的逐品种逐日结果缓存
+
+    参数:
+    root_dir (Path): 缓存根目录
+    params (dict): 计算参数，参与哈希
+    code_version (str): 计算逻辑版本号，逻辑变化时修改以使旧结果失效
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, root_dir, params, code_version):
+        self.params = params
+        self.code_version = code_version
+        self.key = params_hash(params, code_version)
+        self.result_dir = Path(root_dir) / self.key
+        self.manifest_path = self.result_dir / self.MANIFEST_NAME
+        self.entries = self._load_entries()
+
+    def _load_entries(self):
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f).get('entries', {})
+
+    @staticmethod
+    def entry_key(fut, date):
+        return f'{fut}/{date}'
+
+    def path(self, fut, date):
+        return self.result_dir / fut / f'{date}.parquet'
+
+    def existing_dates(self, fut):
+        """
+        列一次目录，返回该品种已有结果文件的日期集合
+        """
+        fut_dir = self.result_dir / fut
+        if not fut_dir.exists():
+            return set()
+        return {name[:-len('.parquet')] for name in os.listdir(fut_dir) if name.endswith('.parquet')}
+
+    def is_valid(self, fut, date, instru_id, fingerprint, existing_dates=None):
+        """
+        判断缓存是否有效：manifest中有记录、合约和输入指纹均未变化且结果文件存在；
+        输入指纹为None（取不到输入文件指纹）时总是无效
+        """
+        if fingerprint is None:
+            return False
+        entry = self.entries.get(self.entry_key(fut, date))
+        if entry is None or entry.get('instru_id') != instru_id or entry.get('input') != fingerprint:
+            return False
+        if existing_dates is not None:
+            return date in existing_dates
+        return self.path(fut, date).exists()
+
+    def record(self, fut, date, instru_id, fingerprint, **extra):
+        """
+        记录一个已写入的结果，需调用save_manifest落盘
+        """
+        self.entries[self.entry_key(fut, date)] = {
+            'instru_id': instru_id,
+            'input': fingerprint,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            **extra
+        }
+
+    def save_manifest(self):
+        atomic_write_json({
+            'params': self.params,
+            'code_version': self.code_version,
+            'entries': self.entries
+        }, self.manifest_path)
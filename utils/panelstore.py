@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jul 17 2025
+
+@author: Xintang Zheng
+
+合并面板存储模块
+每个feature一个目录，按交易日所在月份分区，每个交易日一个row group；
+每次合并只改写新读取的日期所在的月份分区，merge_state记录每个品种已合并的日期；
+load_panel按日期范围裁剪分区、按row group统计信息过滤、只读取所需品种的列
+
+可选的内存映射格式：每个月份分区另存为按列连续的float64 .npy，时间索引和品种列表存在旁路文件中，
+每次合并只重写改动过的月份；MemmapPanel直接映射，不做反序列化，范围在一个月份内时为视图，
+跨月份时将范围写成一个连续的内存映射文件（只写一次），之后同样直接映射；多个进程映射同一文件时共用一份页缓存；
+时间索引、品种和形状只读取索引文件和旁路文件得到，不读取值
+
+目录结构:
+    merged_dir/merge_state.json
+    merged_dir/{feature}/{YYYYMM}.parquet
+    merged_dir/memmap/{feature}/{YYYYMM}.npy          (时间戳 × 品种，列优先)
+    merged_dir/memmap/{feature}/{YYYYMM}.index.npy    (int64纳秒时间戳)
+    merged_dir/memmap/{feature}.json                  (品种列表、已合并到的日期)
+    merged_dir/memmap/ranges/{feature}/{key}.npy      (跨月份范围的连续文件，合并改写该feature时删除)
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.cacheutils import atomic_write_json, _tmp_path
+from utils.timeutils import trading_day_row_offsets, NIGHT_SESSION_START
+
+
+# %%
+MERGE_STATE_NAME = 'merge_state.json'
+PANEL_LAYOUT = 'month'
+MEMMAP_DIR_NAME = 'memmap'
+MEMMAP_RANGES_DIR_NAME = 'ranges'
+
+
+# %% 合并状态
+def read_merge_state(merged_dir):
+    """
+    读取合并状态，不存在时返回None
+    """
+    state_path = Path(merged_dir) / MERGE_STATE_NAME
+    if not state_path.exists():
+        return None
+    with open(state_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_merge_state(merged_dir, state):
+    atomic_write_json(state, Path(merged_dir) / MERGE_STATE_NAME)
+
+
+def clear_panels(merged_dir, features):
+    """
+    删除各feature的全部分区（以及旧版的单文件面板）、内存映射面板和合并状态，用于全量重建
+    """
+    merged_dir = Path(merged_dir)
+    for feature in features:
+        shutil.rmtree(merged_dir / feature, ignore_errors=True)
+        (merged_dir / f'{feature}.parquet').unlink(missing_ok=True)
+    (merged_dir / MERGE_STATE_NAME).unlink(missing_ok=True)
+    shutil.rmtree(merged_dir / MEMMAP_DIR_NAME, ignore_errors=True)
+
+
+# %% 分区读写
+def panel_parts(merged_dir, feature):
+    """
+    返回feature的月份分区文件列表，按月份顺序排列
+    """
+    feature_dir = Path(merged_dir) / feature
+    if not feature_dir.exists():
+        return []
+    return sorted(feature_dir.glob('*.parquet'))
+
+
+def _write_partition(path, panel):
+    """
+    写入一个月份分区，每个交易日一个row group，使按时间过滤时可以跳过无关的交易日
+    """
+    table = pa.Table.from_pandas(panel, preserve_index=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with pq.ParquetWriter(tmp_path, table.schema) as writer:
+        for start, stop in trading_day_row_offsets(panel.index).values():
+            writer.write_table(table.slice(start, stop - start))
+    os.replace(tmp_path, path)
+
+
+def append_panel(merged_dir, feature, panel):
+    """
+    将新日期的面板按交易日所在月份追加到分区：新月份直接写入，已有月份与原数据拼接后改写，
+    不涉及其他月份
+
+    参数:
+    merged_dir (Path): 合并数据目录
+    feature (str): 特征名
+    panel (pd.DataFrame): 行为时间戳、列为品种的面板，时间均晚于已合并的数据
+    """
+    feature_dir = Path(merged_dir) / feature
+    months = {}
+    for date, (start, stop) in trading_day_row_offsets(panel.index).items():
+        month_start, _ = months.get(date[:6], (start, stop))
+        months[date[:6]] = (month_start, stop)
+
+    for month, (start, stop) in months.items():
+        path = feature_dir / f'{month}.parquet'
+        month_panel = panel.iloc[start:stop]
+        if path.exists():
+            month_panel = pd.concat([pd.read_parquet(path), month_panel], axis=0)
+        _write_partition(path, month_panel)
+
+
+def replace_panel_days(merged_dir, feature, month, panel, dates_by_column):
+    """
+    改写一个月份分区中部分品种、部分交易日的行：dates_by_column中列出的 (品种, 交易日) 取panel中的值，
+    其余取原分区中的值；panel中有而原分区中没有的时间戳并入分区，其他品种在这些时间戳上为0
+
+    参数:
+    merged_dir (Path): 合并数据目录
+    feature (str): 特征名
+    month (str): 交易日所在月份，YYYYMM
+    panel (pd.DataFrame): 该月份的面板，行为时间戳、列为品种
+    dates_by_column (dict): 品种 -> 需要替换的交易日列表，YYYYMMDD
+    """
+    path = Path(merged_dir) / feature / f'{month}.parquet'
+    if path.exists():
+        existing = pd.read_parquet(path)
+        index = existing.index.union(panel.index)
+        values = existing.reindex(index=index, columns=panel.columns, fill_value=0.0).to_numpy(dtype=np.float64, copy=True)
+        new_values = panel.reindex(index=index, fill_value=0.0).to_numpy(dtype=np.float64)
+    else:
+        index = panel.index
+        values = np.zeros(panel.shape)
+        new_values = panel.to_numpy(dtype=np.float64)
+
+    day_offsets = trading_day_row_offsets(index)
+    for j, fut in enumerate(panel.columns):
+        for date in dates_by_column.get(fut, []):
+            start, stop = day_offsets.get(date, (0, 0))
+            values[start:stop, j] = new_values[start:stop, j]
+    _write_partition(path, pd.DataFrame(values, index=index, columns=panel.columns))
+
+
+def _trading_day_bound(date, end=False):
+    """
+    交易日对应的时间戳边界：交易日从前一天的 NIGHT_SESSION_START 开始
+    """
+    day = pd.Timestamp(str(date)).normalize() + pd.Timedelta(days=1 if end else 0)
+    return day - (pd.Timedelta(days=1) - pd.Timedelta(NIGHT_SESSION_START))
+
+
+def load_panel(merged_dir, feature, start=None, end=None, products=None):
+    """
+    读取feature面板的一个切片：按月份裁剪分区，按row group的时间统计信息过滤交易日，只读取所需品种的列
+
+    参数:
+    merged_dir (Path): 合并数据目录
+    feature (str): 特征名
+    start (str or datetime): 起始交易日（包含），如 '20240101'，None表示不限
+    end (str or datetime): 结束交易日（包含），None表示不限
+    products (list): 品种列表，None表示全部
+
+    返回:
+    pd.DataFrame: 行为时间戳、列为品种
+    """
+    merged_dir = Path(merged_dir)
+    parts = panel_parts(merged_dir, feature)
+    if not parts:
+        legacy_path = merged_dir / f'{feature}.parquet'
+        if not legacy_path.exists():
+            raise FileNotFoundError(f'未找到 {feature} 的合并数据: {merged_dir / feature}')
+        parts = [legacy_path]
+    else:
+        first_month = pd.Timestamp(str(start)).strftime('%Y%m') if start is not None else None
+        last_month = pd.Timestamp(str(end)).strftime('%Y%m') if end is not None else None
+        parts = [path for path in parts
+                 if (first_month is None or path.stem >= first_month)
+                 and (last_month is None or path.stem <= last_month)]
+
+    schema = pq.read_schema(parts[0]) if parts else None
+    if schema is None:
+        return pd.DataFrame(columns=products, dtype=float, index=pd.DatetimeIndex([]))
+    index_column = schema.pandas_metadata['index_columns'][0]
+
+    filters = []
+    if start is not None:
+        filters.append((index_column, '>=', _trading_day_bound(start)))
+    if end is not None:
+        filters.append((index_column, '<', _trading_day_bound(end, end=True)))
+
+    columns = None
+    if products is not None:
+        missing = [fut for fut in products if fut not in schema.names]
+        if missing:
+            raise KeyError(f'合并数据中没有这些品种: {missing}')
+        columns = list(products) + [index_column]
+
+    panels = [pq.read_table(path, columns=columns, filters=filters or None).to_pandas() for path in parts]
+    return panels[0] if len(panels) == 1 else pd.concat(panels, axis=0)
+
+
+def read_panel(merged_dir, feature):
+    """
+    读取feature的完整面板：按月份顺序拼接所有分区，兼容旧版的单文件面板
+
+    返回:
+    pd.DataFrame: 行为时间戳、列为品种
+    """
+    return load_panel(merged_dir, feature)
+
+
+# %% 内存映射格式
+def _memmap_feature_dir(merged_dir, feature):
+    return Path(merged_dir) / MEMMAP_DIR_NAME / feature
+
+
+def _memmap_ranges_dir(merged_dir, feature):
+    return Path(merged_dir) / MEMMAP_DIR_NAME / MEMMAP_RANGES_DIR_NAME / feature
+
+
+def _save_npy(path, array):
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def write_memmap_panel(merged_dir, feature):
+    """
+    同步feature的内存映射面板：每个月份分区对应一组内存映射文件，只重写没有映射文件或分区比映射文件新的月份，
+    删除分区已不存在的月份，每次合并的耗时与改写的月份数成正比
+
+    参数:
+    merged_dir (Path): 合并数据目录
+    feature (str): 特征名
+    """
+    merged_dir = Path(merged_dir)
+    feature_dir = _memmap_feature_dir(merged_dir, feature)
+    feature_dir.mkdir(parents=True, exist_ok=True)
+    # 旧版的单文件内存映射面板
+    for name in (f'{feature}.npy', f'{feature}.index.npy'):
+        (merged_dir / MEMMAP_DIR_NAME / name).unlink(missing_ok=True)
+
+    parts = {path.stem: path for path in panel_parts(merged_dir, feature)}
+    for month, part_path in parts.items():
+        values_path = feature_dir / f'{month}.npy'
+        if values_path.exists() and values_path.stat().st_mtime_ns >= part_path.stat().st_mtime_ns:
+            continue
+        # 跨月份范围的连续文件由改写前的月份拼成，一并删除
+        shutil.rmtree(_memmap_ranges_dir(merged_dir, feature), ignore_errors=True)
+        panel = pd.read_parquet(part_path)
+        # 列优先存储：每个品种的时间序列连续，DataFrame按列取值时不需要跨步访问；先写时间索引，值文件最后写入
+        _save_npy(feature_dir / f'{month}.index.npy', np.asarray(panel.index, dtype='datetime64[ns]').view(np.int64))
+        _save_npy(values_path, np.asfortranarray(panel.to_numpy(dtype=np.float64)))
+    for path in feature_dir.glob('*.npy'):
+        if path.name.split('.')[0] not in parts:
+            path.unlink()
+
+    columns = []
+    if parts:
+        schema = pq.read_schema(next(iter(parts.values())))
+        index_columns = schema.pandas_metadata['index_columns']
+        columns = [name for name in schema.names if name not in index_columns]
+    state = read_merge_state(merged_dir) or {}
+    atomic_write_json({'columns': columns, 'last_date': state.get('last_date')},
+                      merged_dir / MEMMAP_DIR_NAME / f'{feature}.json')
+
+
+class MemmapPanel:
+    """
+    内存映射面板的引用：load时以只读方式映射文件并返回DataFrame，所选范围在一个月份内时映射该月份的文件，
+    跨多个月份时映射由prepare写出的范围连续文件；index、columns、shape只读取索引文件和旁路文件；
+    pickle时只传递路径和切片参数，在worker中重新映射，多个进程共用同一份页缓存
+
+    参数:
+    merged_dir (Path): 合并数据目录
+    feature (str): 特征名
+    start (str or datetime): 起始交易日（包含），None表示不限
+    end (str or datetime): 结束交易日（包含），None表示不限
+    products (list): 品种列表，None表示全部；品种在文件中连续时为视图，否则需要复制所选的列
+    """
+
+    def __init__(self, merged_dir, feature, start=None, end=None, products=None):
+        self.merged_dir = Path(merged_dir)
+        self.feature = feature
+        self.start = start
+        self.end = end
+        self.products = list(products) if products is not None else None
+
+    @property
+    def memmap_dir(self):
+        return self.merged_dir / MEMMAP_DIR_NAME
+
+    def months(self):
+        """
+        已有内存映射文件的月份，按顺序排列
+        """
+        feature_dir = _memmap_feature_dir(self.merged_dir, self.feature)
+        if not feature_dir.exists():
+            return []
+        return sorted(path.stem for path in feature_dir.glob('*.npy') if not path.name.endswith('.index.npy'))
+
+    def exists(self):
+        return (self.memmap_dir / f'{self.feature}.json').exists() and bool(self.months())
+
+    def _blocks(self):
+        """
+        只读取旁路文件和各月份的时间索引，确定所选范围
+
+        返回:
+        tuple: (blocks, columns, col_index)，blocks为 [(月份, 起始行, 结束行, 时间戳)]，只包含有数据的月份
+        """
+        if not self.exists():
+            raise FileNotFoundError(f'未找到 {self.feature} 的内存映射面板: {self.memmap_dir}')
+        with open(self.memmap_dir / f'{self.feature}.json', encoding='utf-8') as f:
+            columns = json.load(f)['columns']
+
+        first_month = pd.Timestamp(str(self.start)).strftime('%Y%m') if self.start is not None else None
+        last_month = pd.Timestamp(str(self.end)).strftime('%Y%m') if self.end is not None else None
+        months = [month for month in self.months()
+                  if (first_month is None or month >= first_month) and (last_month is None or month <= last_month)]
+
+        col_index = slice(None)
+        if self.products is not None:
+            missing = [fut for fut in self.products if fut not in columns]
+            if missing:
+                raise KeyError(f'合并数据中没有这些品种: {missing}')
+            positions = [columns.index(fut) for fut in self.products]
+            contiguous = positions == list(range(positions[0], positions[0] + len(positions))) if positions else True
+            col_index = slice(positions[0], positions[-1] + 1) if positions and contiguous else positions
+            columns = list(self.products)
+
+        feature_dir = _memmap_feature_dir(self.merged_dir, self.feature)
+        blocks = []
+        for month in months:
+            stamps = np.load(feature_dir / f'{month}.index.npy', mmap_mode='r')
+            row_start, row_stop = 0, len(stamps)
+            if self.start is not None:
+                row_start = int(np.searchsorted(stamps, _trading_day_bound(self.start).value))
+            if self.end is not None:
+                row_stop = int(np.searchsorted(stamps, _trading_day_bound(self.end, end=True).value))
+            if row_stop > row_start:
+                blocks.append((month, row_start, row_stop, np.asarray(stamps[row_start:row_stop])))
+        return blocks, columns, col_index
+
+    @property
+    def index(self):
+        blocks, _, _ = self._blocks()
+        stamps = np.concatenate([block[3] for block in blocks]) if blocks else np.empty(0, dtype=np.int64)
+        return pd.DatetimeIndex(stamps.view('datetime64[ns]'))
+
+    @property
+    def columns(self):
+        return pd.Index(self._blocks()[1])
+
+    @property
+    def shape(self):
+        blocks, columns, _ = self._blocks()
+        return sum(row_stop - row_start for _, row_start, row_stop, _ in blocks), len(columns)
+
+    def _range_path(self, blocks, columns):
+        """
+        跨月份范围的连续文件路径，由所选月份文件的修改时间、行范围和品种确定
+        """
+        feature_dir = _memmap_feature_dir(self.merged_dir, self.feature)
+        payload = json.dumps({
+            'blocks': [(month, row_start, row_stop, (feature_dir / f'{month}.npy').stat().st_mtime_ns)
+                       for month, row_start, row_stop, _ in blocks],
+            'columns': list(columns),
+        })
+        key = hashlib.sha1(payload.encode()).hexdigest()[:16]
+        return _memmap_ranges_dir(self.merged_dir, self.feature) / f'{key}.npy'
+
+    def prepare(self):
+        """
+        所选范围跨多个月份时，将其写成一个列优先的连续内存映射文件（已存在时跳过），之后load直接映射该文件；
+        在主进程中调用一次，避免各worker分别写出
+
+        返回:
+        Path or None: 范围连续文件的路径，范围在一个月份内时为None
+        """
+        blocks, columns, col_index = self._blocks()
+        if len(blocks) <= 1:
+            return None
+        range_path = self._range_path(blocks, columns)
+        if range_path.exists():
+            return range_path
+
+        range_path.parent.mkdir(parents=True, exist_ok=True)
+        feature_dir = _memmap_feature_dir(self.merged_dir, self.feature)
+        n_rows = sum(row_stop - row_start for _, row_start, row_stop, _ in blocks)
+        tmp_path = _tmp_path(range_path)
+        data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(n_rows, len(columns)),
+                                         fortran_order=True)
+        row = 0
+        for month, row_start, row_stop, _ in blocks:
+            values = np.load(feature_dir / f'{month}.npy', mmap_mode='r')
+            data[row:row + row_stop - row_start] = values[row_start:row_stop, col_index]
+            row += row_stop - row_start
+        data.flush()
+        del data
+        os.replace(tmp_path, range_path)
+        return range_path
+
+    def load(self):
+        """
+        返回:
+        pd.DataFrame: 行为时间戳、列为品种，数据为只读的内存映射视图（品种不连续时复制所选的列）；
+                      跨多个月份时映射prepare写出的连续文件，不在内存中拼接
+        """
+        blocks, columns, col_index = self._blocks()
+        if not blocks:
+            data = np.empty((0, len(columns)), order='F')
+        elif len(blocks) == 1:
+            month, row_start, row_stop, _ = blocks[0]
+            values = np.load(_memmap_feature_dir(self.merged_dir, self.feature) / f'{month}.npy', mmap_mode='r')
+            data = values[row_start:row_stop, col_index]
+        else:
+            range_path = self._range_path(blocks, columns)
+            if not range_path.exists():
+                range_path = self.prepare()
+            data = np.load(range_path, mmap_mode='r')
+        stamps = np.concatenate([block[3] for block in blocks]) if blocks else np.empty(0, dtype=np.int64)
+        index = pd.DatetimeIndex(stamps.view('datetime64[ns]'))
+        return pd.DataFrame(data, index=index, columns=columns, copy=False)
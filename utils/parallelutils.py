@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jul 14 2025
+
+@author: Xintang Zheng
+
+并行任务调度工具
+限制同时在途的任务数，可选按内存预算暂停提交，并统计每个worker的内存峰值；
+提供进程内常驻的共享执行器，raw_fac、merge、trans各阶段复用同一批已预加载模块、已预热内核的worker
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import os
+import time
+import atexit
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# %% 内存统计
+def get_peak_rss_mb():
+    """
+    当前进程的内存峰值(MB)，不支持的平台返回None
+    """
+    if resource is None:
+        return None
+    # Linux下ru_maxrss单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_total_rss_mb():
+    """
+    当前进程及其所有子进程的常驻内存之和(MB)，没有安装psutil时返回None
+    """
+    if psutil is None:
+        return None
+    proc = psutil.Process()
+    total = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            continue
+    return total / 1024 / 1024
+
+
+def call_with_peak_rss(func, task):
+    """
+    在worker中执行任务，并附带worker的pid、内存峰值和任务的起止时间
+    """
+    start = time.time()
+    result = func(task)
+    return result, os.getpid(), get_peak_rss_mb(), start, time.time()
+
+
+# %% 常驻执行器
+# worker启动时预加载的模块和预热的计算内核，取raw_fac、merge、trans各阶段所需的并集，
+# 各阶段使用默认参数时共用同一个进程执行器
+DEFAULT_PRELOAD = ('numpy', 'pandas', 'pyarrow', 'pyarrow.parquet', 'pyarrow.csv',
+                   'utils.tickstore', 'utils.tickfeatures', 'utils.rollutils', 'operators.ts_intraday')
+DEFAULT_WARMUP_MODULES = ('utils.tickutils', 'utils.rollutils')
+
+_worker_pools = {}
+_worker_pools_lock = threading.Lock()
+
+
+def _init_worker(preload, warmup):
+    """
+    worker启动时预加载模块并执行预热函数，之后的任务不再付出导入和编译开销
+    """
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+    if warmup is not None:
+        warmup()
+
+
+class _BoundedExecutor:
+    """
+    共享执行器的并发上限视图：同时提交到执行器的任务不超过max_workers，
+    达到上限时submit阻塞，任务结束（含失败、取消）后释放
+    """
+
+    def __init__(self, executor, max_workers):
+        self._executor = executor
+        self._max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    @property
+    def _broken(self):
+        return getattr(self._executor, '_broken', False)
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+def warm_up_worker():
+    """
+    默认的worker预热函数：调用各阶段计算模块的warm_up_kernels，使numba内核在worker启动时加载完成
+    """
+    for name in DEFAULT_WARMUP_MODULES:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        module.warm_up_kernels()
+
+
+def get_worker_pool(n_tasks=None, max_workers=None, executor_type='process', preload=DEFAULT_PRELOAD,
+                    warmup=warm_up_worker):
+    """
+    获取进程内常驻的共享执行器：已有执行器的worker数足够时直接复用，不足时关闭后按新规模重建，
+    各阶段用完后不关闭，进程退出时统一关闭。进程执行器按 (preload, warmup) 区分，
+    不同的worker初始化各自使用一个执行器，不会复用到未做相应预加载、预热的worker。
+    已有执行器的worker数多于本次所需时，返回限制并发数的视图，同时运行的任务数（及内存占用）不超过本次的worker数
+
+    参数:
+    n_tasks (int): 本阶段的任务数，worker数不超过任务数
+    max_workers (int): 最大worker数，None表示CPU核心数
+    executor_type (str): 'process' 或 'thread'
+    preload (tuple): 进程worker启动时预加载的模块名，默认为各阶段所需模块的并集
+    warmup (callable): 进程worker启动时执行的预热函数（需可pickle，如模块级函数），None表示不预热
+
+    返回:
+    ProcessPoolExecutor、ThreadPoolExecutor 或其并发上限视图，只应调用submit，调用方不应关闭；
+    executor._max_workers 为本次的并发上限
+    """
+    n_workers = max_workers or os.cpu_count() or 1
+    if n_tasks is not None:
+        n_workers = min(n_workers, n_tasks)
+    n_workers = max(1, n_workers)
+
+    # 线程执行器没有worker初始化，只按类型区分
+    key = (executor_type, tuple(preload), warmup) if executor_type == 'process' else (executor_type,)
+    with _worker_pools_lock:
+        pool, pool_size = _worker_pools.get(key, (None, 0))
+        if pool is not None and pool_size >= n_workers and not getattr(pool, '_broken', False):
+            return pool if pool_size == n_workers else _BoundedExecutor(pool, n_workers)
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+        if executor_type == 'process':
+            pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                       initargs=(tuple(preload), warmup))
+        else:
+            pool = ThreadPoolExecutor(max_workers=n_workers)
+        _worker_pools[key] = (pool, n_workers)
+        return pool
+
+
+@atexit.register
+def shutdown_worker_pools():
+    """
+    关闭所有常驻执行器
+    """
+    with _worker_pools_lock:
+        for pool, _ in _worker_pools.values():
+            pool.shutdown(wait=True)
+        _worker_pools.clear()
+
+
+# %% 有界提交
+def run_bounded(executor, func, tasks, max_in_flight, rss_budget_mb=None, worker_peak_rss=None,
+                poll_interval=1.0, on_task_done=None, task_spans=None):
+    """
+    按滑动窗口提交任务：同时在途的任务不超过max_in_flight，完成一个再补充一个
+
+    参数:
+    executor: ProcessPoolExecutor 或 ThreadPoolExecutor
+    func (callable): 任务函数，接收单个任务参数
+    tasks (iterable): 任务参数序列
+    max_in_flight (int): 最大在途任务数
+    rss_budget_mb (float): 可选，主进程及子进程常驻内存之和的预算(MB)，超出时暂停提交新任务
+                           （至少保留一个在途任务），需要安装psutil
+    worker_peak_rss (dict): 可选，传入时记录每个worker pid的内存峰值(MB)
+    poll_interval (float): 超出内存预算时的轮询间隔(秒)
+    on_task_done (callable): 可选，任务结束（成功或失败）时立即以task为参数回调，
+                             在执行器的回调线程中运行，不依赖调用方消费结果的进度
+    task_spans (list): 可选，传入时追加每个成功任务的 (pid, 开始时间, 结束时间)，用于统计核心利用率
+
+    返回:
+    generator: 按完成顺序产出 (task, result, error)，error为None表示成功
+    """
+    if rss_budget_mb is not None and psutil is None:
+        print('⚠ 未安装psutil，忽略内存预算 rss_budget_mb')
+        rss_budget_mb = None
+
+    max_in_flight = max(1, max_in_flight)
+    task_iter = iter(tasks)
+    in_flight = {}
+    exhausted = False
+
+    try:
+        while True:
+            # 补充任务直到窗口满或超出内存预算
+            while not exhausted and len(in_flight) < max_in_flight:
+                if (rss_budget_mb is not None and in_flight
+                        and get_total_rss_mb() > rss_budget_mb):
+                    break
+                try:
+                    task = next(task_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(call_with_peak_rss, func, task)
+                if on_task_done is not None:
+                    future.add_done_callback(lambda _, task=task: on_task_done(task))
+                in_flight[future] = task
+
+            if not in_flight:
+                return
+
+            timeout = poll_interval if rss_budget_mb is not None else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                task = in_flight.pop(future)
+                try:
+                    result, pid, peak_rss, start, end = future.result()
+                except Exception as e:
+                    yield task, None, e
+                    continue
+                if worker_peak_rss is not None and peak_rss is not None:
+                    worker_peak_rss[pid] = max(worker_peak_rss.get(pid, 0.0), peak_rss)
+                if task_spans is not None:
+                    task_spans.append((pid, start, end))
+                yield task, result, None
+    finally:
+        # 提前退出时执行器不会随之关闭，取消未开始的任务并等待正在运行的任务结束
+        for future in in_flight:
+            future.cancel()
+        wait(in_flight)
+
+
+def print_worker_peak_rss(worker_peak_rss):
+    """
+    打印每个worker的内存峰值
+    """
+    if not worker_peak_rss:
+        return
+    peaks = sorted(worker_peak_rss.values(), reverse=True)
+    print(f'📊 worker内存峰值: 最大 {peaks[0]:.0f} MB, 平均 {sum(peaks) / len(peaks):.0f} MB, '
+          f'合计 {sum(peaks):.0f} MB ({len(peaks)} 个worker)')
+    for pid, peak in sorted(worker_peak_rss.items(), key=lambda x: -x[1]):
+        print(f'   pid {pid}: {peak:.0f} MB')
+
+
+def print_core_utilization(task_spans, n_workers, wall_start, wall_end):
+    """
+    打印核心利用率：所有任务耗时之和 / (worker数 × 总耗时)，
+    以及尾部耗时：最后一次所有worker同时忙碌之后到结束的时间
+
+    参数:
+    task_spans (list): run_bounded记录的 (pid, 开始时间, 结束时间)
+    n_workers (int): 并发的worker数，即get_worker_pool返回的 executor._max_workers
+    wall_start (float): 开始提交任务的时间
+    wall_end (float): 所有任务结束的时间
+    """
+    wall = wall_end - wall_start
+    if not task_spans or wall <= 0:
+        return
+    busy = sum(end - start for _, start, end in task_spans)
+
+    # 按时间扫描在途任务数，找到最后一次达到worker数的时刻
+    events = sorted([(start, 1) for _, start, _ in task_spans] + [(end, -1) for _, _, end in task_spans])
+    running, last_full = 0, wall_start
+    for t, delta in events:
+        running += delta
+        if running >= n_workers or (delta == -1 and running + 1 >= n_workers):
+            last_full = t
+    tail = wall_end - last_full
+
+    print(f'📊 核心利用率: {busy / (n_workers * wall):.1%} '
+          f'(任务耗时合计 {busy:.1f} 秒 / {n_workers} 个worker × 总耗时 {wall:.1f} 秒)，'
+          f'尾部耗时 {tail:.1f} 秒 ({tail / wall:.1%})')
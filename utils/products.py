@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jul 17 2025
+
+@author: Xintang Zheng
+
+期货品种元数据
+合约乘数、最小变动价位和交易时段模板，驱动主买主卖计算中的vwap和时间网格
+
+交易时段约定:
+    夜盘属于下一交易日，TradDay为交易日，UpdateTime为实际时刻
+    时间网格按交易日零点计，夜盘开始时刻之后（>= NIGHT_SESSION_START）的时刻减去一天，
+    跨零点的夜盘（如 21:00 - 02:30）在当日零点前后连续，见 utils.timeutils.session_time_ns
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import re
+from pathlib import Path
+
+from utils.timeutils import add_time, parse_time_string
+
+
+# %%
+# 品种元数据的版本号，合约乘数或交易时段修改时同步修改，使依赖它的结果缓存失效
+PRODUCT_REGISTRY_VERSION = '1'
+
+
+# %% 交易时段模板 {时段名: (开盘, 收盘)}
+_COMMODITY_DAY = {
+    'morning1': ('09:00:00', '10:15:00'),
+    'morning2': ('10:30:00', '11:30:00'),
+    'afternoon': ('13:30:00', '15:00:00'),
+}
+
+SESSION_TEMPLATES = {
+    'cffex_index': {
+        'morning': ('09:30:00', '11:30:00'),
+        'afternoon': ('13:00:00', '15:00:00'),
+    },
+    'cffex_bond': {
+        'morning': ('09:30:00', '11:30:00'),
+        'afternoon': ('13:00:00', '15:15:00'),
+    },
+    'day': _COMMODITY_DAY,
+    'night_2300': {'night': ('21:00:00', '23:00:00'), **_COMMODITY_DAY},
+    'night_0100': {'night': ('21:00:00', '01:00:00'), **_COMMODITY_DAY},
+    'night_0230': {'night': ('21:00:00', '02:30:00'), **_COMMODITY_DAY},
+}
+
+
+# %% 品种元数据 {品种: (交易所, 合约乘数, 最小变动价位, 交易时段模板)}
+_PRODUCT_TABLE = [
+    # 中金所
+    ('IC', 'CFFEX', 200, 0.2, 'cffex_index'),
+    ('IF', 'CFFEX', 300, 0.2, 'cffex_index'),
+    ('IH', 'CFFEX', 300, 0.2, 'cffex_index'),
+    ('IM', 'CFFEX', 200, 0.2, 'cffex_index'),
+    ('TS', 'CFFEX', 20000, 0.002, 'cffex_bond'),
+    ('TF', 'CFFEX', 10000, 0.005, 'cffex_bond'),
+    ('T', 'CFFEX', 10000, 0.005, 'cffex_bond'),
+    ('TL', 'CFFEX', 10000, 0.01, 'cffex_bond'),
+    # 上期所
+    ('cu', 'SHFE', 5, 10, 'night_0100'),
+    ('al', 'SHFE', 5, 5, 'night_0100'),
+    ('zn', 'SHFE', 5, 5, 'night_0100'),
+    ('pb', 'SHFE', 5, 5, 'night_0100'),
+    ('ni', 'SHFE', 1, 10, 'night_0100'),
+    ('sn', 'SHFE', 1, 10, 'night_0100'),
+    ('ss', 'SHFE', 5, 5, 'night_0100'),
+    ('ao', 'SHFE', 20, 1, 'night_0100'),
+    ('au', 'SHFE', 1000, 0.02, 'night_0230'),
+    ('ag', 'SHFE', 15, 1, 'night_0230'),
+    ('rb', 'SHFE', 10, 1, 'night_2300'),
+    ('hc', 'SHFE', 10, 1, 'night_2300'),
+    ('ru', 'SHFE', 10, 5, 'night_2300'),
+    ('bu', 'SHFE', 10, 1, 'night_2300'),
+    ('fu', 'SHFE', 10, 1, 'night_2300'),
+    ('sp', 'SHFE', 10, 2, 'night_2300'),
+    # 上期能源
+    ('sc', 'INE', 1000, 0.1, 'night_0230'),
+    ('bc', 'INE', 5, 10, 'night_0100'),
+    ('lu', 'INE', 10, 1, 'night_2300'),
+    ('nr', 'INE', 10, 5, 'night_2300'),
+    # 大商所
+    ('a', 'DCE', 10, 1, 'night_2300'),
+    ('b', 'DCE', 10, 1, 'night_2300'),
+    ('m', 'DCE', 10, 1, 'night_2300'),
+    ('y', 'DCE', 10, 2, 'night_2300'),
+    ('p', 'DCE', 10, 2, 'night_2300'),
+    ('c', 'DCE', 10, 1, 'night_2300'),
+    ('cs', 'DCE', 10, 1, 'night_2300'),
+    ('rr', 'DCE', 10, 1, 'night_2300'),
+    ('l', 'DCE', 5, 1, 'night_2300'),
+    ('v', 'DCE', 5, 1, 'night_2300'),
+    ('pp', 'DCE', 5, 1, 'night_2300'),
+    ('eg', 'DCE', 10, 1, 'night_2300'),
+    ('eb', 'DCE', 5, 1, 'night_2300'),
+    ('pg', 'DCE', 20, 1, 'night_2300'),
+    ('j', 'DCE', 100, 0.5, 'night_2300'),
+    ('jm', 'DCE', 60, 0.5, 'night_2300'),
+    ('i', 'DCE', 100, 0.5, 'night_2300'),
+    ('jd', 'DCE', 10, 1, 'day'),
+    ('lh', 'DCE', 16, 5, 'day'),
+    # 郑商所
+    ('SR', 'CZCE', 10, 1, 'night_2300'),
+    ('CF', 'CZCE', 5, 5, 'night_2300'),
+    ('TA', 'CZCE', 5, 2, 'night_2300'),
+    ('MA', 'CZCE', 10, 1, 'night_2300'),
+    ('FG', 'CZCE', 20, 1, 'night_2300'),
+    ('SA', 'CZCE', 20, 1, 'night_2300'),
+    ('RM', 'CZCE', 10, 1, 'night_2300'),
+    ('OI', 'CZCE', 10, 1, 'night_2300'),
+    ('PF', 'CZCE', 5, 2, 'night_2300'),
+    ('PX', 'CZCE', 5, 2, 'night_2300'),
+    ('SH', 'CZCE', 30, 1, 'night_2300'),
+    ('AP', 'CZCE', 10, 1, 'day'),
+    ('CJ', 'CZCE', 5, 5, 'day'),
+    ('UR', 'CZCE', 20, 1, 'day'),
+    ('SF', 'CZCE', 5, 2, 'day'),
+    ('SM', 'CZCE', 5, 2, 'day'),
+    ('PK', 'CZCE', 5, 2, 'day'),
+    # 广期所
+    ('si', 'GFEX', 5, 5, 'day'),
+    ('lc', 'GFEX', 1, 50, 'day'),
+]
+
+PRODUCTS = {
+    product: {'exchange': exchange, 'multiplier': multiplier, 'tick_size': tick_size, 'session': session}
+    for product, exchange, multiplier, tick_size, session in _PRODUCT_TABLE
+}
+
+
+# %%
+def product_of(instru_id):
+    """
+    由合约代码取品种代码，如 'IC2401' -> 'IC'，'cu2401' -> 'cu'，'SR401' -> 'SR'
+    """
+    match = re.match(r'[A-Za-z]+', instru_id)
+    if match is None:
+        raise ValueError(f'无法识别合约代码: {instru_id}')
+    return match.group(0)
+
+
+def get_product(product):
+    """
+    获取品种元数据 {'exchange', 'multiplier', 'tick_size', 'session'}
+    """
+    try:
+        return PRODUCTS[product]
+    except KeyError:
+        raise KeyError(f'品种 {product} 未在 utils.products.PRODUCTS 中登记') from None
+
+
+def product_sessions(product):
+    """
+    品种的交易时段 {时段名: (开盘, 收盘)}
+    """
+    return SESSION_TEMPLATES[get_product(product)['session']]
+
+
+def product_keep_periods(product, interval):
+    """
+    品种在给定bar间隔下保留的bar标签范围（右闭右标签），格式同keep_periods：
+    每个时段的第一个bar标签为开盘加一个间隔，最后一个为收盘，
+    如IC在'1min'下为 {'morning': ('09:31:00', '11:30:00'), 'afternoon': ('13:01:00', '15:00:00')}
+
+    参数:
+    product (str): 品种代码
+    interval (str): bar间隔，如'1min'
+
+    返回:
+    dict: {时段名: (第一个bar标签, 最后一个bar标签)}
+    """
+    interval_params = {'seconds': parse_time_string(interval)}
+    return {name: (add_time(start, interval_params), end)
+            for name, (start, end) in product_sessions(product).items()}
+
+
+def available_products(zhuli_dir):
+    """
+    主力合约目录中有文件且已登记元数据的品种，按登记顺序排列
+    """
+    zhuli_dir = Path(zhuli_dir)
+    existing = {path.stem for path in zhuli_dir.glob('*.parquet')}
+    return [product for product in PRODUCTS if product in existing]
@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jul 18 2025
+
+@author: Xintang Zheng
+
+分段滚动计算内核
+在 (行 × 列) 的float64二维数组上逐段计算滚动统计，每段从段首重新开始（min_periods=1，NaN不计入）；
+分段由起止行号给出，见 operators.ts_intraday.SegmentIndex
+
+有numba时使用编译版本（计算时释放GIL，可在线程中并行）：逐列单次遍历，累加、移出的顺序和补偿方式与pandas rolling相同，结果逐位一致；
+否则使用向量化numpy版本：各段补齐到相同长度后按窗口长度分块，窗口和由块内的前向、后向累计和拼出，
+误差不超过 窗口长度 × 2.2e-16 × 窗口内绝对值之和
+
+多窗口滚动求和、均值（*_multi）每段只做一次带补偿的前缀和，每个窗口由前缀相减得到，增加窗口几乎不增加计算，
+误差约为 2 × 2.2e-16 × |窗口和|；exact=True时在同一次遍历中逐窗口做与pandas相同的滚动加减，结果与单窗口版本逐位一致
+
+指数加权均值（adjust=True）按与pandas ewm相同的递推计算，段首重置状态，多个span在同一次遍历中完成
+
+滚动最小、最大值：numba版本为单调队列，每个值最多入队、出队一次；
+numpy版本为van Herk/Gil-Werman分块，块内前向、后向累计极值后每个窗口只取两个值，均与窗口长度无关
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# %% 分段补齐
+def segment_positions(starts, ends):
+    """
+    返回每行所属分段的编号和段内位置
+    """
+    lengths = ends - starts
+    segment_ids = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(segment_ids.size) - np.repeat(starts, lengths)
+    return segment_ids, positions
+
+
+def segmented_prefix_counts(valid, segment_ids, positions, n_segments, max_length):
+    """
+    按段计算布尔标记的前缀计数：各段补齐到最长段的长度后沿段内方向累加，段与段之间互不影响
+
+    返回:
+    np.ndarray: (段数, 最长段长度 + 1, 列数) 的int64数组，第二维第k个位置为段内前k行的计数
+    """
+    counts = np.zeros((n_segments, max_length + 1, valid.shape[1]), dtype=np.int64)
+    counts[segment_ids, positions + 1] = valid
+    np.cumsum(counts, axis=1, out=counts)
+    return counts
+
+
+# %% 滚动求和、均值
+def _segmented_window_sums_numpy(values, starts, ends, windows, mean):
+    """
+    没有numba时的向量化numpy版本：各段补齐到相同长度（NaN按0），按窗口长度分块做块内前向、后向累计和；
+    窗口 [lo, pos] 跨两个块时为 lo 处的后向和加 pos 处的前向和，位于一个块内时为 pos 处的前向和，
+    两部分都只包含窗口内的值。非NaN计数为整数，由段内前缀计数相减得到
+
+    每个窗口和只由窗口内的值相加得到，误差不超过 窗口长度 × 2.2e-16 × 窗口内绝对值之和；
+    与pandas（整段滚动加减）不逐位一致，两者之差另含pandas自身的舍入误差（不超过约 4 × 2.2e-16 × 段内绝对值之和）
+
+    返回:
+    np.ndarray: (窗口数 × 列 × 行) 的float64数组
+    """
+    n_rows, n_cols = values.shape
+    out = np.empty((len(windows), n_cols, n_rows))
+    if n_rows == 0:
+        return out
+    segment_ids, positions = segment_positions(starts, ends)
+    n_segments = len(starts)
+    max_length = int((ends - starts).max())
+    valid = ~np.isnan(values)
+    counts = segmented_prefix_counts(valid, segment_ids, positions, n_segments, max_length)
+    ends_count = counts[segment_ids, positions + 1]
+    padded = np.zeros((n_segments, max_length, n_cols))
+    padded[segment_ids, positions] = np.where(valid, values, 0.0)
+
+    for k, window in enumerate(windows):
+        window = int(window)
+        block = min(window, max_length)
+        n_blocks = -(-max_length // block)
+        blocks = np.zeros((n_segments, n_blocks * block, n_cols))
+        blocks[:, :max_length] = padded
+        blocks = blocks.reshape(n_segments, n_blocks, block, n_cols)
+        forward = np.cumsum(blocks, axis=2).reshape(n_segments, n_blocks * block, n_cols)
+        backward = np.cumsum(blocks[:, :, ::-1], axis=2)[:, :, ::-1].reshape(n_segments, n_blocks * block, n_cols)
+
+        window_starts = positions + 1 - window
+        window_sums = forward[segment_ids, positions]
+        spans_two = (window_starts > 0) & (window_starts % block != 0)
+        window_sums[spans_two] += backward[segment_ids[spans_two], window_starts[spans_two]]
+        window_counts = ends_count - counts[segment_ids, np.maximum(window_starts, 0)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = window_sums / window_counts if mean else window_sums
+        out[k] = np.where(window_counts > 0, result, np.nan).T
+    return out
+
+
+def _segmented_prefix_sums_loop(values, starts, ends, windows, mean):
+    """
+    供numba编译的多窗口版本：每段只做一次带补偿的前缀和（双精度和加上舍入余项，TwoSum累加），
+    每个窗口和由两个前缀相减得到，增加窗口只增加一次减法；
+    前缀的舍入余项一起相减，误差约为 2 × 2.2e-16 × |窗口和|，另加不超过 段长 × 1e-32 × 段内绝对值之和，
+    不受段内更早的大值影响；窗口内全为0时为0，全为非负（非正）时不返回负（正）数
+    """
+    n_rows, n_cols = values.shape
+    n_windows = len(windows)
+    out = np.empty((n_windows, n_cols, n_rows))
+    max_length = 0
+    for seg in range(len(starts)):
+        max_length = max(max_length, ends[seg] - starts[seg])
+    prefix_hi = np.zeros(max_length + 1)
+    prefix_lo = np.zeros(max_length + 1)
+    prefix_nobs = np.zeros(max_length + 1, dtype=np.int64)
+    prefix_neg = np.zeros(max_length + 1, dtype=np.int64)
+
+    for col in range(n_cols):
+        for seg in range(len(starts)):
+            start = starts[seg]
+            length = ends[seg] - start
+            hi = 0.0
+            lo = 0.0
+            for pos in range(length):
+                val = values[start + pos, col]
+                prefix_nobs[pos + 1] = prefix_nobs[pos]
+                prefix_neg[pos + 1] = prefix_neg[pos]
+                if val == val:
+                    # TwoSum：t + err 精确等于 hi + val，余项累加到lo后重新规格化
+                    t = hi + val
+                    bp = t - hi
+                    lo += (hi - (t - bp)) + (val - bp)
+                    hi = t + lo
+                    lo = lo - (hi - t)
+                    prefix_nobs[pos + 1] += 1
+                    if np.signbit(val):
+                        prefix_neg[pos + 1] += 1
+                prefix_hi[pos + 1] = hi
+                prefix_lo[pos + 1] = lo
+
+            for k in range(n_windows):
+                for pos in range(length):
+                    lo_pos = max(pos + 1 - windows[k], 0)
+                    nobs = prefix_nobs[pos + 1] - prefix_nobs[lo_pos]
+                    if nobs == 0:
+                        out[k, col, start + pos] = np.nan
+                        continue
+                    total = (prefix_hi[pos + 1] - prefix_hi[lo_pos]) + (prefix_lo[pos + 1] - prefix_lo[lo_pos])
+                    neg_ct = prefix_neg[pos + 1] - prefix_neg[lo_pos]
+                    if neg_ct == 0 and total < 0:
+                        total = 0.0
+                    elif neg_ct == nobs and total > 0:
+                        total = 0.0
+                    out[k, col, start + pos] = total / nobs if mean else total
+    return out
+
+
+if njit is not None:
+    _segmented_window_sums_kernel = njit(cache=True, nogil=True)(_segmented_prefix_sums_loop)
+else:
+    _segmented_window_sums_kernel = _segmented_window_sums_numpy
+
+
+def _segmented_rolling_loop(values, starts, ends, windows, mean):
+    """
+    与pandas逐位一致的版本，供numba编译：每个值只读取一次，同时更新所有窗口的状态；
+    每个窗口与pandas的roll_sum/roll_mean一致，加入、移出分别做Kahan补偿，
+    连续相同值时直接取值×个数（连续计数只与加入的值有关，各窗口共用），均值在全为正（负）时不返回负（正）数
+    """
+    n_rows, n_cols = values.shape
+    n_windows = len(windows)
+    out = np.empty((n_windows, n_cols, n_rows))
+    nobs = np.empty(n_windows, dtype=np.int64)
+    neg_ct = np.empty(n_windows, dtype=np.int64)
+    sum_x = np.empty(n_windows)
+    compensation_add = np.empty(n_windows)
+    compensation_remove = np.empty(n_windows)
+    for col in range(n_cols):
+        for seg in range(len(starts)):
+            start = starts[seg]
+            end = ends[seg]
+            nobs[:] = 0
+            neg_ct[:] = 0
+            sum_x[:] = 0.0
+            compensation_add[:] = 0.0
+            compensation_remove[:] = 0.0
+            num_consecutive_same_value = 0
+            prev_value = values[start, col] if end > start else np.nan
+            for i in range(start, end):
+                val = values[i, col]
+                is_observation = val == val
+                if is_observation:
+                    if val == prev_value:
+                        num_consecutive_same_value += 1
+                    else:
+                        num_consecutive_same_value = 1
+                    prev_value = val
+
+                for k in range(n_windows):
+                    # 移出离开窗口的值
+                    if i - windows[k] >= start:
+                        old = values[i - windows[k], col]
+                        if old == old:
+                            nobs[k] -= 1
+                            y = -old - compensation_remove[k]
+                            t = sum_x[k] + y
+                            compensation_remove[k] = t - sum_x[k] - y
+                            sum_x[k] = t
+                            if np.signbit(old):
+                                neg_ct[k] -= 1
+
+                    # 加入新值
+                    if is_observation:
+                        nobs[k] += 1
+                        y = val - compensation_add[k]
+                        t = sum_x[k] + y
+                        compensation_add[k] = t - sum_x[k] - y
+                        sum_x[k] = t
+                        if np.signbit(val):
+                            neg_ct[k] += 1
+
+                    if nobs[k] == 0:
+                        out[k, col, i] = np.nan
+                    elif mean:
+                        if num_consecutive_same_value >= nobs[k]:
+                            result = prev_value
+                        else:
+                            result = sum_x[k] / nobs[k]
+                            if neg_ct[k] == 0 and result < 0:
+                                result = 0.0
+                            elif neg_ct[k] == nobs[k] and result > 0:
+                                result = 0.0
+                        out[k, col, i] = result
+                    elif num_consecutive_same_value >= nobs[k]:
+                        out[k, col, i] = prev_value * nobs[k]
+                    else:
+                        out[k, col, i] = sum_x[k]
+    return out
+
+
+if njit is not None:
+    _segmented_rolling_kernel = njit(cache=True, nogil=True)(_segmented_rolling_loop)
+else:
+    _segmented_rolling_kernel = _segmented_window_sums_numpy
+
+
+def _as_2d(values):
+    # 按列遍历，列优先存储时每列连续（内存映射面板即为列优先，不需要复制）
+    return np.asfortranarray(np.asarray(values, dtype=np.float64).reshape(len(values), -1))
+
+
+def _segmented_rolling(values, starts, ends, windows, mean, exact=True):
+    """
+    返回 (窗口数 × 行 × 列) 的数组，每个窗口的结果为列优先的视图
+    """
+    kernel = _segmented_rolling_kernel if exact else _segmented_window_sums_kernel
+    out = kernel(_as_2d(values), np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64),
+                 np.asarray(windows, dtype=np.int64).reshape(-1), mean)
+    return out.transpose(0, 2, 1)
+
+
+def segmented_rolling_sum(values, starts, ends, window):
+    """
+    分段滚动求和，等价于对每段分别做 rolling(window, min_periods=1).sum()；
+    有numba时与pandas逐位一致，否则误差见 _segmented_window_sums_numpy
+
+    参数:
+    values (np.ndarray): (行 × 列) 数组
+    starts, ends (np.ndarray): 各段的起止行号（int64），结束行不包含
+    window (int): 窗口长度
+
+    返回:
+    np.ndarray: 与values形状相同的float64数组，窗口内没有非NaN值时为NaN
+    """
+    return _segmented_rolling(values, starts, ends, [window], False)[0]
+
+
+def segmented_rolling_mean(values, starts, ends, window):
+    """
+    分段滚动均值，等价于对每段分别做 rolling(window, min_periods=1).mean()，参数同 segmented_rolling_sum
+    """
+    return _segmented_rolling(values, starts, ends, [window], True)[0]
+
+
+def segmented_rolling_sum_multi(values, starts, ends, windows, exact=False):
+    """
+    一次计算多个窗口的分段滚动求和：每段只做一次带补偿的前缀和，每个窗口和由前缀相减得到，
+    增加窗口几乎不增加计算；误差约为 2 × 2.2e-16 × |窗口和|（见 _segmented_prefix_sums_loop，
+    没有numba时见 _segmented_window_sums_numpy），与 segmented_rolling_sum 不逐位一致
+
+    参数:
+    values (np.ndarray): (行 × 列) 数组
+    starts, ends (np.ndarray): 各段的起止行号（int64），结束行不包含
+    windows (list): 窗口长度列表
+    exact (bool): 为True时在同一次遍历中逐窗口做与pandas相同的滚动加减，结果与 segmented_rolling_sum 逐位一致，
+                  计算量随窗口数线性增加
+
+    返回:
+    np.ndarray: (窗口数 × 行 × 列) 的float64数组，第k个为windows[k]的结果
+    """
+    return _segmented_rolling(values, starts, ends, windows, False, exact)
+
+
+def segmented_rolling_mean_multi(values, starts, ends, windows, exact=False):
+    """
+    一次计算多个窗口的分段滚动均值，参数和返回同 segmented_rolling_sum_multi，
+    exact=True时每个窗口的结果与 segmented_rolling_mean 逐位一致
+    """
+    return _segmented_rolling(values, starts, ends, windows, True, exact)
+
+
+# %% 指数加权均值
+def _ewma_decay(spans):
+    """
+    与pandas相同的参数换算：com = (span - 1) / 2，alpha = 1 / (1 + com)，返回每步的权重衰减 1 - alpha
+    """
+    com = (np.asarray(spans, dtype=np.float64) - 1) / 2
+    return 1. - 1. / (1. + com)
+
+
+def _segmented_ewma_numpy(values, starts, ends, decays):
+    """
+    向量化numpy版本：按段内位置逐步递推，每一步同时处理所有段、列和span，运算顺序与pandas相同
+
+    返回:
+    np.ndarray: (span数 × 列 × 行) 的float64数组
+    """
+    n_rows, n_cols = values.shape
+    n_spans = len(decays)
+    out = np.empty((n_spans, n_cols, n_rows))
+    if n_rows == 0:
+        return out
+    lengths = ends - starts
+    decays = np.asarray(decays)[:, None, None]
+    weighted = np.empty((n_spans, len(starts), n_cols))
+    old_wt = np.ones((n_spans, len(starts), n_cols))
+
+    for pos in range(int(lengths.max())):
+        active = np.flatnonzero(lengths > pos)
+        rows = starts[active] + pos
+        cur = np.broadcast_to(values[rows], (n_spans, len(active), n_cols))
+        if pos == 0:
+            weighted[:] = cur
+        else:
+            prev = weighted[:, active]
+            prev_wt = old_wt[:, active]
+            is_observation = cur == cur
+            has_weighted = prev == prev
+
+            # 已有加权值时，无论当前是否为NaN都衰减旧权重；当前有值且与加权值不同时合并
+            prev_wt = np.where(has_weighted, prev_wt * decays, prev_wt)
+            update = has_weighted & is_observation
+            with np.errstate(invalid='ignore'):
+                merged = (prev_wt * prev + 1. * cur) / (prev_wt + 1.)
+            new_weighted = np.where(update & (prev != cur), merged, prev)
+            new_weighted = np.where(~has_weighted & is_observation, cur, new_weighted)
+            weighted[:, active] = new_weighted
+            old_wt[:, active] = np.where(update, prev_wt + 1., prev_wt)
+        out[:, :, rows] = weighted[:, active].transpose(0, 2, 1)
+    return out
+
+
+def _segmented_ewma_loop(values, starts, ends, decays):
+    """
+    单次遍历版本，供numba编译：与pandas ewm(adjust=True, ignore_na=False).mean()的递推一致，
+    多个span各自维护加权值和权重
+    """
+    n_rows, n_cols = values.shape
+    n_spans = len(decays)
+    out = np.empty((n_spans, n_cols, n_rows))
+    weighted = np.empty(n_spans)
+    old_wt = np.empty(n_spans)
+    for col in range(n_cols):
+        for seg in range(len(starts)):
+            start = starts[seg]
+            end = ends[seg]
+            if end <= start:
+                continue
+            for k in range(n_spans):
+                weighted[k] = values[start, col]
+                old_wt[k] = 1.
+                out[k, col, start] = weighted[k]
+            for i in range(start + 1, end):
+                cur = values[i, col]
+                is_observation = cur == cur
+                for k in range(n_spans):
+                    if weighted[k] == weighted[k]:
+                        old_wt[k] *= decays[k]
+                        if is_observation:
+                            # 常数序列不做合并，避免舍入误差
+                            if weighted[k] != cur:
+                                weighted[k] = old_wt[k] * weighted[k] + 1. * cur
+                                weighted[k] /= (old_wt[k] + 1.)
+                            old_wt[k] += 1.
+                    elif is_observation:
+                        weighted[k] = cur
+                    out[k, col, i] = weighted[k]
+    return out
+
+
+if njit is not None:
+    _segmented_ewma_kernel = njit(cache=True, nogil=True)(_segmented_ewma_loop)
+else:
+    _segmented_ewma_kernel = _segmented_ewma_numpy
+
+
+def segmented_ewma_multi(values, starts, ends, spans):
+    """
+    一次计算多个span的分段指数加权均值，等价于对每段分别做 ewm(span, min_periods=1, adjust=True).mean()
+
+    参数:
+    values (np.ndarray): (行 × 列) 数组
+    starts, ends (np.ndarray): 各段的起止行号（int64），结束行不包含
+    spans (list): span列表
+
+    返回:
+    np.ndarray: (span数 × 行 × 列) 的float64数组，第k个为spans[k]的结果，段内还没有非NaN值时为NaN
+    """
+    out = _segmented_ewma_kernel(_as_2d(values), np.asarray(starts, dtype=np.int64),
+                                 np.asarray(ends, dtype=np.int64), _ewma_decay(np.reshape(spans, -1)))
+    return out.transpose(0, 2, 1)
+
+
+def segmented_ewma(values, starts, ends, span):
+    """
+    分段指数加权均值，参数同 segmented_ewma_multi
+
+    返回:
+    np.ndarray: 与values形状相同的float64数组
+    """
+    return segmented_ewma_multi(values, starts, ends, [span])[0]
+
+
+# %% 滚动最小、最大值
+def _segmented_rolling_extrema_numpy(values, starts, ends, window, is_max):
+    """
+    向量化numpy版本（van Herk/Gil-Werman）：各段补齐到相同长度，按窗口长度分块，
+    块内前向、后向累计极值（fmax/fmin跳过NaN），窗口极值为起点处的后向值与终点处的前向值之一
+    """
+    n_rows, n_cols = values.shape
+    out = np.empty((n_rows, n_cols))
+    if n_rows == 0:
+        return out
+    segment_ids, positions = segment_positions(starts, ends)
+    max_length = int((ends - starts).max())
+    window = min(window, max_length)
+    n_blocks = -(-max_length // window)
+
+    padded = np.full((len(starts), n_blocks * window, n_cols), np.nan)
+    padded[segment_ids, positions] = values
+    blocks = padded.reshape(len(starts), n_blocks, window, n_cols)
+    extremum = np.fmax if is_max else np.fmin
+    forward = extremum.accumulate(blocks, axis=2).reshape(padded.shape)
+    backward = extremum.accumulate(blocks[:, :, ::-1], axis=2)[:, :, ::-1].reshape(padded.shape)
+
+    # 窗口起点在段首（含被截断）时窗口落在第一个块内，只取前向值
+    out[:] = forward[segment_ids, positions]
+    window_starts = positions + 1 - window
+    inner = window_starts > 0
+    out[inner] = extremum(backward[segment_ids[inner], window_starts[inner]], out[inner])
+    return out
+
+
+def _segmented_rolling_extrema_loop(values, starts, ends, window, is_max):
+    """
+    单调队列版本，供numba编译：队列中保存窗口内可能成为极值的行号，对应的值单调，队首即为窗口极值；
+    NaN不入队，相同值保留较晚的行，与pandas的roll_min/roll_max一致
+    """
+    n_rows, n_cols = values.shape
+    out = np.empty((n_rows, n_cols))
+    max_length = 0
+    for seg in range(len(starts)):
+        max_length = max(max_length, ends[seg] - starts[seg])
+    queue = np.empty(max_length, dtype=np.int64)
+
+    for col in range(n_cols):
+        for seg in range(len(starts)):
+            head = 0
+            tail = 0
+            for i in range(starts[seg], ends[seg]):
+                val = values[i, col]
+                if val == val:
+                    if is_max:
+                        while tail > head and values[queue[tail - 1], col] <= val:
+                            tail -= 1
+                    else:
+                        while tail > head and values[queue[tail - 1], col] >= val:
+                            tail -= 1
+                    queue[tail] = i
+                    tail += 1
+                # 移出离开窗口的行
+                while tail > head and queue[head] <= i - window:
+                    head += 1
+                out[i, col] = values[queue[head], col] if tail > head else np.nan
+    return out
+
+
+if njit is not None:
+    _segmented_rolling_extrema_kernel = njit(cache=True, nogil=True)(_segmented_rolling_extrema_loop)
+else:
+    _segmented_rolling_extrema_kernel = _segmented_rolling_extrema_numpy
+
+
+def segmented_rolling_min(values, starts, ends, window):
+    """
+    分段滚动最小值，等价于对每段分别做 rolling(window, min_periods=1).min()
+
+    参数:
+    values (np.ndarray): (行 × 列) 数组
+    starts, ends (np.ndarray): 各段的起止行号（int64），结束行不包含
+    window (int): 窗口长度
+
+    返回:
+    np.ndarray: 与values形状相同的float64数组，窗口内没有非NaN值时为NaN
+    """
+    return _segmented_rolling_extrema_kernel(_as_2d(values), np.asarray(starts, dtype=np.int64),
+                                             np.asarray(ends, dtype=np.int64), int(window), False)
+
+
+def segmented_rolling_max(values, starts, ends, window):
+    """
+    分段滚动最大值，等价于对每段分别做 rolling(window, min_periods=1).max()，参数同 segmented_rolling_min
+    """
+    return _segmented_rolling_extrema_kernel(_as_2d(values), np.asarray(starts, dtype=np.int64),
+                                             np.asarray(ends, dtype=np.int64), int(window), True)
+
+
+# %% 预热
+def warm_up_kernels():
+    """
+    在极小的输入上调用一次各分段内核，使numba从磁盘缓存加载（或编译）完成，
+    供常驻worker启动时预热
+    """
+    values = np.zeros((2, 1))
+    starts, ends = np.array([0]), np.array([2])
+    segmented_rolling_mean(values, starts, ends, 1)
+    segmented_rolling_mean_multi(values, starts, ends, [1])
+    segmented_ewma_multi(values, starts, ends, [2])
+    segmented_rolling_max(values, starts, ends, 1)
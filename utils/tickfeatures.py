@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul 16 2025
+
+@author: Xintang Zheng
+
+主买主卖特征注册表
+在同一次读取、同一次方向判断的基础上，按声明的 (逐tick表达式, bar归约方式) 计算一族原始特征
+
+特征定义:
+    逐tick特征: expr为逐tick字段名或 callable(ticks) -> np.ndarray，how为bar归约方式
+                （'sum'、'count'、'mean'、'last'、'max'、'min'）
+    bar级特征:  how='bar'，expr为 callable(bars) -> np.ndarray，由requires中的其他特征的bar结果计算
+
+逐tick字段（build_tick_context的结果）:
+    turnover, volume: 逐tick成交额、成交量增量（第一个tick为NaN）
+    direction: 交易方向，1主买，-1主卖，0未知
+    act_buy_amount, act_sell_amount, act_buy_volume, act_sell_volume: 主买主卖金额和成交量
+    bid1, ask1, midprice, spread: 盘口价格
+    multiplier, tick_size: 合约乘数和最小变动价位（标量）
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import numpy as np
+
+from utils.tickutils import classify_trade_direction, grid_bar_ids, reduce_bars, TRADE_FLOW_VERSION
+from utils.products import PRODUCT_REGISTRY_VERSION
+from utils.cacheutils import ResultCache
+
+
+# %%
+TRADE_FLOW_FEATURES = {}
+DEFAULT_TRADE_FLOW_FEATURES = ['act_buy_amount', 'act_sell_amount']
+BAR_REDUCTIONS = ('sum', 'count', 'mean', 'last', 'max', 'min')
+
+
+def register_trade_flow_feature(name, expr, how='sum', requires=None):
+    """
+    注册一个主买主卖特征，注册后可在params['features']中按名称引用
+
+    参数:
+    name (str): 特征名，即结果parquet中的列名
+    expr (str or callable): 逐tick特征为字段名或 callable(ticks)，bar级特征为 callable(bars)
+    how (str): bar归约方式，'bar'表示由其他特征的bar结果计算
+    requires (list): bar级特征依赖的特征名
+    """
+    if how != 'bar' and how not in BAR_REDUCTIONS:
+        raise ValueError(f'不支持的归约方式: {how}')
+    if how == 'bar' and not requires:
+        raise ValueError(f'bar级特征 {name} 需要指定requires')
+    TRADE_FLOW_FEATURES[name] = {'expr': expr, 'how': how, 'requires': list(requires or [])}
+
+
+def _empty_value(name):
+    return 0.0 if TRADE_FLOW_FEATURES[name]['how'] in ('sum', 'count') else np.nan
+
+
+def _resolve_order(features):
+    """
+    展开bar级特征的依赖，返回按依赖顺序排列的全部特征名
+    """
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        if name not in TRADE_FLOW_FEATURES:
+            raise KeyError(f'未注册的主买主卖特征: {name}')
+        for dep in TRADE_FLOW_FEATURES[name]['requires']:
+            visit(dep)
+        order.append(name)
+
+    for name in features:
+        visit(name)
+    return order
+
+
+# %% 结果缓存
+def trade_flow_result_cache(root_dir, interval, keep_periods=None, features=None):
+    """
+    主买主卖原始结果的缓存目录，计算与合并阶段用同一函数定位目录
+
+    参数:
+    root_dir (Path): 结果根目录
+    interval (str): bar间隔
+    keep_periods (dict): 所有品种统一的bar标签范围，None表示按品种元数据的交易时段
+    features (list): 输出的特征名，None表示只输出主买主卖金额
+
+    返回:
+    ResultCache: 按 (参数, 代码版本, 品种元数据版本) 哈希分目录的结果缓存
+    """
+    params = {'interval': interval, 'keep_periods': keep_periods, 'products': PRODUCT_REGISTRY_VERSION}
+    if features:
+        params['features'] = list(features)
+    return ResultCache(root_dir, params, TRADE_FLOW_VERSION)
+
+
+# %% 逐tick计算
+def build_tick_context(data, multiplier, tick_size=np.nan):
+    """
+    对单个合约的tick数据做一次方向判断，构造所有特征共用的逐tick字段
+
+    参数:
+    data (pd.DataFrame): 单个合约的tick数据（TickStore缓存格式），需包含TRADE_FLOW_COLUMNS
+    multiplier (float): 合约乘数，见 utils.products
+    tick_size (float): 最小变动价位，见 utils.products
+
+    返回:
+    dict: 字段名 -> 逐tick数组，另含标量multiplier和tick_size
+    """
+    cum_turnover = data['Turnover'].to_numpy(dtype=np.float64)
+    cum_volume = data['Volume'].to_numpy(dtype=np.float64)
+    bid1 = data['BidPrice1'].to_numpy(dtype=np.float64)
+    ask1 = data['AskPrice1'].to_numpy(dtype=np.float64)
+
+    direction, act_buy_amount, act_sell_amount = classify_trade_direction(
+        cum_turnover, cum_volume, bid1, ask1, multiplier=multiplier
+    )
+
+    turnover = np.diff(cum_turnover, prepend=np.nan)
+    volume = np.diff(cum_volume, prepend=np.nan)
+    valid_volume = np.nan_to_num(volume)
+
+    return {
+        'turnover': turnover,
+        'volume': volume,
+        'direction': direction.astype(np.float64),
+        'act_buy_amount': act_buy_amount,
+        'act_sell_amount': act_sell_amount,
+        'act_buy_volume': np.where(direction == 1, valid_volume, 0.0),
+        'act_sell_volume': np.where(direction == -1, valid_volume, 0.0),
+        'bid1': bid1,
+        'ask1': ask1,
+        'midprice': (bid1 + ask1) / 2,
+        'spread': ask1 - bid1,
+        'multiplier': float(multiplier),
+        'tick_size': float(tick_size),
+    }
+
+
+def evaluate_tick_features(ticks, features):
+    """
+    计算特征（含依赖）所需的逐tick数组，多个间隔可共用结果
+
+    返回:
+    dict: 逐tick特征名 -> 逐tick数组
+    """
+    tick_values = {}
+    for name in _resolve_order(features):
+        spec = TRADE_FLOW_FEATURES[name]
+        if spec['how'] == 'bar':
+            continue
+        expr = spec['expr']
+        tick_values[name] = ticks[expr] if isinstance(expr, str) else expr(ticks)
+    return tick_values
+
+
+# %% bar归约
+def empty_bar_features(features, n_bars):
+    """
+    没有tick时各特征的bar结果：sum/count为0，其余为NaN
+    """
+    return {name: np.full(n_bars, _empty_value(name)) for name in features}
+
+
+def reduce_features_to_grid(tick_values, features, day_ns, time_ns, grid, interval_seconds, multiplier):
+    """
+    将逐tick特征按声明的归约方式聚合到目标时间网格（右闭右标签），再计算bar级特征
+
+    参数:
+    tick_values (dict): evaluate_tick_features的结果
+    features (list): 需要输出的特征名
+    day_ns (np.ndarray): 交易日零点的纳秒时间戳
+    time_ns (np.ndarray): 当日零点起的纳秒偏移
+    grid (np.ndarray): 目标时间网格（datetime64），需升序
+    interval_seconds (int): bar间隔秒数
+    multiplier (float): 合约乘数，bar级特征可通过bars['multiplier']使用
+
+    返回:
+    dict: 特征名 -> 长度为len(grid)的float64数组
+    """
+    n_bars = len(grid)
+    bar_ids, in_grid = grid_bar_ids(day_ns, time_ns, grid, interval_seconds)
+
+    bars = {'multiplier': float(multiplier)}
+    for name in _resolve_order(features):
+        spec = TRADE_FLOW_FEATURES[name]
+        if spec['how'] == 'bar':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bars[name] = np.asarray(spec['expr'](bars), dtype=np.float64)
+        else:
+            bars[name] = reduce_bars(bar_ids, tick_values[name][in_grid], n_bars, how=spec['how'])
+
+    return {name: bars[name] for name in features}
+
+
+# %% 内置特征
+register_trade_flow_feature('act_buy_amount', 'act_buy_amount', 'sum')
+register_trade_flow_feature('act_sell_amount', 'act_sell_amount', 'sum')
+register_trade_flow_feature('act_buy_volume', 'act_buy_volume', 'sum')
+register_trade_flow_feature('act_sell_volume', 'act_sell_volume', 'sum')
+register_trade_flow_feature('turnover', 'turnover', 'sum')
+register_trade_flow_feature('volume', 'volume', 'sum')
+register_trade_flow_feature('signed_turnover', lambda t: t['act_buy_amount'] - t['act_sell_amount'], 'sum')
+register_trade_flow_feature('signed_volume', lambda t: t['act_buy_volume'] - t['act_sell_volume'], 'sum')
+register_trade_flow_feature('tick_count', 'midprice', 'count')
+register_trade_flow_feature('trade_count', lambda t: (t['volume'] > 0).astype(np.float64), 'sum')
+register_trade_flow_feature('spread_mean', 'spread', 'mean')
+register_trade_flow_feature('spread_max', 'spread', 'max')
+register_trade_flow_feature('spread_ticks_mean', lambda t: t['spread'] / t['tick_size'], 'mean')
+register_trade_flow_feature('midprice_last', 'midprice', 'last')
+register_trade_flow_feature('vwap', lambda b: b['turnover'] / b['volume'] / b['multiplier'], 'bar',
+                            requires=['turnover', 'volume'])
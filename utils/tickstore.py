@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jul 10 2025
+
+@author: Xintang Zheng
+
+tick数据本地列式缓存模块
+将每日的 mdl_21_1_0.csv 转换一次为本地压缩的parquet文件，之后所有raw_fac阶段均通过列投影读取
+
+缓存文件格式:
+    - 按 InstruID 排序（稳定排序，合约内部保持原始行情顺序，即时间顺序）
+    - TradDay: int64，交易日零点的纳秒时间戳
+    - UpdateTime: int64，当日零点起的纳秒偏移
+    - 价格及成交额列: float64
+    - 文件元数据中记录每个合约的行范围索引，读取单个合约时只读取覆盖该范围的row group
+    - 文件元数据中记录转换时原始文件的指纹，check_source=True时原始文件变化后重新转换
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import os
+import sys
+import json
+import shutil
+import threading
+from collections import deque
+import http.client
+from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# %% add sys path
+file_path = Path(__file__).resolve()
+project_dir = file_path.parents[1]
+sys.path.append(str(project_dir))
+
+# %%
+from utils.timeutils import session_time_ns
+
+
+# %%
+TICK_FILE_NAME = 'mdl_21_1_0.csv'
+INSTRU_INDEX_KEY = b'instru_index'
+SOURCE_FINGERPRINT_KEY = b'source_fingerprint'
+
+# 各阶段需要的列
+TRADE_FLOW_COLUMNS = ['InstruID', 'TradDay', 'UpdateTime', 'Turnover', 'Volume', 'BidPrice1', 'AskPrice1']
+ORDERBOOK_COLUMNS = (['InstruID', 'TradDay', 'UpdateTime']
+                     + [f'{side}{field}{level}' for level in range(1, 6)
+                        for side in ('Bid', 'Ask') for field in ('Price', 'Volume')])
+
+# mdl_21 行情字段的解析类型，未声明的列由pyarrow自动推断
+MDL21_SCHEMA = {
+    'InstruID': pa.dictionary(pa.int32(), pa.string()),
+    'TradDay': pa.int32(),
+    'UpdateTime': pa.time64('ns'),
+    'LastPrice': pa.float64(),
+    'Volume': pa.int64(),
+    'Turnover': pa.float64(),
+    **{f'{side}Price{level}': pa.float64() for level in range(1, 6) for side in ('Bid', 'Ask')},
+    **{f'{side}Volume{level}': pa.int64() for level in range(1, 6) for side in ('Bid', 'Ask')},
+}
+
+
+# %%
+def normalize_ticks(data):
+    """
+    将原始csv读入的DataFrame转换为缓存格式的类型
+
+    参数:
+    data (pd.DataFrame): 原始tick数据，TradDay为'YYYYMMDD'，UpdateTime为'HH:MM:SS[.fff]'
+
+    返回:
+    pd.DataFrame: TradDay/UpdateTime为int64纳秒，价格及成交额为float64
+    """
+    data = data.copy()
+    if not isinstance(data['InstruID'].dtype, pd.CategoricalDtype):
+        data['InstruID'] = data['InstruID'].astype(str)
+    data['TradDay'] = pd.to_datetime(data['TradDay'].astype(str), format='%Y%m%d').to_numpy().astype('i8')
+    data['UpdateTime'] = pd.to_timedelta(data['UpdateTime'].astype(str)).to_numpy().astype('i8')
+
+    float_cols = [col for col in data.columns if 'Price' in col or col == 'Turnover']
+    data[float_cols] = data[float_cols].astype('float64')
+
+    return data
+
+
+def read_mdl21_csv(source, columns=None, use_threads=True):
+    """
+    按声明的schema读取 mdl_21_1_0.csv，只解析需要的列，使用pyarrow多线程解析
+
+    参数:
+    source (str or Path): 本地路径或http地址
+    columns (list): 需要的列，None表示全部列
+    use_threads (bool): 是否多线程解析
+
+    返回:
+    pd.DataFrame: 缓存格式的tick数据，InstruID为按字典序排列类别的categorical
+    """
+    column_types = {col: col_type for col, col_type in MDL21_SCHEMA.items()
+                    if columns is None or col in columns}
+    read_options = pv.ReadOptions(use_threads=use_threads, block_size=16 * 1024 * 1024)
+    convert_options = pv.ConvertOptions(include_columns=columns, column_types=column_types)
+
+    try:
+        if str(source).startswith(('http://', 'https://')):
+            with urlopen(str(source)) as stream:
+                table = pv.read_csv(stream, read_options=read_options, convert_options=convert_options)
+        else:
+            table = pv.read_csv(source, read_options=read_options, convert_options=convert_options)
+    except pa.ArrowInvalid as e:
+        # 文件格式与声明的schema不一致时回退到pandas解析
+        print(f'⚠ 按schema解析 {source} 失败，回退到pandas: {str(e)}')
+        return normalize_ticks(pd.read_csv(source, usecols=columns))
+
+    # 在arrow中转换为缓存格式，避免生成python时间对象
+    if 'TradDay' in table.column_names:
+        trad_day = table['TradDay'].to_numpy()
+        days, inverse = np.unique(trad_day, return_inverse=True)
+        day_ns = pd.to_datetime(days.astype(str), format='%Y%m%d').to_numpy().astype('i8')
+        table = table.set_column(table.column_names.index('TradDay'), 'TradDay', pa.array(day_ns[inverse]))
+    if 'UpdateTime' in table.column_names:
+        table = table.set_column(table.column_names.index('UpdateTime'), 'UpdateTime',
+                                 table['UpdateTime'].cast(pa.int64()))
+
+    data = table.to_pandas()
+    if 'InstruID' in data.columns:
+        data['InstruID'] = data['InstruID'].cat.reorder_categories(
+            sorted(data['InstruID'].cat.categories))
+
+    return data
+
+
+def tick_datetime(data):
+    """
+    由缓存格式的 TradDay 和 UpdateTime 生成时间戳，夜盘行情计为交易日零点之前的时刻
+
+    参数:
+    data (pd.DataFrame): 缓存格式的tick数据
+
+    返回:
+    pd.DatetimeIndex: 每个tick的时间戳
+    """
+    return pd.DatetimeIndex(data['TradDay'].to_numpy() + session_time_ns(data['UpdateTime'].to_numpy()))
+
+
+# %%
+class TickStore:
+    """
+    tick数据本地列式缓存
+
+    参数:
+    data_base_path (str): 原始数据基础路径，如'http://172.16.30.3/future-data/tonglian-data/msg_backup'
+    cache_dir (Path or None): 本地缓存目录，None表示不落地缓存，每次直接解析原始csv
+    compression (str): parquet压缩算法
+    row_group_size (int): 每个row group的行数，越小单合约读取越精确，压缩率略低
+    staging_dir (Path or None): 预下载原始csv的暂存目录（见TickPrefetcher），存在暂存文件时优先读取
+    check_source (bool): 是否检查原始文件是否变化，为True时已有的缓存文件在原始文件变化后重新转换，
+                         每个日期多一次HEAD请求（本地原始文件为一次stat）
+    timeout (float): HEAD请求超时(秒)
+    """
+
+    def __init__(self, data_base_path, cache_dir=None, compression='zstd', row_group_size=65536,
+                 staging_dir=None, check_source=False, timeout=30):
+        self.data_base_path = data_base_path
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.staging_dir = Path(staging_dir) if staging_dir is not None else None
+        self.check_source = check_source
+        self.timeout = timeout
+        self._source_fingerprints = {}
+
+    def raw_path(self, date):
+        return f'{self.data_base_path}/{date}/{TICK_FILE_NAME}'
+
+    def tick_path(self, date):
+        return self.cache_dir / f'{date}.parquet'
+
+    def staged_path(self, date):
+        return self.staging_dir / f'{date}_{TICK_FILE_NAME}'
+
+    def is_remote(self):
+        return str(self.data_base_path).startswith(('http://', 'https://'))
+
+    def read_raw(self, date, columns=None):
+        """
+        读取并解析原始csv，返回缓存格式的DataFrame（包含InstruID时已按InstruID排序）
+
+        参数:
+        columns (list): 只解析需要的列，None表示全部列
+        """
+        raw_path = self.raw_path(date)
+        if self.staging_dir is not None and self.staged_path(date).exists():
+            raw_path = self.staged_path(date)
+        data = read_mdl21_csv(raw_path, columns=columns)
+        if 'InstruID' in data.columns:
+            data = data.sort_values('InstruID', kind='stable').reset_index(drop=True)
+        return data
+
+    def source_fingerprint(self, date):
+        """
+        原始文件指纹：HTTP上为HEAD返回的 'Content-Length-Last-Modified'，本地为 'size-mtime_ns'，
+        取不到时返回None；同一实例内每个日期只请求一次
+        """
+        if date in self._source_fingerprints:
+            return self._source_fingerprints[date]
+
+        fingerprint = None
+        if self.is_remote():
+            try:
+                with urlopen(Request(self.raw_path(date), method='HEAD'), timeout=self.timeout) as response:
+                    length = response.headers.get('Content-Length')
+                    last_modified = response.headers.get('Last-Modified')
+                if length is not None or last_modified is not None:
+                    fingerprint = f'{length}-{last_modified}'
+            except (URLError, OSError, http.client.HTTPException):
+                pass
+        else:
+            try:
+                stat = os.stat(self.raw_path(date))
+                fingerprint = f'{stat.st_size}-{stat.st_mtime_ns}'
+            except OSError:
+                pass
+
+        self._source_fingerprints[date] = fingerprint
+        return fingerprint
+
+    def is_stale(self, date):
+        """
+        缓存文件是否落后于原始文件：转换时记录的原始文件指纹与当前不同（旧版本缓存文件没有记录，视为落后）；
+        原始文件指纹取不到时不判为落后
+        """
+        current = self.source_fingerprint(date)
+        if current is None:
+            return False
+        metadata = pq.read_schema(self.tick_path(date)).metadata or {}
+        return metadata.get(SOURCE_FINGERPRINT_KEY, b'').decode() != current
+
+    def ensure(self, date):
+        """
+        确保某日的缓存文件存在，不存在（check_source=True时还包括原始文件已变化）则从原始csv转换，返回缓存文件路径
+        """
+        path = self.tick_path(date)
+        if path.exists() and not (self.check_source and self.is_stale(date)):
+            return path
+
+        source_fingerprint = self.source_fingerprint(date)
+
+        data = self.read_raw(date)
+        table = pa.Table.from_pandas(data, preserve_index=False)
+
+        # 合约行范围索引 {InstruID: [start, end)}，数据已按InstruID排序
+        instru_values, starts = np.unique(data['InstruID'].to_numpy(), return_index=True)
+        order = np.argsort(starts)
+        instru_values, starts = instru_values[order], starts[order]
+        ends = np.append(starts[1:], len(data))
+        instru_index = {instru: [int(start), int(end)]
+                        for instru, start, end in zip(instru_values, starts, ends)}
+        metadata = dict(table.schema.metadata or {})
+        metadata[INSTRU_INDEX_KEY] = json.dumps(instru_index).encode()
+        if source_fingerprint is not None:
+            metadata[SOURCE_FINGERPRINT_KEY] = source_fingerprint.encode()
+        table = table.replace_schema_metadata(metadata)
+
+        # 先写临时文件再重命名，避免并发任务读到写了一半的文件
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        pq.write_table(table, tmp_path, compression=self.compression, row_group_size=self.row_group_size)
+        os.replace(tmp_path, path)
+
+        return path
+
+    def fingerprint(self, date):
+        """
+        输入文件指纹，用于判断下游结果缓存是否失效
+        有本地缓存时取缓存文件的 'size-mtime_ns'（check_source=True且原始文件已变化时为None），
+        否则取原始文件的指纹（见source_fingerprint）；取不到时返回None，下游视为需要重算
+        """
+        if self.cache_dir is None:
+            return self.source_fingerprint(date)
+
+        path = self.tick_path(date)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        if self.check_source and self.is_stale(date):
+            return None
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def fingerprints(self, dates):
+        """
+        批量获取输入文件指纹，有本地缓存时只列一次缓存目录，check_source=True时另检查每个日期的原始文件
+        """
+        if self.cache_dir is None:
+            return {date: self.fingerprint(date) for date in dates}
+
+        stats = {}
+        if self.cache_dir.exists():
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.parquet') and not entry.name.startswith('.'):
+                        stat = entry.stat()
+                        stats[entry.name[:-len('.parquet')]] = f'{stat.st_size}-{stat.st_mtime_ns}'
+        fingerprints = {date: stats.get(date) for date in dates}
+        if self.check_source:
+            for date, fingerprint in fingerprints.items():
+                if fingerprint is not None and self.is_stale(date):
+                    fingerprints[date] = None
+        return fingerprints
+
+    def input_sizes(self, dates):
+        """
+        批量获取输入文件大小（字节），用于估计任务耗时
+        有本地缓存文件时取缓存文件，否则取本地原始文件；原始文件在HTTP上且没有缓存时为None
+        """
+        cached_sizes = {}
+        if self.cache_dir is not None and self.cache_dir.exists():
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.parquet') and not entry.name.startswith('.'):
+                        cached_sizes[entry.name[:-len('.parquet')]] = entry.stat().st_size
+
+        sizes = {}
+        for date in dates:
+            size = cached_sizes.get(date)
+            if size is None and not self.is_remote():
+                try:
+                    size = os.path.getsize(self.raw_path(date))
+                except OSError:
+                    size = None
+            sizes[date] = size
+        return sizes
+
+    def instrument_index(self, date):
+        """
+        读取某日缓存文件中的合约行范围索引
+
+        返回:
+        dict: {InstruID: [start, end)}，旧版本缓存文件没有索引时返回None
+        """
+        metadata = pq.read_schema(self.ensure(date)).metadata or {}
+        if INSTRU_INDEX_KEY not in metadata:
+            return None
+        return json.loads(metadata[INSTRU_INDEX_KEY])
+
+    def _read_rows(self, path, ranges, columns):
+        """
+        只读取覆盖给定行范围的row group，再从中取出对应的行
+        """
+        parquet_file = pq.ParquetFile(path)
+        rg_rows = np.array([parquet_file.metadata.row_group(i).num_rows
+                            for i in range(parquet_file.num_row_groups)], dtype='i8')
+        rg_ends = np.cumsum(rg_rows)
+        rg_starts = rg_ends - rg_rows
+
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges] + [np.empty(0, dtype='i8')])
+        rg_of_row = np.searchsorted(rg_ends, rows, side='right')
+        row_groups = np.unique(rg_of_row)
+
+        # 被读取的row group在结果表中的起始位置
+        read_offsets = np.zeros(parquet_file.num_row_groups, dtype='i8')
+        read_offsets[row_groups] = np.cumsum(rg_rows[row_groups]) - rg_rows[row_groups]
+
+        table = parquet_file.read_row_groups(row_groups.tolist(), columns=columns)
+        positions = rows - rg_starts[rg_of_row] + read_offsets[rg_of_row]
+        return table.take(pa.array(positions)).to_pandas()
+
+    def load_ticks(self, date, instru_id=None, columns=None):
+        """
+        读取某日的tick数据
+
+        参数:
+        date (str): 日期，格式为'YYYYMMDD'
+        instru_id (str or list): 合约代码，None表示读取全部合约
+        columns (list): 需要的列，None表示全部列
+
+        返回:
+        pd.DataFrame: 缓存格式的tick数据
+        """
+        instru_ids = [instru_id] if isinstance(instru_id, str) else instru_id
+
+        if self.cache_dir is None:
+            read_columns = columns
+            if columns is not None and instru_ids is not None and 'InstruID' not in columns:
+                read_columns = ['InstruID'] + list(columns)
+            data = self.read_raw(date, columns=read_columns)
+            if instru_ids is not None:
+                data = data[data['InstruID'].isin(instru_ids)].reset_index(drop=True)
+            if columns is not None:
+                data = data[columns]
+            return data
+
+        path = self.ensure(date)
+        if instru_ids is None:
+            return pd.read_parquet(path, columns=columns)
+
+        instru_index = self.instrument_index(date)
+        if instru_index is None:
+            return pd.read_parquet(path, columns=columns, filters=[('InstruID', 'in', instru_ids)])
+
+        ranges = sorted(instru_index[instru] for instru in set(instru_ids) if instru in instru_index)
+        return self._read_rows(path, ranges, columns)
+
+
+# %% 原始数据预下载
+class TickPrefetcher:
+    """
+    用线程池按顺序预下载后续日期的原始csv到暂存目录，计算进程直接读取本地暂存文件，
+    使网络传输与计算重叠。每个下载线程复用一个keep-alive的HTTP连接。
+
+    暂存文件总大小受byte_budget限制：每个下载开始前按提交顺序、按估计大小（HEAD的Content-Length，
+    取不到时为上一个文件的大小）预留预算，已暂存和预留的字节数加上本文件超出预算时等待release释放，
+    下载完成后按实际大小修正；暂存为空时总允许下载，保证单个文件超出预算时也能继续。
+
+    参数:
+    tick_store (TickStore): 需设置staging_dir，且data_base_path为http(s)地址
+    max_workers (int): 下载线程数
+    byte_budget (int): 暂存文件的字节预算
+    timeout (float): HTTP连接超时(秒)
+    """
+
+    def __init__(self, tick_store, max_workers=4, byte_budget=4 * 1024 ** 3, timeout=300):
+        self.tick_store = tick_store
+        self.max_workers = max_workers
+        self.byte_budget = byte_budget
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._staged_bytes = {}
+        self._last_size = 0
+        self._pending = deque()
+        self._local = threading.local()
+        self._executor = None
+        self._futures = {}
+        self._closed = False
+
+    @property
+    def used_bytes(self):
+        with self._cond:
+            return sum(self._staged_bytes.values())
+
+    def start(self, dates):
+        """
+        按给定顺序开始预下载，已有本地tick缓存的日期跳过
+        """
+        self.tick_store.staging_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tick_prefetch')
+        for date in dict.fromkeys(dates):
+            if self.tick_store.cache_dir is not None and self.tick_store.tick_path(date).exists():
+                continue
+            with self._cond:
+                self._pending.append(date)
+            self._futures[date] = self._executor.submit(self._download, date)
+
+    def _connection(self, netloc, scheme):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = conn_class(netloc, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, url):
+        parts = urlsplit(url)
+        # 连接可能已被服务端关闭，失败时重建一次
+        for attempt in range(2):
+            conn = self._connection(parts.netloc, parts.scheme)
+            try:
+                conn.request(method, parts.path)
+                return conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+
+    def _estimate_size(self, date):
+        """
+        下载前估计文件大小：优先取HEAD返回的Content-Length，取不到时取上一个下载完成的文件大小
+        """
+        try:
+            response = self._request('HEAD', self.tick_store.raw_path(date))
+            response.read()
+            if response.status == 200 and response.getheader('Content-Length'):
+                return int(response.getheader('Content-Length'))
+        except (http.client.HTTPException, OSError, ValueError):
+            pass
+        with self._cond:
+            return self._last_size
+
+    def _download(self, date):
+        # 按估计大小预留字节预算，超出预算时等待；下载完成后按实际大小修正
+        # 预留按提交顺序进行，避免靠后的日期占满预算而计算任务等待的日期无法下载
+        estimate = self._estimate_size(date)
+        with self._cond:
+            while not self._closed and (
+                    self._pending[0] != date
+                    or (self._staged_bytes and sum(self._staged_bytes.values()) + estimate > self.byte_budget)):
+                self._cond.wait()
+            if self._closed:
+                return None
+            self._pending.popleft()
+            self._staged_bytes[date] = estimate
+            self._cond.notify_all()
+
+        staged_path = self.tick_store.staged_path(date)
+        tmp_path = staged_path.with_name(f'.{staged_path.name}.tmp')
+        try:
+            response = self._request('GET', self.tick_store.raw_path(date))
+            if response.status != 200:
+                response.read()
+                raise IOError(f'HTTP {response.status}: {self.tick_store.raw_path(date)}')
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(response, f, length=1024 * 1024)
+            os.replace(tmp_path, staged_path)
+        except Exception:
+            self.release(date)
+            raise
+
+        size = staged_path.stat().st_size
+        with self._cond:
+            if date in self._staged_bytes:
+                self._staged_bytes[date] = size
+            self._last_size = size
+            self._cond.notify_all()
+        return staged_path
+
+    def wait(self, date):
+        """
+        等待某日下载完成；下载失败时不抛出异常，由计算任务回退到直接读取原始地址并报告错误
+        """
+        future = self._futures.get(date)
+        if future is None:
+            return
+        try:
+            future.result()
+        except Exception as e:
+            print(f'预下载 {date} 失败: {str(e)}')
+
+    def release(self, date):
+        """
+        计算完成后删除暂存文件并释放字节预算
+        """
+        try:
+            self.tick_store.staged_path(date).unlink()
+        except FileNotFoundError:
+            pass
+        with self._cond:
+            self._staged_bytes.pop(date, None)
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        停止预下载并清理所有暂存文件
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        for date in list(self._futures):
+            self.release(date)
+
+
+# %% 主函数：批量转换缓存
+if __name__ == '__main__':
+    from tqdm import tqdm
+
+    data_base_path = 'http://172.16.30.3/future-data/tonglian-data/msg_backup'
+    cache_dir = Path('/mnt/Data/xintang/future_data/tick_cache')
+    zhuli_dir = Path('/mnt/nfs/30.132_xt_data1/future_zhuli')
+
+    from utils.products import available_products
+
+    tick_store = TickStore(data_base_path, cache_dir=cache_dir)
+    dates = set()
+    for product in available_products(zhuli_dir):
+        dates.update(pd.read_parquet(zhuli_dir / f'{product}.parquet')['date'].astype(str).unique())
+
+    for date in tqdm(sorted(dates), desc='转换tick缓存'):
+        try:
+            tick_store.ensure(date)
+        except Exception as e:
+            print(f'转换 {date} 失败: {str(e)}')
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jul 11 2025
+
+@author: Xintang Zheng
+
+tick级别计算内核
+在连续的numpy数组上完成逐tick计算，有numba时使用编译版本，否则使用向量化numpy版本
+
+星星: ★ ☆ ✪ ✩ 🌟 ⭐ ✨ 🌠 💫 ⭐️
+勾勾叉叉: ✓ ✔ ✕ ✖ ✅ ❎
+报警啦: ⚠ ⓘ ℹ ☣
+箭头: ➔ ➜ ➙ ➤ ➥ ↩ ↪
+emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵 🎶 🧭 📅 🤔 🧮 🔢 📊 📈 📉 🧠 📝
+
+"""
+# %% imports
+import numpy as np
+
+from utils.timeutils import session_time_ns
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# %%
+# 主买主卖计算逻辑的版本号，逻辑变化时修改，使旧的结果缓存失效
+TRADE_FLOW_VERSION = '4'
+
+
+# %% 主买主卖方向判断
+def _classify_trade_direction_numpy(cum_turnover, cum_volume, bid1, ask1, multiplier):
+    """
+    向量化numpy版本，延续上一tick方向通过前向填充实现
+    """
+    n = len(cum_turnover)
+    turnover = np.empty(n)
+    volume = np.empty(n)
+    midprice_diff = np.empty(n)
+    if n == 0:
+        return np.empty(0, dtype=np.int8), np.empty(0), np.empty(0)
+
+    turnover[0] = volume[0] = midprice_diff[0] = np.nan
+    np.subtract(cum_turnover[1:], cum_turnover[:-1], out=turnover[1:])
+    np.subtract(cum_volume[1:], cum_volume[:-1], out=volume[1:])
+    midprice = (bid1 + ask1) / 2
+    np.subtract(midprice[1:], midprice[:-1], out=midprice_diff[1:])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vwap = turnover / volume / multiplier
+
+    # 第一优先级：midprice变化方向；第二优先级：midprice不变时，比较vwap和midprice
+    unchanged = ~(midprice_diff > 0) & ~(midprice_diff < 0)
+    direction = np.sign(np.where(unchanged, vwap - midprice, midprice_diff))
+    direction = np.nan_to_num(direction).astype(np.int8)
+
+    # 第三优先级：vwap == midprice时，延续上一个确定的方向
+    carry = unchanged & (vwap == midprice)
+    source = np.where(carry, -1, np.arange(n))
+    source = np.maximum.accumulate(source)
+    direction = np.where(source >= 0, direction[np.maximum(source, 0)], 0).astype(np.int8)
+
+    valid_turnover = np.nan_to_num(turnover)
+    act_buy_amount = np.where(direction == 1, valid_turnover, 0.0)
+    act_sell_amount = np.where(direction == -1, valid_turnover, 0.0)
+
+    return direction, act_buy_amount, act_sell_amount
+
+
+def _classify_trade_direction_loop(cum_turnover, cum_volume, bid1, ask1, multiplier):
+    """
+    单次O(n)循环版本，供numba编译（error_model='numpy'，除零得到inf/nan，与向量化版本一致）
+    """
+    n = len(cum_turnover)
+    direction = np.zeros(n, dtype=np.int8)
+    act_buy_amount = np.zeros(n)
+    act_sell_amount = np.zeros(n)
+
+    prev_direction = 0
+    for i in range(n):
+        midprice = (bid1[i] + ask1[i]) / 2
+        if i == 0:
+            turnover = np.nan
+            vwap = np.nan
+            midprice_diff = np.nan
+        else:
+            turnover = cum_turnover[i] - cum_turnover[i - 1]
+            volume = cum_volume[i] - cum_volume[i - 1]
+            vwap = turnover / volume / multiplier
+            midprice_diff = midprice - (bid1[i - 1] + ask1[i - 1]) / 2
+
+        if midprice_diff > 0:
+            curr_direction = 1
+        elif midprice_diff < 0:
+            curr_direction = -1
+        elif vwap > midprice:
+            curr_direction = 1
+        elif vwap < midprice:
+            curr_direction = -1
+        elif vwap == midprice:
+            curr_direction = prev_direction
+        else:
+            curr_direction = 0
+
+        direction[i] = curr_direction
+        prev_direction = curr_direction
+        if turnover == turnover:
+            if curr_direction == 1:
+                act_buy_amount[i] = turnover
+            elif curr_direction == -1:
+                act_sell_amount[i] = turnover
+
+    return direction, act_buy_amount, act_sell_amount
+
+
+if njit is not None:
+    _classify_trade_direction_kernel = njit(cache=True, error_model='numpy')(_classify_trade_direction_loop)
+else:
+    _classify_trade_direction_kernel = _classify_trade_direction_numpy
+
+
+def classify_trade_direction(cum_turnover, cum_volume, bid1, ask1, multiplier):
+    """
+    根据midprice和vwap判断每个tick的主买主卖方向，并计算主买主卖金额
+
+    判断规则:
+        1. midprice上升为主买，下降为主卖
+        2. midprice不变时，vwap > midprice为主买，vwap < midprice为主卖
+        3. midprice不变且vwap == midprice时，延续上一tick的最终方向（可连续延续）
+
+    参数:
+    cum_turnover (np.ndarray): 累计成交额
+    cum_volume (np.ndarray): 累计成交量
+    bid1 (np.ndarray): 买一价
+    ask1 (np.ndarray): 卖一价
+    multiplier (float): 合约乘数，用于由成交额和成交量计算vwap，见 utils.products
+
+    返回:
+    tuple: (direction int8数组, act_buy_amount float64数组, act_sell_amount float64数组)
+           第一个tick没有成交额增量，金额为0
+    """
+    arrays = [np.ascontiguousarray(arr, dtype=np.float64)
+              for arr in (cum_turnover, cum_volume, bid1, ask1)]
+    return _classify_trade_direction_kernel(*arrays, float(multiplier))
+
+
+def warm_up_kernels():
+    """
+    在极小的输入上调用一次计算内核，使numba从磁盘缓存加载（或编译）完成，
+    供常驻worker启动时预热
+    """
+    arr = np.zeros(2)
+    classify_trade_direction(arr, arr, arr, arr, 1.0)
+
+
+# %% 按时间网格聚合
+def grid_bar_ids(day_ns, time_ns, grid, interval_seconds):
+    """
+    用整数运算将tick映射到目标时间网格的bar上（右闭右标签）：
+    tick归入不早于它的第一个网格标签，距该标签不足一个间隔时有效，
+    因此网格标签不必是间隔的整数倍（如按开盘时刻起算的'7min'网格）
+
+    参数:
+    day_ns (np.ndarray): 交易日零点的纳秒时间戳（TickStore缓存格式的TradDay）
+    time_ns (np.ndarray): 当日零点起的纳秒偏移（TickStore缓存格式的UpdateTime）
+    grid (np.ndarray): 目标时间网格（datetime64），需升序，如get_a_share_intraday_time_series的结果
+    interval_seconds (int): bar间隔秒数
+
+    返回:
+    tuple: (bar_ids, in_grid)，in_grid为落在网格内的tick掩码，bar_ids为这些tick所在bar的位置
+    """
+    grid_ns = np.asarray(grid).astype('datetime64[ns]').view('i8')
+    n_bars = len(grid_ns)
+
+    # 夜盘时刻按交易日零点计为负偏移
+    interval_ns = np.int64(interval_seconds) * 1_000_000_000
+    tick_ns = np.asarray(day_ns, dtype=np.int64) + session_time_ns(time_ns)
+
+    # 右闭右标签：bar (标签 - 间隔, 标签] 内的tick归入该标签
+    bar_ids = np.searchsorted(grid_ns, tick_ns, side='left')
+    in_grid = bar_ids < n_bars
+    in_grid[in_grid] = grid_ns[bar_ids[in_grid]] - tick_ns[in_grid] < interval_ns
+    return bar_ids[in_grid], in_grid
+
+
+def reduce_bars(bar_ids, values, n_bars, how='sum'):
+    """
+    按bar位置对tick值做归约，NaN值不参与归约
+
+    参数:
+    bar_ids (np.ndarray): 每个tick所在bar的位置，grid_bar_ids的结果
+    values (np.ndarray): 与bar_ids等长的tick值
+    n_bars (int): bar数量
+    how (str): 'sum'、'count'、'mean'、'last'、'max' 或 'min'
+
+    返回:
+    np.ndarray: 长度为n_bars的float64数组，没有tick的bar在sum/count下为0，其余为NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if how == 'sum':
+        # 没有tick时bincount返回int64，统一转为float64
+        return np.bincount(bar_ids, weights=np.where(valid, values, 0.0),
+                           minlength=n_bars).astype(np.float64, copy=False)
+
+    bar_ids, values = bar_ids[valid], values[valid]
+    count = np.bincount(bar_ids, minlength=n_bars).astype(np.float64)
+    if how == 'count':
+        return count
+
+    output = np.full(n_bars, np.nan)
+    has_tick = count > 0
+    if how == 'mean':
+        output[has_tick] = np.bincount(bar_ids, weights=values, minlength=n_bars)[has_tick] / count[has_tick]
+    elif how == 'last':
+        # 每个bar中位置最靠后的tick
+        last_pos = np.full(n_bars, -1, dtype=np.int64)
+        np.maximum.at(last_pos, bar_ids, np.arange(len(bar_ids)))
+        output[has_tick] = values[last_pos[has_tick]]
+    elif how in ('max', 'min'):
+        ufunc = np.maximum if how == 'max' else np.minimum
+        extreme = np.full(n_bars, -np.inf if how == 'max' else np.inf)
+        ufunc.at(extreme, bar_ids, values)
+        output[has_tick] = extreme[has_tick]
+    else:
+        raise ValueError(f'不支持的归约方式: {how}')
+    return output
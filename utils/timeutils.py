@@ -13,7 +13,9 @@ emoji: 🔔 ⏳ ⏰ 🔒 🔓 🛑 🚫 ❗ ❓ ❌ ⭕ 🚀 🔥 💧 💡 🎵
 """
 # %% imports
 import numpy as np
+import pandas as pd
 from datetime import datetime, timedelta
+from functools import lru_cache
 import re
 
 
@@ -66,50 +68,140 @@ def add_time(time_str, interval_params, minus=False):
     return adjusted_time
         
         
+DEFAULT_TRADING_PERIODS = {
+    'morning': ('09:30:00', '11:30:00'),
+    'afternoon': ('13:00:00', '15:00:00')
+}
+
+# 夜盘开始时刻：此时刻及之后的行情属于下一交易日，按交易日零点计时减去一天
+NIGHT_SESSION_START = '18:00:00'
+_NIGHT_SESSION_START_NS = parse_time_string('18h') * 1_000_000_000
+_ONE_DAY_NS = 24 * 3600 * 1_000_000_000
+
+
+def session_time_ns(time_ns):
+    """
+    将当日零点起的纳秒时刻转换为相对交易日零点的偏移：夜盘时刻减去一天，
+    如 21:05 -> -02:55，跨零点后的 00:30 保持为 +00:30，使一个交易日内的时间连续递增
+    
+    :param time_ns: 当日零点起的纳秒偏移 (TickStore缓存格式的UpdateTime)
+    :return: int64数组
+    """
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    return np.where(time_ns >= _NIGHT_SESSION_START_NS, time_ns - _ONE_DAY_NS, time_ns)
+
+
+@lru_cache(maxsize=None)
+def _intraday_offsets(interval, trading_periods):
+    """
+    计算并缓存单日交易时间序列相对零点的偏移（毫秒）
+    
+    :param interval: 时间间隔 (timedelta)
+    :param trading_periods: 交易时段，((name, (start_time, end_time)), ...) 形式的元组
+    :return: 只读的int64数组
+    """
+    midnight = datetime(1970, 1, 1)
+    night_start = datetime.strptime(f'1970-01-01 {NIGHT_SESSION_START}', '%Y-%m-%d %H:%M:%S')
+    
+    offsets = []
+    for name, (start_time, end_time) in trading_periods:
+        start = datetime.strptime(f'1970-01-01 {start_time}', '%Y-%m-%d %H:%M:%S')
+        end = datetime.strptime(f'1970-01-01 {end_time}', '%Y-%m-%d %H:%M:%S')
+        # 跨零点的时段（如夜盘 21:00 - 02:30）收盘在次日
+        if end < start:
+            end += timedelta(days=1)
+        # 夜盘属于下一交易日，相对交易日零点为负偏移
+        if start >= night_start:
+            start -= timedelta(days=1)
+            end -= timedelta(days=1)
+        series = np.arange(start - midnight, end - midnight + interval, interval)
+        offsets.append(series.astype('timedelta64[us]').astype('i8') // 1000)
+    
+    offsets = np.sort(np.concatenate(offsets))
+    offsets.flags.writeable = False
+    return offsets
+
+
+def get_intraday_offsets(interval_params, trading_periods=None):
+    """
+    获取单日交易时间序列相对当日零点的偏移，按 (interval, trading_periods) 缓存。
+    
+    :param interval_params: 时间间隔参数 (字典形式，如 {'seconds': 1} 或 {'minutes': 1})
+    :param trading_periods: 交易时段参数，同 get_a_share_intraday_time_series
+    :return: 只读的int64数组 (毫秒)
+    """
+    trading_periods = trading_periods or DEFAULT_TRADING_PERIODS
+    return _intraday_offsets(timedelta(**interval_params), tuple(trading_periods.items()))
+
+
 def get_a_share_intraday_time_series(date: datetime, interval_params, trading_periods=None):
     """
     生成A股市场交易时间内的等间隔时间序列。
     
     :param date: 日期 (datetime对象)
     :param interval_params: 时间间隔参数 (字典形式，如 {'seconds': 1} 或 {'minutes': 1})
-    :param trading_periods: 交易时段参数 (字典形式，包含 'morning' 和 'afternoon' 键，每个键的值为 (start_time, end_time))
+    :param trading_periods: 交易时段参数 (字典形式，每个键的值为 (start_time, end_time))
         默认为 A 股市场常见的交易时段，支持精确到秒:
             'morning': ('09:30:00', '11:30:00')
             'afternoon': ('13:00:00', '15:00:00')
+        可包含任意多个时段，夜盘（开始时刻不早于 NIGHT_SESSION_START）计入下一交易日，
+        收盘早于开盘的时段视为跨零点，如 'night': ('21:00:00', '02:30:00')；
+        期货品种的时段见 utils.products.product_keep_periods
     :return: numpy数组，包含当天交易时间内的时间戳序列 (毫秒级)
     """
-    # 设置默认的交易时段
-    default_trading_periods = {
-        'morning': ('09:30:00', '11:30:00'),
-        'afternoon': ('13:00:00', '15:00:00')
-    }
+    # 单日偏移模板只计算一次，之后每天只需加上当日零点
+    offsets = get_intraday_offsets(interval_params, trading_periods)
+    day_start = np.datetime64(date.strftime('%Y-%m-%d'), 'ms').astype('i8')
     
-    # 使用用户提供的交易时段，如果未提供则使用默认值
-    trading_periods = trading_periods or default_trading_periods
-
-    # 自动化计算交易时段的开始和结束时间，支持到秒
-    morning_start_str = trading_periods['morning'][0]
-    morning_end_str = trading_periods['morning'][1]
-    afternoon_start_str = trading_periods['afternoon'][0]
-    afternoon_end_str = trading_periods['afternoon'][1]
+    time_series = (day_start + offsets).view('datetime64[ms]')
     
-    # 将时间字符串转换为 datetime 对象
-    morning_start = datetime.strptime(f"{date.strftime('%Y-%m-%d')} {morning_start_str}", '%Y-%m-%d %H:%M:%S')
-    morning_end = datetime.strptime(f"{date.strftime('%Y-%m-%d')} {morning_end_str}", '%Y-%m-%d %H:%M:%S')
-    afternoon_start = datetime.strptime(f"{date.strftime('%Y-%m-%d')} {afternoon_start_str}", '%Y-%m-%d %H:%M:%S')
-    afternoon_end = datetime.strptime(f"{date.strftime('%Y-%m-%d')} {afternoon_end_str}", '%Y-%m-%d %H:%M:%S')
+    return time_series
 
-    interval = timedelta(**interval_params)
+
+def grid_for_dates(dates, interval_params, trading_periods=None):
+    """
+    生成多个交易日的完整时间索引，通过日期零点与单日偏移模板的广播相加得到。
+    
+    :param dates: 日期序列，元素为 'YYYYMMDD' 字符串/整数或 datetime 对象，重复日期只保留一次
+    :param interval_params: 时间间隔参数 (字典形式，如 {'seconds': 1} 或 {'minutes': 1})
+    :param trading_periods: 交易时段参数，同 get_a_share_intraday_time_series
+    :return: pd.DatetimeIndex，按时间升序
+    """
+    offsets = get_intraday_offsets(interval_params, trading_periods)
     
-    # 生成上午交易时间序列
-    morning_series = (np.arange(morning_start, morning_end + interval, 
-                               interval).astype('i8') // 1e3).astype('i8')
+    dates = pd.Index(list(dates))
+    if dates.inferred_type in ('string', 'integer', 'mixed-integer'):
+        day_starts = pd.to_datetime(dates.astype(str), format='%Y%m%d')
+    else:
+        day_starts = pd.to_datetime(dates).normalize()
+    day_starts = np.unique(day_starts.to_numpy().astype('datetime64[ms]').astype('i8'))
     
-    # 生成下午交易时间序列
-    afternoon_series = (np.arange(afternoon_start, afternoon_end + interval, 
-                                 interval).astype('i8') // 1e3).astype('i8')
+    grid = (day_starts[:, None] + offsets[None, :]).ravel()
+    
+    return pd.DatetimeIndex(grid.view('datetime64[ms]').astype('datetime64[ns]'))
+
 
-    # 合并上午和下午时间序列
-    time_series = np.concatenate([morning_series, afternoon_series]).view('datetime64[ms]')
+def trading_day_numbers(index):
+    """
+    每个时间戳所属交易日的编号（自1970-01-01起的天数）：夜盘（不早于 NIGHT_SESSION_START）计入下一交易日
     
-    return time_series
\ No newline at end of file
+    :param index: pd.DatetimeIndex 或 datetime64 数组
+    :return: int64数组
+    """
+    stamps = np.asarray(index, dtype='datetime64[ns]').astype(np.int64)
+    return (stamps + (_ONE_DAY_NS - _NIGHT_SESSION_START_NS)) // _ONE_DAY_NS
+
+
+def trading_day_row_offsets(index):
+    """
+    按交易日切分升序的时间索引：夜盘（不早于 NIGHT_SESSION_START）的时间戳计入下一交易日，
+    每个交易日的行在索引中连续。
+    
+    :param index: 升序的 pd.DatetimeIndex，如 grid_for_dates 的结果
+    :return: dict，'YYYYMMDD' -> (起始行, 结束行)，结束行不包含
+    """
+    days = trading_day_numbers(index)
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.array([], dtype=np.int64)
+    stops = np.r_[starts[1:], len(days)].astype(np.int64)
+    labels = pd.to_datetime(days[starts] * _ONE_DAY_NS).strftime('%Y%m%d')
+    return {label: (int(start), int(stop)) for label, start, stop in zip(labels, starts, stops)}